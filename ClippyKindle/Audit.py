@@ -0,0 +1,86 @@
+# reads back a random sample of the removed duplicates recorded by clippy.py --dedup-audit
+import sys
+import json
+import random
+import argparse
+
+class DedupAudit:
+    """
+    Streams a record of each duplicate removed by Book.sort() to a JSONL file (one json object per line)
+    as it's removed (so records are never kept in memory), so false positives can be spot-checked later.
+    """
+    def __init__(self, fname):
+        """
+        Opens (overwriting) the provided audit file for writing.
+
+        Args:
+            fname (str): file path of audit file to write (e.g. "dedup-audit.jsonl")
+        """
+        self.fname = fname
+        self.numRecords = 0
+        self.f = open(fname, 'w')
+
+    def record(self, bookName, kept, removed, reason, similarity):
+        """
+        writes a record of a removed duplicate to the audit file
+
+        Args:
+            bookName (str): name of the book the items belong to
+            kept (Highlight, Note, or Bookmark): item that was preserved
+            removed (Highlight, Note, or Bookmark): item that was removed (as a duplicate of kept)
+            reason (str): why the items were considered duplicates (e.g. "substring")
+            similarity (float): fraction of the removed item's content shared with the kept item
+        """
+        self.f.write(json.dumps({"book": bookName, "kept": kept.toDict(), "removed": removed.toDict(),
+            "reason": reason, "similarity": similarity}) + "\n")
+        self.numRecords += 1
+
+    def close(self):
+        """
+        closes the audit file
+        """
+        self.f.close()
+
+def sampleAudit(fname, num, seed=None):
+    """
+    reads a uniformly random sample of records from an audit file (created with DedupAudit)
+    using reservoir sampling, so only the sampled records are ever kept in memory
+
+    Args:
+        fname (str): file path of audit file to read
+        num (int): number of records to sample
+        seed (int): Optional; seed for the random number generator (for reproducible samples)
+    Returns:
+        (list of dict): sampled records (in the order they appear in the file)
+    """
+    rng = random.Random(seed)
+    reservoir = [] # list of (line index, line) tuples
+    with open(fname) as f:
+        for index, line in enumerate(f):
+            if index < num:
+                reservoir.append((index, line))
+            else:
+                j = rng.randint(0, index)
+                if j < num:
+                    reservoir[j] = (index, line)
+    reservoir.sort()
+    return [json.loads(line) for _, line in reservoir]
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Prints a random sample of the removed duplicates recorded in an audit file created by clippy.py --dedup-audit.')
+    parser.add_argument('audit_file', type=str, help='(string) path to audit file (e.g. "./dedup-audit.jsonl")')
+    parser.add_argument('--num', type=int, default=10, help='(int) number of records to sample (default: 10)')
+    parser.add_argument('--seed', type=int, default=None, help='(int) optional seed for reproducible samples')
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+
+    for record in sampleAudit(args.audit_file, args.num, args.seed):
+        print("book: '{}' ({}, similarity {})".format(record["book"], record["reason"], record["similarity"]))
+        print("  kept:    [{} {}] {}".format(record["kept"]["locType"], record["kept"]["loc"], record["kept"].get("content", "")))
+        print("  removed: [{} {}] {}\n".format(record["removed"]["locType"], record["removed"]["loc"], record["removed"].get("content", "")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import sys
+import argparse
+import json
+import time
+# NOTE: the modules gzip, bz2 and lzma are only imported when a file using them is opened
+
+# supported compression formats: name -> (magic bytes at the start of a file, file extension, default compression level)
+COMPRESSIONS = {
+    "gzip": (b"\x1f\x8b", ".gz", 6),
+    "bz2": (b"BZh", ".bz2", 9),
+    "xz": (b"\xfd7zXZ\x00", ".xz", 6),
+}
+MAGIC_SIZE = max(len(magic) for magic, _, _ in COMPRESSIONS.values()) # number of bytes needed to detect a format
+
+def getCompressionFromExt(fname):
+    """
+    Returns:
+        (str): name of compression format the provided file name's extension refers to (e.g. "collection.json.gz" -> "gzip"),
+            or None if it isn't compressed
+    """
+    for name, (_, ext, _) in COMPRESSIONS.items():
+        if fname.lower().endswith(ext):
+            return name
+    return None
+
+def stripCompressionExt(fname):
+    """
+    Returns:
+        (str): provided file name without its compression extension if any (e.g. "collection.json.gz" -> "collection.json")
+    """
+    compression = getCompressionFromExt(fname)
+    return fname if compression == None else fname[:-len(COMPRESSIONS[compression][1])]
+
+def detectCompression(fname):
+    """
+    detects whether a file is compressed from its first few bytes (or its extension if it's empty or doesn't exist yet)
+
+    Returns:
+        (str): name of compression format of the file (see COMPRESSIONS), or None if it isn't compressed
+    """
+    if os.path.isfile(fname):
+        with open(fname, 'rb') as f:
+            head = f.read(MAGIC_SIZE)
+        if len(head) != 0:
+            return next((name for name, (magic, _, _) in COMPRESSIONS.items() if head.startswith(magic)), None)
+    return getCompressionFromExt(fname)
+
+def openFile(fname, mode='r', compression=None, level=None):
+    """
+    opens a file, transparently (de)compressing it if needed, so it can be streamed without a temporary file.
+    Files being read are decompressed according to their contents (see detectCompression()),
+    and files being written are compressed according to their extension (e.g. "collection.json.gz") unless
+    compression is provided.
+
+    Args:
+        fname (str): file path
+        mode (str): Optional; 'r', 'w', 'rb' or 'wb' (as for the builtin open())
+        compression (str): Optional; compression format of a file being written (see COMPRESSIONS),
+            "none" writes it uncompressed whatever its extension
+        level (int): Optional; compression level of a file being written (default: see COMPRESSIONS)
+    Returns:
+        (file object): the opened file
+    """
+    if 'r' in mode:
+        compression = detectCompression(fname)
+    elif compression == None:
+        compression = getCompressionFromExt(fname)
+    if compression in [None, "none"]:
+        return open(fname, mode)
+    if compression not in COMPRESSIONS:
+        raise ValueError("unknown compression format '{}' (expected one of {})".format(compression, list(COMPRESSIONS)))
+    level = COMPRESSIONS[compression][2] if level == None else level
+    mode = mode if 'b' in mode else mode + 't'
+    if compression == "gzip":
+        import gzip
+        return gzip.open(fname, mode, compresslevel=level) if 'w' in mode else gzip.open(fname, mode)
+    if compression == "bz2":
+        import bz2
+        return bz2.open(fname, mode, compresslevel=level) if 'w' in mode else bz2.open(fname, mode)
+    import lzma
+    return lzma.open(fname, mode, preset=level) if 'w' in mode else lzma.open(fname, mode)
+
+def readDecompressed(fname):
+    """
+    Returns:
+        (bytes): contents of the provided file decompressed, or None if it isn't compressed (so can be read directly)
+    """
+    if detectCompression(fname) == None:
+        return None
+    with openFile(fname, 'rb') as f:
+        return f.read()
+
+def decompressToFile(fname, folder):
+    """
+    decompresses a file into a new temporary file in the provided folder, streaming it so it's never held in memory
+    (unlike readDecompressed())
+
+    Returns:
+        (str): path of the decompressed file (which the caller must delete), or None if the file isn't compressed
+            (so can be read directly)
+    """
+    if detectCompression(fname) == None:
+        return None
+    import shutil
+    import tempfile
+    fd, path = tempfile.mkstemp(prefix="decompressed-", suffix=".txt", dir=folder)
+    with openFile(fname, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return path
+
+def benchmark(collectionPath, formats, repeat=1):
+    """
+    measures the time taken to write and read a collection in each of the provided compression formats
+    (in a temporary folder), so the CPU time spent (de)compressing can be weighed against the I/O time saved
+
+    Args:
+        collectionPath (str): path of (possibly compressed) collection json file created by clippy.py
+        formats (list of tuples): (str compression format (or "none"), int level or None) to measure
+        repeat (int): Optional; number of times to repeat each measurement (the fastest is kept)
+    Returns:
+        (list of dicts): measurements of each format: "format", "size" (bytes), and wall/cpu seconds of
+            "writeWall", "writeCpu", "readWall" and "readCpu"
+    """
+    import tempfile
+    with openFile(collectionPath) as f:
+        data = json.load(f)
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for compression, level in formats:
+            path = os.path.join(folder, "collection.json" + ("" if compression == "none" else COMPRESSIONS[compression][1]))
+            res = {"format": compression if level == None else "{} (level {})".format(compression, level)}
+            for name, func in [("write", lambda: json.dump(data, f, indent=2)), ("read", lambda: json.load(f))]:
+                wall, cpu = float("inf"), float("inf")
+                for _ in range(repeat):
+                    startWall, startCpu = time.perf_counter(), time.process_time()
+                    with openFile(path, name[0], compression, level) as f:
+                        func()
+                    wall, cpu = min(wall, time.perf_counter() - startWall), min(cpu, time.process_time() - startCpu)
+                res[name + "Wall"], res[name + "Cpu"] = wall, cpu
+            res["size"] = os.path.getsize(path)
+            results.append(res)
+    return results
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Benchmarks writing/reading a collection created by clippy.py uncompressed and in each compression format, estimating how long reading it would take from storage of the provided throughputs (compression only pays off when the I/O time saved exceeds the CPU time spent decompressing).')
+    parser.add_argument('collection', type=str, help='(string) path to (possibly compressed) json file created by clippy.py (e.g. "./collection.json")')
+    parser.add_argument('--repeat', type=int, default=3, help='(int) number of times to repeat each measurement, keeping the fastest (default: 3)')
+    parser.add_argument('--throughput', type=float, action="append", default=None, help='(float) storage throughput in MB/s to estimate read times for, can be provided multiple times (default: 10, 100 and 1000 i.e. network share, hard drive and ssd)')
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+    throughputs = args.throughput if args.throughput != None else [10, 100, 1000]
+
+    formats = [("none", None)] + [(name, None) for name in COMPRESSIONS] + [("gzip", 1), ("xz", 1)]
+    results = benchmark(args.collection, formats, args.repeat)
+    from prettytable import PrettyTable
+    table = PrettyTable()
+    table.field_names = (["format", "size (MB)", "ratio", "write wall (s)", "write cpu (s)", "read wall (s)", "read cpu (s)"] +
+        ["est. read @ {:g} MB/s".format(throughput) for throughput in throughputs])
+    for res in results:
+        # (reads were from the page cache, so their time is almost entirely CPU: add the time to transfer the file)
+        table.add_row([res["format"], "{:.2f}".format(res["size"] / 1e6), "{:.1f}x".format(results[0]["size"] / res["size"]),
+            "{:.3f}".format(res["writeWall"]), "{:.3f}".format(res["writeCpu"]), "{:.3f}".format(res["readWall"]), "{:.3f}".format(res["readCpu"])] +
+            ["{:.3f}".format(res["readWall"] + res["size"] / (throughput * 1e6)) for throughput in throughputs])
+    print(table)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,23 @@
+import sys
+import heapq
+import difflib
 from datetime import datetime
 import ClippyKindle
+from ClippyKindle.Profiler import PROFILER
+
+# thresholds used when detecting duplicate highlights/notes (see Highlight.isDuplicate() and Note.isDuplicate())
+DUP_MAX_PAGE_DIST = 1         # max distance between highlights (using pages) to be considered duplicates
+DUP_MAX_LOC_DIST = 10         # max distance between highlights (using locations) to be considered duplicates
+DUP_MIN_HIGHLIGHT_SPACES = 5  # min number of spaces in a highlight for it to be fuzzy matched
+DUP_MIN_NOTE_SPACES = 6       # min number of spaces in a note for it to be fuzzy matched
+DUP_MIN_OVERLAP = 0.5         # min fraction of content that must be in common for a fuzzy match
+QGRAM_SIZE = 3                # length of substrings counted when ruling out fuzzy matches (see compareContent())
+# names of the checks of compareContent() which may each rule out a fuzzy match (recorded by the profiler with
+#   calls = number of pairs checked, items = number of those ruled out)
+SIMILARITY_TIERS = ["similarity: length bound", "similarity: q-gram filter", "similarity: GCS"]
+
+# columns of the csv rows of a book (see Book.toCSV() and Book.iterCSV())
+CSV_HEADER = ("highlight", "associated_note", "highlight_loc", "note", "note_loc", "bookmark_loc")
 
 class Book:
     """
@@ -19,6 +37,10 @@ class Book:
         self.highlights = [] # array of Highlight objects for this book
         self.notes = []      # array of Note objects for this book
         self.bookmarks = []  # array of Bookmark objects for this book
+        self.id = None       # optional integer id of this book (see BookRegistry)
+        # whether self.highlights, self.notes and self.bookmarks are known to be sorted (see sort())
+        #   (code appending to them directly should set this False, or use addItem() to keep them sorted)
+        self.sorted = False
 
     def __repr__(self):
         """
@@ -41,6 +63,20 @@ class Book:
         fullName = self.title
         return fullName + ("" if self.author == "" else " by {}".format(self.author))
 
+    def addItem(self, obj):
+        """
+        adds a Highlight, Note, or Bookmark object to this book
+        (if the book is sorted it's inserted in place, keeping it sorted without needing to call sort() again)
+
+        Args:
+            obj (Highlight/Note/Bookmark): object to add
+        """
+        objList = self.highlights if isinstance(obj, Highlight) else (self.notes if isinstance(obj, Note) else self.bookmarks)
+        if self.sorted:
+            insortItem(objList, obj)
+        else:
+            objList.append(obj)
+
     def cutBefore(self, cutDate):
         """
         removes all data in Book object that was modified on or before provided timestamp
@@ -75,16 +111,29 @@ class Book:
             (tuple of datetime.datetime objects) first object in tuple is the earliest date, second is the latest
             (if book has no items, earliest will be returned as None, and the latest as the datetimes at epoch 0)
         """
-        latest = datetime.fromtimestamp(0)
-        earliest = None
-        for obj in self.highlights + self.notes + self.bookmarks:
-            #print(latest.date.timestamp())
-            latest = datetime.fromtimestamp(max(latest.timestamp(), obj.date.timestamp()))
-            if earliest == None:
-                earliest = obj.date
-            else:
-                earliest = datetime.fromtimestamp(min(earliest.timestamp(), obj.date.timestamp()))
-        return (earliest, latest)
+        timestamps = [obj.date.timestamp() for obj in self.highlights + self.notes + self.bookmarks]
+        if len(timestamps) == 0:
+            return (None, datetime.fromtimestamp(0))
+        # (only convert the min/max back to datetimes)
+        return (datetime.fromtimestamp(min(timestamps)), datetime.fromtimestamp(max(max(timestamps), 0)))
+
+    def getSummary(self, bookDict=None):
+        """
+        summarizes this book (see BookSummary)
+
+        Args:
+            bookDict (dict): Optional; dict representing this book (created with toDict()) if already available
+        Returns:
+            (BookSummary): summary of this book
+        """
+        import json
+        import hashlib # (imported here as most scripts never need them)
+        d = self.toDict() if bookDict == None else bookDict
+        locType = None if len(d["items"]) == 0 else d["items"][0]["locType"]
+        contentHash = hashlib.blake2b(json.dumps(d["items"], sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        return BookSummary({"name": self.getName(), "title": self.title, "author": self.author,
+            "highlights": len(self.highlights), "notes": len(self.notes), "bookmarks": len(self.bookmarks),
+            "dateStart": d["dateStart"], "dateEnd": d["dateEnd"], "locType": locType, "hash": contentHash})
 
     def toDict(self):
         """
@@ -92,8 +141,11 @@ class Book:
         Returns:
             (dict): A dict storing all the data in this book.
         """
-        items = self.highlights + self.notes + self.bookmarks
-        items = sortDictList([item.toDict() for item in items])
+        if self.sorted:
+            # (merge the already sorted lists, in the same order sortDictList() would give)
+            items = [item.toDict() for item in heapq.merge(self.highlights, self.notes, self.bookmarks, key=sortKey)]
+        else:
+            items = sortDictList([item.toDict() for item in self.highlights + self.notes + self.bookmarks])
         dateRange = self.getDateRange()
         return {"title": self.title, "author": self.author, 
                 "dateStart": None if dateRange[0] == None else ClippyKindle.dateToStr(dateRange[0]),
@@ -104,10 +156,18 @@ class Book:
         converts this book object to a CSV file (columns sorted by location in book increasing)
         Returns:
             Array of lists representing each row (can be written to csv file later).
+            (see iterCSV() to write the rows without building this list)
         """
-        self.sort(removeDups=False) # in case user didn't sort first
-        csvRows = [["highlight", "associated_note", "highlight_loc", "note", "note_loc", "bookmark_loc"]]
+        return [list(CSV_HEADER)] + list(self.iterCSV())
 
+    def iterCSV(self):
+        """
+        generator yielding each row of this book's CSV file (see toCSV()) one at a time, excluding the header
+        (CSV_HEADER) so rows can be streamed straight into a csv.writer, e.g. when appending to a combined file
+        Yields:
+            (list) row of the CSV file
+        """
+        self.sort(removeDups=False) # in case user didn't sort first
         nIdx = 0 # running associated note index (for matching highlights with an overlapping note)
         usedNotes = {} # keys will be the indices in self.notes already associated with a highlight
         for i in range(0, max(len(self.highlights), len(self.notes), len(self.bookmarks))):
@@ -131,66 +191,57 @@ class Book:
                 curRow += ["", "", ""]
             curRow += [self.notes[i].content, self.notes[i].loc] if i < len(self.notes) else ["", ""]
             curRow += [self.bookmarks[i].loc] if i < len(self.bookmarks) else [""]
-            csvRows.append(curRow)
-        return csvRows
+            yield curRow
 
-    def sort(self, removeDups):
+    def sort(self, removeDups, dedupCache=None, audit=None):
         """
         sorts arrays self.highlights, self.notes, and self.bookmarks.  Each array is stored by
         (increasing) location in the book (ties are broken by the date recorded)
+        (skipped if the book is already sorted, see self.sorted)
         optionally removes duplicates within each array
 
         Args:
             removeDups (bool): set True to remove suspected duplicates within self.notes,
                 self.highlights, self.bookmarks. the oldest item in each set of
                 duplicates is the one preserved (the one last modified)
+            dedupCache (DedupCache.DedupCache): Optional; persistent cache of previous duplicate decisions
+                to consult before comparing highlights/notes
+            audit (Audit.DedupAudit): Optional; audit file to record each removed duplicate in
+                (along with the item preserved in its place)
         Returns:
             None
         """
-        # sort self.highlights:
-        tmp = sortDictList([item.toDict() for item in self.highlights])
-        self.highlights = [Highlight.fromDict(item) for item in tmp]
-        # sort self.notes:
-        tmp = sortDictList([item.toDict() for item in self.notes])
-        self.notes = [Note.fromDict(item) for item in tmp]
-        # sort self.bookmarks:
-        tmp = sortDictList([item.toDict() for item in self.bookmarks])
-        self.bookmarks = [Bookmark.fromDict(item) for item in tmp]
+        bookName = self.getName() if PROFILER.enabled else None
+        if not self.sorted:
+            with PROFILER.stage("sort", items=len(self.highlights) + len(self.notes) + len(self.bookmarks), book=bookName):
+                # (new lists, so lists shared with other books e.g. by Server._windowDict() are left unchanged)
+                self.highlights = sorted(self.highlights, key=sortKey)
+                self.notes = sorted(self.notes, key=sortKey)
+                self.bookmarks = sorted(self.bookmarks, key=sortKey)
+            self.sorted = True
 
         if not removeDups:
             return
         # now remove duplicates from each list:
-        # TODO: store the set of each removed element in a separate json file (along with the final preserved "duplicate")
-        #  randomly sample this file to check for false ?positives?
-        def removeDuplicates(objList):
-            """
-            removes duplicate objects in provided list of sorted objects
-            Args:
-                objList (list): list of objects where each has method isDuplicate() defined
-
-            Returns:
-                Modified list of provided objects (some possibly removed).
-            """
-            i = 0
-            while True:
-                if i >= len(objList)-2: # stop when i is at the second to last element
-                    break
-                # compare to bookmark i+1:
-                if objList[i].isDuplicate(objList[i+1]):
-                    #print("deleting: " + str(objList[i]))
-                    del objList[i] # delete the older one (and don't advance i this loop)
-                else:
-                    i += 1 
-            return objList
-        self.highlights = removeDuplicates(self.highlights) # remove duplicate highlights
-        self.notes = removeDuplicates(self.notes)           # remove duplicate notes
-        self.bookmarks = removeDuplicates(self.bookmarks)   # remove duplicate bookmarks
+        #  (optionally recording each removed element in audit, along with the preserved "duplicate")
+        compare, onRemove = getDedupFunctions(self.getName(), dedupCache, audit)
+        numBefore = len(self.highlights) + len(self.notes) + len(self.bookmarks)
+        with PROFILER.stage("dedup", book=bookName):
+            self.highlights = list(iterWithoutDuplicates(self.highlights, compare, onRemove)) # remove duplicate highlights
+            self.notes = list(iterWithoutDuplicates(self.notes, compare, onRemove))           # remove duplicate notes
+            self.bookmarks = list(iterWithoutDuplicates(self.bookmarks, compare, onRemove))   # remove duplicate bookmarks
+        PROFILER.count("dedup", calls=0, items=numBefore - len(self.highlights) - len(self.notes) - len(self.bookmarks))
 
     @staticmethod
-    def fromDict(d):
+    def fromDict(d, trustSorted=False):
         """
+        Args:
+            d (dict): dict representing a book (created with toDict())
+            trustSorted (bool): Optional; set True if the items in d are known to already be sorted
+                (e.g. created by toDict()) to skip checking that they are
         Returns:
             A new Book object populated with the values from a provided dict (e.g. read from a JSON file)
+            (its items are only sorted if they weren't already in order)
         """
         book = Book(d["title"], d["author"])
         for item in d["items"]:
@@ -200,10 +251,136 @@ class Book:
                 book.notes.append(Note.fromDict(item))
             if item["type"] == "bookmark":
                 book.bookmarks.append(Bookmark.fromDict(item))
+        book.sorted = trustSorted or all(isSorted(objList) for objList in [book.highlights, book.notes, book.bookmarks])
         book.sort(removeDups=False) # don't remove dupes if provided dict contained them
         return book
 
 
+class BookSummary:
+    """
+    Lightweight stand in for a Book, holding just its name, item counts, date range, location type and a hash of
+    its content (see Book.getSummary()), e.g. loaded from a collection's summary index (see ClippyKindle.Summary)
+    so books can be listed without loading their items.
+    """
+    def __init__(self, d):
+        """
+        Args:
+            d (dict): dict representing the summary (created with toDict())
+        """
+        self.name = d["name"]
+        self.title = d["title"]
+        self.author = d["author"]
+        self.highlights = d["highlights"] # number of highlights in the book
+        self.notes = d["notes"]           # number of notes in the book
+        self.bookmarks = d["bookmarks"]   # number of bookmarks in the book
+        self.dateStart = d["dateStart"]   # date string of the earliest item (or None if the book has no items)
+        self.dateEnd = d["dateEnd"]       # date string of the latest item (see Book.toDict())
+        self.locType = d["locType"]       # location type of the book's items, e.g. "location" or "page" (or None)
+        self.hash = d["hash"]             # hash of the book's items (changes whenever any item does)
+
+    def __repr__(self):
+        return "<BookSummary of '{}': {} highlights, {} notes, {} bookmarks>".format(self.name, self.highlights, self.notes, self.bookmarks)
+
+    def getName(self):
+        """
+        returns a string containing the book's title and author (see Book.getName())
+        """
+        return self.name
+
+    def numItems(self):
+        """
+        Returns:
+            (int): total number of highlights, notes and bookmarks in the book
+        """
+        return self.highlights + self.notes + self.bookmarks
+
+    def getDateRange(self):
+        """
+        Returns:
+            (tuple of datetime.datetime objects) earliest and latest date of an item in the book (see Book.getDateRange())
+        """
+        return (None if self.dateStart == None else ClippyKindle.strToDate(self.dateStart), ClippyKindle.strToDate(self.dateEnd))
+
+    def toDict(self):
+        """
+        Returns:
+            (dict): A dict representing this summary
+        """
+        return {"name": self.name, "title": self.title, "author": self.author, "highlights": self.highlights,
+            "notes": self.notes, "bookmarks": self.bookmarks, "dateStart": self.dateStart, "dateEnd": self.dateEnd,
+            "locType": self.locType, "hash": self.hash}
+
+class BookRegistry:
+    """
+    Maps the title lines of a clippings file (e.g. "Fahrenheit 451: A Novel (Bradbury, Ray)") to Book objects,
+    giving each book a stable integer id (in order of first appearance).
+    Title lines are interned and their title/author split is only computed once per book.
+    """
+    def __init__(self):
+        """
+        Initialize an empty BookRegistry.
+        """
+        self.books = [] # list of Book objects (indexed by book id)
+        self.ids = {}   # dict mapping (interned) title line -> book id
+
+    def __len__(self):
+        """
+        Returns:
+            (int): number of books registered
+        """
+        return len(self.books)
+
+    def __iter__(self):
+        """
+        iterates over the registered Book objects (in order of their ids)
+        """
+        return iter(self.books)
+
+    def getId(self, titleLine):
+        """
+        returns the id of the book with the provided title line (registering a new Book object if needed)
+
+        Args:
+            titleLine (str): title/author line from the clippings file
+        Returns:
+            (int): id of book
+        """
+        bookId = self.ids.get(titleLine)
+        if bookId == None:
+            titleLine = sys.intern(titleLine)
+            bookId = len(self.books)
+            title, author = BookRegistry.splitTitle(titleLine)
+            book = Book(title, author)
+            book.id = bookId
+            self.books.append(book)
+            self.ids[titleLine] = bookId
+        return bookId
+
+    def get(self, bookId):
+        """
+        Returns:
+            (Book): the book with the provided id
+        """
+        return self.books[bookId]
+
+    @staticmethod
+    def splitTitle(titleLine):
+        """
+        splits a title line from the clippings file into the book's title and author
+        e.g. "Fahrenheit 451: A Novel (Bradbury, Ray)" -> ("Fahrenheit 451: A Novel", "Bradbury, Ray")
+
+        Returns:
+            (tuple of str): (title, author) where author is "" if not found
+        """
+        title, author = titleLine, ""
+        if titleLine.endswith(')'):
+            authorStart = titleLine.rfind(" (")
+            if authorStart != -1:
+                title = titleLine[0 : titleLine.rfind('(')-1].strip()
+                author = titleLine[authorStart+2 : -1].strip()
+        return (title, author)
+
+
 # TODO: don't store locType in Highlight/Note/Bookmark classes (just in Book)
 class Highlight:
     """ 
@@ -247,21 +424,36 @@ class Highlight:
         Returns:
             (bool): true or false.
         """
+        return self.compare(other, fuzzyMatch)[0]
+
+    def compare(self, other, fuzzyMatch=True):
+        """
+        compares provided Highlight object to this object (see isDuplicate())
+
+        Returns:
+            (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+            (see compareContent())
+        """
+        PROFILER.count("isDuplicate")
         # duplicates will have similar locations
-        if abs(self.loc - other.loc) <= (1 if self.locType == "page" else 10):
-            if self.content in other.content or other.content in self.content:
-                return True
-            thisWords, otherWords = self.content.count(" "), other.content.count(" ")
-            if thisWords < 5: # speed things up bc we check this later
-                return False
-
-            sub = GCS(self.content, other.content).strip()  # get longest common substring
-            subWords = sub.count(" ")
-            # err on the side of false negatives
-            if thisWords >= 5 and len(sub)/len(self.content) >= 0.5:
-                # (self.content is a decent length and over half of it is identical to other.content)
-                return True
-        return False
+        if self.isNearby(other):
+            return compareContent(self.content, other.content, DUP_MIN_HIGHLIGHT_SPACES, fuzzyMatch)
+        return (False, None, None)
+
+    def isNearby(self, other):
+        """
+        Returns:
+            (bool): true if provided Highlight object is close enough to this object to possibly be a duplicate
+        """
+        return abs(self.loc - other.loc) <= (DUP_MAX_PAGE_DIST if self.locType == "page" else DUP_MAX_LOC_DIST)
+
+    def isFuzzyCandidate(self, other):
+        """
+        Returns:
+            (bool): true if comparing provided Highlight object to this object requires fuzzy matching their content
+                (the expensive step of compare(), worth caching the decision of, see DedupCache)
+        """
+        return self.isNearby(other) and needsFuzzyMatch(self.content, other.content, DUP_MIN_HIGHLIGHT_SPACES)
 
     def toDict(self):
         """
@@ -312,22 +504,37 @@ class Note:
         Returns:
             (bool): true or false
         """
+        return self.compare(other, fuzzyMatch)[0]
+
+    def compare(self, other, fuzzyMatch=True):
+        """
+        compares provided Note object to this object (see isDuplicate())
+
+        Returns:
+            (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+            (see compareContent())
+        """
+        PROFILER.count("isDuplicate")
+        if self.isNearby(other):
+            return compareContent(self.content, other.content, DUP_MIN_NOTE_SPACES, fuzzyMatch)
+        return (False, None, None)
+
+    def isNearby(self, other):
+        """
+        Returns:
+            (bool): true if provided Note object is at the same location as this object (so may be a duplicate)
+        """
         # duplicate notes will have the exact the same location
         # (but remember that nearby (potentially noted) words in ebook can have the same location)
-        if self.loc == other.loc:
-            if self.content in other.content or other.content in self.content:
-                return True
-            thisWords, otherWords = self.content.count(" "), other.content.count(" ")
-            if thisWords < 6: # speed things up bc we check this later
-                return False
-
-            sub = GCS(self.content, other.content).strip()  # get longest common substring
-            subWords = sub.count(" ")
-            # err on the side of false negatives
-            if thisWords >= 6 and len(sub)/len(self.content) >= 0.5:
-                # (self.content is a decent length and over half of it is identical to other.content)
-                return True
-        return False
+        return self.loc == other.loc
+
+    def isFuzzyCandidate(self, other):
+        """
+        Returns:
+            (bool): true if comparing provided Note object to this object requires fuzzy matching their content
+                (see Highlight.isFuzzyCandidate())
+        """
+        return self.isNearby(other) and needsFuzzyMatch(self.content, other.content, DUP_MIN_NOTE_SPACES)
 
     def __repr__(self):
         """
@@ -392,7 +599,19 @@ class Bookmark:
         Returns:
             (bool): true or false.
         """
-        return self.loc == other.loc
+        return self.compare(other)[0]
+
+    def compare(self, other):
+        """
+        compares provided Bookmark object to this object (see isDuplicate())
+
+        Returns:
+            (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+        """
+        PROFILER.count("isDuplicate")
+        if self.loc == other.loc:
+            return (True, "location", 1.0)
+        return (False, None, None)
 
     def toDict(self):
         """
@@ -423,30 +642,191 @@ def sortDictList(arr):
         (list of dict objects): original list of dicts except now reordered
     """
     for item in arr:
-        dateEpoch = ClippyKindle.strToDate(item["dateStr"]).timestamp()
-        item["sortKey"] = item["loc"] + float("." + str(int(dateEpoch)))
+        item["sortKey"] = _sortKey(item["loc"], ClippyKindle.strToDate(item["dateStr"]).timestamp())
     arr.sort(key=lambda item: item["sortKey"]) # https://stackoverflow.com/a/403426
     for item in arr: # remove sortKeys
         item.pop("sortKey")
     return arr
 
+def sortKey(obj):
+    """
+    Returns:
+        (float): key for sorting a Highlight/Note/Bookmark object by (increasing) page/location within the book,
+            ties broken by date recorded (the same order as sortDictList())
+    """
+    return _sortKey(obj.loc, obj.date.timestamp())
+
+def _sortKey(loc, dateEpoch):
+    return loc + float("." + str(int(dateEpoch)))
+
+def isSorted(objList):
+    """
+    Returns:
+        (bool): true if the provided list of Highlight/Note/Bookmark objects is already sorted (see sortKey()),
+            checked in a single pass
+    """
+    prevKey = None
+    for obj in objList:
+        key = sortKey(obj)
+        if prevKey != None and key < prevKey:
+            return False
+        prevKey = key
+    return True
+
+def insortItem(objList, obj):
+    """
+    inserts a Highlight/Note/Bookmark object into a sorted list of such objects (see sortKey()), keeping it sorted
+    (after any objects with an equal key, as sorting the list with obj appended would)
+    """
+    key = sortKey(obj)
+    lo, hi = 0, len(objList)
+    while lo < hi: # (binary search, as bisect.insort() only accepts a key function in python >= 3.10)
+        mid = (lo + hi) // 2
+        if key < sortKey(objList[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    objList.insert(lo, obj)
+
+def getDedupFunctions(bookName, dedupCache=None, audit=None):
+    """
+    helper function returning the functions used to remove duplicates from a book (see iterWithoutDuplicates())
+
+    Args:
+        bookName (str): name of book (see Book.getName())
+        dedupCache, audit: see Book.sort()
+    Returns:
+        (tuple): (compare function, onRemove function or None)
+    """
+    def compare(obj, other):
+        # (only decisions needing a fuzzy match are cached, as the other checks are cheaper than a cache lookup)
+        if dedupCache != None and not isinstance(obj, Bookmark) and obj.isFuzzyCandidate(other):
+            return dedupCache.compare(obj, other)
+        return obj.compare(other)
+    onRemove = None if audit == None else (lambda removed, kept, reason, similarity:
+            audit.record(bookName, kept, removed, reason, similarity))
+    return (compare, onRemove)
+
+def iterWithoutDuplicates(objs, compare, onRemove=None):
+    """
+    generator removing duplicates from a sorted sequence of Highlight/Note/Bookmark objects (of the same type)
+    by comparing each object to the next one, and dropping the older one of each duplicated pair.
+    Only a single pair of objects is held at a time, so objs may be streamed (e.g. merged from files on disk).
+    (note the last pair of objects is never compared, as has always been the case for Book.sort())
+
+    Args:
+        objs (iterable): sorted objects (see sortKey())
+        compare (function): function comparing an object to the next one, returning (bool isDuplicate, str reason, float similarity)
+            (e.g. Highlight.compare())
+        onRemove (function): Optional; function called as onRemove(removed, kept, reason, similarity) for each object removed
+    Yields:
+        each object that isn't a duplicate (in order)
+    """
+    objs = iter(objs)
+    cur = next(objs, None)
+    nxt = next(objs, None)
+    if nxt == None:
+        if cur != None:
+            yield cur
+        return
+    for after in objs:
+        # (cur and nxt aren't the last pair, so compare them)
+        isDup, reason, similarity = compare(cur, nxt)
+        if isDup:
+            if onRemove != None:
+                onRemove(cur, nxt, reason, similarity)
+        else:
+            yield cur
+        cur, nxt = nxt, after
+    yield cur
+    yield nxt
+
+def needsFuzzyMatch(content, otherContent, minSpaces):
+    """
+    Returns:
+        (bool): true if compareContent() can only decide whether the provided content is duplicated by fuzzy matching it
+            (i.e. neither content contains the other, and content has enough words to be fuzzy matched)
+    """
+    return not (content in otherContent or otherContent in content) and content.count(" ") >= minSpaces
+
+def compareContent(content, otherContent, minSpaces, fuzzyMatch=True):
+    """
+    helper function for deciding whether the content of two (nearby) highlights/notes is duplicated
+
+    Args:
+        content (str): content of the item being compared
+        otherContent (str): content of the item it's being compared to
+        minSpaces (int): min number of spaces content must have to be fuzzy matched
+        fuzzyMatch (bool): true if overlapping content (but not exactly the same) can be considered duplicated
+    Returns:
+        (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+            where reason is "substring" (one content contains the other) or "overlap" (the longest common
+            substring covers enough of content), and similarity is the fraction of content shared (when computed)
+    """
+    if content in otherContent or otherContent in content:
+        longest = max(len(content), len(otherContent))
+        return (True, "substring", 1.0 if longest == 0 else min(len(content), len(otherContent)) / longest)
+    thisWords = content.count(" ")
+    if thisWords < minSpaces or not fuzzyMatch: # speed things up bc we check this later
+        return (False, None, None)
+
+    # cascade of increasingly expensive checks, each ruling out pairs that can't possibly share enough content
+    #   (so the longest common substring is only found for pairs that might be duplicates)
+    needed = DUP_MIN_OVERLAP * len(content) # min length of common substring for content to be a duplicate
+    # tier 1: the common substring can't be longer than otherContent
+    PROFILER.count(SIMILARITY_TIERS[0], items=int(len(otherContent) < needed))
+    if len(otherContent) < needed:
+        return (False, None, None)
+    # tier 2: a common substring of length n contains n-QGRAM_SIZE+1 q-grams (substrings of length QGRAM_SIZE)
+    #   that both strings must contain
+    if needed > QGRAM_SIZE:
+        numShared = countSharedQgrams(content, otherContent)
+        PROFILER.count(SIMILARITY_TIERS[1], items=int(numShared < needed - QGRAM_SIZE + 1))
+        if numShared < needed - QGRAM_SIZE + 1:
+            return (False, None, None)
+    # tier 3: find longest common substring
+    sub = GCS(content, otherContent).strip()  # get longest common substring
+    similarity = len(sub)/len(content)
+    PROFILER.count(SIMILARITY_TIERS[2], items=int(similarity < DUP_MIN_OVERLAP))
+    # err on the side of false negatives
+    if similarity >= DUP_MIN_OVERLAP:
+        # (content is a decent length and over half of it is identical to otherContent)
+        return (True, "overlap", similarity)
+    return (False, None, similarity)
+
+def countSharedQgrams(string1, string2):
+    """
+    Returns:
+        (int): number of q-grams (substrings of length QGRAM_SIZE) the provided strings have in common
+            (counting repeated q-grams as many times as they appear in both strings)
+    """
+    counts = {}
+    for i in range(len(string1) - QGRAM_SIZE + 1):
+        qgram = string1[i:i+QGRAM_SIZE]
+        counts[qgram] = counts.get(qgram, 0) + 1
+    numShared = 0
+    for i in range(len(string2) - QGRAM_SIZE + 1):
+        qgram = string2[i:i+QGRAM_SIZE]
+        if counts.get(qgram, 0) > 0:
+            counts[qgram] -= 1
+            numShared += 1
+    return numShared
+
 def GCS(string1, string2):
     """
     Returns:
         (str): The greatest (longest) common substring between two provided strings
-        (returns empty string if there is no overlap)
+        (returns empty string if there is no overlap, and the one appearing first in string1 if there's a tie)
+    """
+    with PROFILER.stage("GCS", items=len(string1) * len(string2)):
+        return _GCS(string1, string2)
+
+def _GCS(string1, string2):
+    """
+    implementation of GCS() (see above)
     """
-    # this function copied directly from:
-    #   https://stackoverflow.com/a/42882629
-    answer = ""
-    len1, len2 = len(string1), len(string2)
-    for i in range(len1):
-        for j in range(len2):
-            lcs_temp=0
-            match=''
-            while ((i+lcs_temp < len1) and (j+lcs_temp<len2) and string1[i+lcs_temp] == string2[j+lcs_temp]):
-                match += string2[j+lcs_temp]
-                lcs_temp+=1
-            if (len(match) > len(answer)):
-                answer = match
-    return answer
+    # (without any junk heuristics SequenceMatcher finds the exact longest match, and much faster than
+    #   comparing the strings at every pair of offsets as previously done: https://stackoverflow.com/a/42882629)
+    matcher = difflib.SequenceMatcher(None, string1, string2, autojunk=False)
+    i, j, size = matcher.find_longest_match(0, len(string1), 0, len(string2))
+    return string1[i:i+size]
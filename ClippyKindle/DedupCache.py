@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from ClippyKindle import DataStructures
+from ClippyKindle.Profiler import PROFILER
+
+# bump this whenever the logic in Highlight.isDuplicate() or Note.isDuplicate() changes
+# (so that decisions cached by an older version are discarded)
+DEDUP_VERSION = 2
+
+class DedupCache:
+    """
+    Persistent (sqlite) memo of the decisions made by isDuplicate() for pairs of highlights/notes,
+    so that later runs only pay for comparisons involving new items.
+    Items are identified by a hash of their type, location and content (which never change).
+    Only decisions that need fuzzy matching are worth caching (see Highlight.isFuzzyCandidate()).
+    """
+    def __init__(self, fname, maxEntries=200000):
+        """
+        Opens (or creates) a DedupCache stored in the provided file.
+        Cached decisions are discarded if they were made using different dedup thresholds.
+
+        Args:
+            fname (str): file path of sqlite database to use (e.g. ".dedup-cache.sqlite")
+            maxEntries (int): Optional; max number of decisions to keep (least recently used are evicted)
+        """
+        self.fname = fname
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}  # dict mapping pair key -> decision tuple (not yet written to database)
+        self._used = set()  # pair keys read from the database during this session
+        self._recentKeys = [] # (object, key) of the last 2 items compared (items are compared to their neighbors,
+                              #   so each item's key is only computed once)
+        self.conn = sqlite3.connect(fname)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._createTables()
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        if row == None or row[0] != DedupCache.signature():
+            self.clear()
+
+    def _createTables(self):
+        """
+        creates the table of decisions (if it doesn't already exist)
+        """
+        self.conn.execute("CREATE TABLE IF NOT EXISTS decisions (pair TEXT PRIMARY KEY, isDup INTEGER, reason TEXT, similarity REAL, lastUsed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS decisions_lastUsed ON decisions (lastUsed)")
+
+    @staticmethod
+    def signature():
+        """
+        Returns:
+            (str): string identifying the current dedup logic and thresholds
+        """
+        return json.dumps([DEDUP_VERSION, DataStructures.DUP_MAX_PAGE_DIST, DataStructures.DUP_MAX_LOC_DIST,
+            DataStructures.DUP_MIN_HIGHLIGHT_SPACES, DataStructures.DUP_MIN_NOTE_SPACES, DataStructures.DUP_MIN_OVERLAP])
+
+    @staticmethod
+    def itemKey(obj):
+        """
+        Returns:
+            (str): hash identifying the provided Highlight/Note object (by its type, location and content)
+        """
+        d = obj.toDict()
+        d.pop("dateStr")
+        return hashlib.sha1(json.dumps(d, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def isDuplicate(self, obj, other):
+        """
+        returns obj.isDuplicate(other), using a previously cached decision when available
+
+        Args:
+            obj (Highlight or Note): object to call isDuplicate() on
+            other (Highlight or Note): object to compare it to
+        Returns:
+            (bool): true or false
+        """
+        return self.compare(obj, other)[0]
+
+    def compare(self, obj, other):
+        """
+        returns obj.compare(other), using a previously cached decision when available
+
+        Returns:
+            (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+        """
+        pair = self._getKey(obj) + ":" + self._getKey(other)
+        if pair in self._pending:
+            self.hits += 1
+            return self._pending[pair]
+        row = self.conn.execute("SELECT isDup, reason, similarity FROM decisions WHERE pair = ?", (pair,)).fetchone()
+        if row != None:
+            self.hits += 1
+            PROFILER.count("dedup cache hit")
+            self._used.add(pair)
+            return (row[0] == 1, row[1], row[2])
+        self.misses += 1
+        PROFILER.count("dedup cache miss")
+        res = obj.compare(other)
+        self._pending[pair] = res
+        return res
+
+    def _getKey(self, obj):
+        """
+        Returns:
+            (str): DedupCache.itemKey() of the provided object (reused if it was one of the last 2 objects compared)
+        """
+        for recentObj, key in self._recentKeys:
+            if recentObj is obj:
+                return key
+        key = DedupCache.itemKey(obj)
+        self._recentKeys = self._recentKeys[-1:] + [(obj, key)]
+        return key
+
+    def clear(self):
+        """
+        discards all cached decisions
+        """
+        self._pending, self._used = {}, set()
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS decisions") # (in case its columns changed)
+            self._createTables()
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)", (DedupCache.signature(),))
+
+    def flush(self):
+        """
+        writes new decisions (and the usage of existing ones) to the database,
+        then evicts the least recently used decisions beyond self.maxEntries
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO decisions (pair, isDup, reason, similarity, lastUsed) VALUES (?, ?, ?, ?, ?)",
+                ((pair, int(res[0]), res[1], res[2], now) for pair, res in self._pending.items()))
+            self.conn.executemany("UPDATE decisions SET lastUsed = ? WHERE pair = ?", ((now, pair) for pair in self._used))
+            numEntries = self.conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+            if numEntries > self.maxEntries:
+                self.conn.execute("DELETE FROM decisions WHERE pair IN (SELECT pair FROM decisions ORDER BY lastUsed LIMIT ?)",
+                    (numEntries - self.maxEntries,))
+        self._pending, self._used = {}, set()
+
+    def close(self):
+        """
+        flushes and closes the database
+        """
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,288 @@
+# compares two collections created by clippy.py, reporting the books/items added, removed and changed
+import os
+import sys
+import json
+import argparse
+
+from ClippyKindle import DataStructures
+
+CHUNK_SIZE = 1 << 20 # number of characters of a collection.json to read at a time
+PREVIEW_LENGTH = 80  # max number of characters of content printed per item
+
+class BookDiff:
+    """
+    Differences between the versions of a book in two collections
+    """
+    def __init__(self, name, status, numItems=0):
+        """
+        Args:
+            name (str): name of book (see Book.getName())
+            status (str): "added" (only in the new collection), "removed" (only in the old collection)
+                or "changed" (in both, but different)
+            numItems (int): Optional; number of items in the book (in the collection it's in, for added/removed books)
+        """
+        self.name = name
+        self.status = status
+        self.numItems = numItems
+        self.added = []   # list of item dicts (see Highlight.toDict()) only in the new book
+        self.removed = [] # list of item dicts only in the old book
+        self.changed = [] # list of (old item dict, new item dict) tuples of items with the same type, location and date
+
+    def __repr__(self):
+        return "<BookDiff '{}': {}, +{} -{} ~{}>".format(self.name, self.status, len(self.added), len(self.removed), len(self.changed))
+
+    def toDict(self):
+        """
+        Returns:
+            (dict): A dict representing this diff
+        """
+        return {"name": self.name, "status": self.status, "numItems": self.numItems, "added": self.added,
+            "removed": self.removed, "changed": [{"old": old, "new": new} for old, new in self.changed]}
+
+class CollectionDiff:
+    """
+    Differences between two collections (see diffCollections())
+    """
+    def __init__(self):
+        self.books = [] # list of BookDiff objects (books added/changed in the new collection's order, then books removed)
+        self.numUnchanged = 0 # number of books identical in both collections
+
+    def isEmpty(self):
+        """
+        Returns:
+            (bool): true if the collections are identical
+        """
+        return len(self.books) == 0
+
+    def getCounts(self):
+        """
+        Returns:
+            (dict): number of books "added", "removed", "changed" and "unchanged", and number of items
+                "itemsAdded", "itemsRemoved" and "itemsChanged" (including the items of books added/removed)
+        """
+        counts = {"added": 0, "removed": 0, "changed": 0, "unchanged": self.numUnchanged,
+            "itemsAdded": 0, "itemsRemoved": 0, "itemsChanged": 0}
+        for bookDiff in self.books:
+            counts[bookDiff.status] += 1
+            counts["itemsAdded"] += bookDiff.numItems if bookDiff.status == "added" else len(bookDiff.added)
+            counts["itemsRemoved"] += bookDiff.numItems if bookDiff.status == "removed" else len(bookDiff.removed)
+            counts["itemsChanged"] += len(bookDiff.changed)
+        return counts
+
+    def toDict(self):
+        """
+        Returns:
+            (dict): A dict representing this diff
+        """
+        return {"counts": self.getCounts(), "books": [bookDiff.toDict() for bookDiff in self.books]}
+
+def iterJsonArray(f, chunkSize=CHUNK_SIZE):
+    """
+    generator yielding the elements of a json array from an open file one at a time (e.g. the books of a collection.json),
+    so only one element needs to be held in memory at once
+
+    Args:
+        f (file object): file (opened in text mode) containing a json array of objects
+        chunkSize (int): Optional; min number of characters to read at a time
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(chunkSize)
+    pos = 0
+    eof = len(buf) == 0
+    started = False # whether the opening '[' has been read
+    while True:
+        # skip whitespace and separators before the next element
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == "," or (buf[pos] == "[" and not started)):
+            started = started or buf[pos] == "["
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+                yield obj
+                continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        elif eof:
+            raise ValueError("unexpected end of json array")
+        # (element is incomplete: read at least as much again as is buffered, so large elements are only decoded a few times)
+        chunk = f.read(max(chunkSize, len(buf) - pos))
+        buf, pos = buf[pos:] + chunk, 0
+        eof = len(chunk) == 0
+
+def iterBookDicts(path):
+    """
+    generator yielding the dict of each book (see Book.toDict()) in a collection, one at a time
+
+    Args:
+        path (str): path of (optionally compressed) json file, sqlite store or sharded collection folder created by clippy.py
+    """
+    from ClippyKindle import Shards
+    if Shards.isShardedPath(path):
+        for entry in Shards.readManifest(path):
+            with open(os.path.join(path, entry["file"])) as f:
+                yield json.load(f)
+        return
+    from ClippyKindle.SqliteStore import SqliteStore
+    if SqliteStore.isStorePath(path):
+        store = SqliteStore(path)
+        try:
+            for name in store.getBookNames():
+                yield store.loadBook(name).toDict()
+        finally:
+            store.close()
+        return
+    from ClippyKindle.Compression import openFile
+    with openFile(path) as f:
+        yield from iterJsonArray(f)
+
+def getItemKey(item):
+    """
+    Returns:
+        (tuple): key matching the versions of an item (dict created with e.g. Highlight.toDict()) in two collections,
+            i.e. its type, location and date
+    """
+    return (item["type"], item["loc"], item["dateStr"])
+
+def hashItem(item):
+    """
+    Returns:
+        (int): hash of every field of an item (dict created with e.g. Highlight.toDict()).
+            Hashes are only compared within a process, so python's (64 bit) hash() is used
+            (it's several times faster than a cryptographic hash of the item's json)
+    """
+    return hash(tuple(sorted(item.items())))
+
+def _hashBook(bookDict, itemHashes):
+    """
+    Returns:
+        (int): hash of a book's fields and (the hashes of) its items in order
+    """
+    return hash((tuple(sorted((key, val) for key, val in bookDict.items() if key != "items")), tuple(itemHashes)))
+
+def _getBookName(bookDict):
+    """
+    Returns:
+        (str): name of a book (see Book.getName()) from its dict
+    """
+    return DataStructures.Book(bookDict["title"], bookDict["author"]).getName()
+
+def diffCollections(oldPath, newPath):
+    """
+    compares two collections in time roughly linear in their size, streaming both. Books are matched by name
+    (see Book.getName()), and items by their type, location and date (see getItemKey()), comparing the hash
+    of each item (so only the hashes of the old collection are held in memory). Books whose hash is unchanged
+    are skipped without comparing their items. The old versions of the items changed/removed are then read
+    in a second pass over the old collection (only if any book changed).
+
+    Args:
+        oldPath (str): path of old collection (json file, sqlite store or sharded collection folder created by clippy.py)
+        newPath (str): path of new collection
+    Returns:
+        (CollectionDiff): differences found
+    """
+    old = {} # dict mapping book name -> (hash of book, number of items, dict mapping item key -> list of item hashes)
+    for bookDict in iterBookDicts(oldPath):
+        itemHashes = [hashItem(item) for item in bookDict["items"]]
+        items = {}
+        for item, itemHash in zip(bookDict["items"], itemHashes):
+            items.setdefault(getItemKey(item), []).append(itemHash)
+        old[_getBookName(bookDict)] = (_hashBook(bookDict, itemHashes), len(itemHashes), items)
+
+    diff = CollectionDiff()
+    changed = {} # dict mapping book name -> BookDiff of changed book (with the hashes of its old items in place of the items)
+    for bookDict in iterBookDicts(newPath):
+        name = _getBookName(bookDict)
+        itemHashes = [hashItem(item) for item in bookDict["items"]]
+        if name not in old:
+            diff.books.append(BookDiff(name, "added", len(itemHashes)))
+            continue
+        bookHash, _, oldItems = old.pop(name)
+        if bookHash == _hashBook(bookDict, itemHashes):
+            diff.numUnchanged += 1
+            continue
+        bookDiff = BookDiff(name, "changed", len(itemHashes))
+        unmatched = {} # dict mapping item key -> list of new items without an identical old item
+        for item, itemHash in zip(bookDict["items"], itemHashes):
+            key = getItemKey(item)
+            candidates = oldItems.get(key, [])
+            if itemHash in candidates:
+                candidates.remove(itemHash)
+            else:
+                unmatched.setdefault(key, []).append(item)
+        for key, items in unmatched.items():
+            candidates = oldItems.get(key, [])
+            # (pair up the remaining items with the same key as changed)
+            bookDiff.changed += list(zip(candidates, items))
+            bookDiff.added += items[len(candidates):]
+            oldItems[key] = candidates[len(items):]
+        for candidates in oldItems.values():
+            bookDiff.removed += candidates
+        # (a book with no differing items had its other fields, or the order of its items, changed)
+        diff.books.append(bookDiff)
+        if len(bookDiff.changed) + len(bookDiff.removed) != 0:
+            changed[name] = bookDiff
+    for name, (_, numItems, _) in old.items():
+        diff.books.append(BookDiff(name, "removed", numItems))
+
+    # replace the hashes of the old items changed/removed with the items themselves
+    if len(changed) != 0:
+        for bookDict in iterBookDicts(oldPath):
+            bookDiff = changed.get(_getBookName(bookDict))
+            if bookDiff == None:
+                continue
+            items = {} # dict mapping item hash -> list of old items with that hash
+            for item in bookDict["items"]:
+                items.setdefault(hashItem(item), []).append(item)
+            bookDiff.changed = [(items[oldHash].pop(), item) for oldHash, item in bookDiff.changed]
+            bookDiff.removed = [items[oldHash].pop() for oldHash in bookDiff.removed]
+    return diff
+
+def _formatItem(item):
+    """
+    Returns:
+        (str): one line description of an item dict
+    """
+    content = item.get("content", "").replace("\n", " ")
+    if len(content) > PREVIEW_LENGTH:
+        content = content[:PREVIEW_LENGTH] + "..."
+    return "[{} {} {}, {}] {}".format(item["type"], item["locType"], item["loc"], item["dateStr"], content).rstrip()
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Compares two collections created by clippy.py (e.g. before and after upgrading or changing the duplicate detection settings), printing the books and items added, removed and changed. Exits with status 1 if they differ (like diff).')
+    parser.add_argument('old', type=str, help='(string) path to old collection: json file (optionally compressed), sqlite store or sharded collection folder (e.g. "./old/collection.json")')
+    parser.add_argument('new', type=str, help='(string) path to new collection (e.g. "./collection.json")')
+    parser.add_argument('--max-items', type=int, default=5, help='(int) max number of items added/removed/changed to print per book (default: 5), 0 only prints the number of differences')
+    parser.add_argument('--json', type=str, default='', help='(string) optional path of json file to write every difference to (e.g. "diff.json")')
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+
+    diff = diffCollections(args.old, args.new)
+    for bookDiff in diff.books:
+        if bookDiff.status != "changed":
+            print("{} book: '{}' ({} item(s))".format(bookDiff.status, bookDiff.name, bookDiff.numItems))
+            continue
+        print("changed book: '{}' (+{} -{} ~{})".format(bookDiff.name, len(bookDiff.added), len(bookDiff.removed), len(bookDiff.changed)))
+        if len(bookDiff.added) + len(bookDiff.removed) + len(bookDiff.changed) == 0:
+            print("  (order of items or dates of book changed)")
+        for prefix, items in [("+", bookDiff.added), ("-", bookDiff.removed)]:
+            for item in items[:args.max_items]:
+                print("  {} {}".format(prefix, _formatItem(item)))
+        for old, new in bookDiff.changed[:args.max_items]:
+            print("  ~ {}\n    -> {}".format(_formatItem(old), _formatItem(new)))
+    counts = diff.getCounts()
+    print("\nbooks: {} added, {} removed, {} changed, {} unchanged".format(counts["added"], counts["removed"], counts["changed"], counts["unchanged"]))
+    print("items: {} added, {} removed, {} changed".format(counts["itemsAdded"], counts["itemsRemoved"], counts["itemsChanged"]))
+    if args.json != "":
+        with open(args.json, 'w') as f:
+            json.dump(diff.toDict(), f, indent=2)
+        print("Wrote differences to: '{}'".format(args.json))
+    exit(0 if diff.isEmpty() else 1)
+
+if __name__ == "__main__":
+    main()
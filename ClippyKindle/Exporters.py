@@ -0,0 +1,268 @@
+import io
+import os
+import csv
+import json
+import html
+
+from ClippyKindle import DataStructures
+
+class BookExport:
+    """
+    The data of a book shared by every format outputting it, so the book is converted to a dict at most once
+    however many formats it's output in (csv rows are streamed rather than stored, see getRows()).
+    """
+    def __init__(self, book, chapters=[]):
+        """
+        Args:
+            book (DataStructures.Book): book to output
+            chapters (list of dicts): Optional; chapters of the book (see marky.jsonToMarkdown())
+        """
+        self.book = book
+        self.chapters = chapters
+        self._dict = None
+
+    def getDict(self):
+        """
+        Returns:
+            (dict): dict representing the book (see Book.toDict()), which must not be modified
+        """
+        if self._dict == None:
+            self._dict = self.book.toDict()
+        return self._dict
+
+    def getRows(self):
+        """
+        Returns:
+            (iterator of lists): csv rows of the book (see Book.iterCSV()) excluding the header,
+                generated as they're consumed (so each call traverses the book again, in constant memory)
+        """
+        return self.book.iterCSV()
+
+class ExportWriter:
+    """
+    Base class of an output format, which streams the output for a book as a series of chunks (strings)
+    rather than building it all in memory, so many books (or formats) can be written one chunk at a time.
+    Subclasses set name and ext and implement chunks() (and header() if the format has one).
+    """
+    name = None     # name of format (as used in settings files)
+    ext = None      # file extension of format (including '.')
+    latest = False  # whether the format can output just the latest items of a book (see Exporter.exportBook())
+
+    def header(self):
+        """
+        Returns:
+            (str): chunk to write once at the start of each file (or None if the format has no header)
+        """
+        return None
+
+    def chunks(self, export):
+        """
+        generator yielding the output for a single book as a series of strings
+
+        Args:
+            export (BookExport): book to output
+        """
+        raise NotImplementedError
+
+class MarkdownWriter(ExportWriter):
+    """
+    Outputs books as markdown (rendered by the provided function)
+    """
+    name = "md"
+    ext = ".md"
+
+    def __init__(self, renderMarkdown, omitNotes=False):
+        """
+        Args:
+            renderMarkdown (function): function converting (dict created by Book.toDict(), chapters, omitNotes)
+                to a markdown string (e.g. marky.jsonToMarkdown)
+            omitNotes (bool): Optional; whether to omit the user's typed notes
+        """
+        self.renderMarkdown = renderMarkdown
+        self.omitNotes = omitNotes
+
+    def chunks(self, export):
+        yield self.renderMarkdown(export.getDict(), export.chapters, self.omitNotes)
+
+class CsvWriter(ExportWriter):
+    """
+    Outputs books as csv rows (see Book.iterCSV())
+    """
+    name = "csv"
+    ext = ".csv"
+    latest = True
+
+    def __init__(self):
+        self.buf = io.StringIO() # (each row is formatted here before it's yielded)
+        self.writer = csv.writer(self.buf)
+
+    def _formatRow(self, row):
+        """
+        Returns:
+            (str): provided row formatted as a line of csv
+        """
+        self.buf.seek(0)
+        self.buf.truncate()
+        self.writer.writerow(row)
+        return self.buf.getvalue()
+
+    def header(self):
+        return self._formatRow(DataStructures.CSV_HEADER)
+
+    def chunks(self, export):
+        for row in export.getRows():
+            yield self._formatRow(row)
+
+class JsonlWriter(ExportWriter):
+    """
+    Outputs each item (highlight/note/bookmark) of books as a line of json (including the name of its book)
+    """
+    name = "jsonl"
+    ext = ".jsonl"
+
+    def chunks(self, export):
+        bookName = export.book.getName()
+        for item in export.getDict()["items"]:
+            yield json.dumps(dict(item, book=bookName), ensure_ascii=False) + "\n"
+
+class AnkiWriter(ExportWriter):
+    """
+    Outputs each highlight of books as a flashcard in a tab separated file that can be imported into Anki
+    (front: the highlight, back: its associated note (if any) and the book/location it's from)
+    """
+    name = "anki"
+    ext = ".anki.tsv"
+
+    def header(self):
+        # (tells Anki how to import the file)
+        return "#separator:tab\n#html:true\n#columns:Front\tBack\n"
+
+    def chunks(self, export):
+        source = "<i>{}</i>".format(AnkiWriter._escape(export.book.getName()))
+        for row in export.getRows():
+            highlight, note, loc = row[0], row[1], row[2]
+            if highlight == "":
+                continue
+            back = "" if note == "" else AnkiWriter._escape(note) + "<br><br>"
+            yield "{}\t{}{} [loc {}]\n".format(AnkiWriter._escape(highlight), back, source, loc)
+
+    @staticmethod
+    def _escape(text):
+        """
+        Returns:
+            (str): provided text as html which fits in a single field of the file
+        """
+        return html.escape(text).replace("\t", " ").replace("\r\n", "<br>").replace("\n", "<br>")
+
+# writer classes of each format that doesn't need any arguments
+WRITER_CLASSES = {cls.name: cls for cls in [CsvWriter, JsonlWriter, AnkiWriter]}
+FORMATS = ["md"] + list(WRITER_CLASSES) # names of every available format
+
+def getWriters(renderMarkdown=None, omitNotes=False):
+    """
+    creates a writer of each available format
+
+    Args:
+        renderMarkdown (function): Optional; function rendering markdown (see MarkdownWriter), markdown isn't available if not provided
+        omitNotes (bool): Optional; whether to omit the user's typed notes from markdown
+    Returns:
+        (dict): mapping format name -> ExportWriter
+    """
+    writers = {name: cls() for name, cls in WRITER_CLASSES.items()}
+    if renderMarkdown != None:
+        writers["md"] = MarkdownWriter(renderMarkdown, omitNotes)
+    return writers
+
+def getGroupFormats(groupSettings):
+    """
+    determines the formats a settings group (see marky.updateSettings()) outputs.
+    A group may list formats explicitly e.g. "formats": ["md", "anki"] (a file for each book in each format)
+    and "combined": {"jsonl": "all.jsonl"} (a single file for the whole group per format), otherwise
+    (and additionally) its outputMD/outputCSV and combinedMD/combinedCSV settings are used.
+
+    Args:
+        groupSettings (dict): settings of group
+    Returns:
+        (tuple): (list of format names of files for each book, dict mapping format name -> combined filename)
+    Raises:
+        ValueError: if the group contains an unknown format
+    """
+    formats = list(groupSettings.get("formats", []))
+    combined = dict(groupSettings.get("combined", {}))
+    for name, outputKey, combinedKey in [("md", "outputMD", "combinedMD"), ("csv", "outputCSV", "combinedCSV")]:
+        if groupSettings.get(outputKey) == True and name not in formats:
+            formats.append(name)
+        if groupSettings.get(combinedKey, "").strip() != "":
+            combined.setdefault(name, groupSettings[combinedKey].strip())
+    for name in formats + list(combined):
+        if name not in FORMATS:
+            raise ValueError("unknown output format '{}' (available formats: {})".format(name, FORMATS))
+    return (formats, combined)
+
+class Exporter:
+    """
+    Writes books to files in any number of formats, traversing each book only once for all of them.
+    Combined files (containing every book exported) are kept open until close() is called.
+    """
+    def __init__(self, outFolder, writers, formats, combined={}):
+        """
+        Args:
+            outFolder (str): path of folder to output files in
+            writers (dict): mapping format name -> ExportWriter (see getWriters())
+            formats (list of str): names of formats to output a file for each book in
+            combined (dict): Optional; mapping format name -> filename (in outFolder) of a file to output every book in
+        """
+        self.outFolder = outFolder
+        self.writers = writers
+        self.formats = formats
+        self.combined = combined
+        self.combinedFiles = {} # dict mapping format name -> open combined file
+        self.created = []       # paths of files created so far
+
+    def exportBook(self, book, chapters=[], latestBook=None):
+        """
+        outputs a book in every format
+
+        Args:
+            book (DataStructures.Book): book to output
+            chapters (list of dicts): Optional; chapters of the book (see marky.jsonToMarkdown())
+            latestBook (DataStructures.Book): Optional; part of the book to output instead of the whole book
+                in formats that support it, i.e. csv (e.g. only the items added since the book was last output)
+        Returns:
+            (list of str): paths of the files created (combined files are only listed the first time)
+        """
+        numCreated = len(self.created)
+        export = BookExport(book, chapters)
+        latestExport = export if latestBook == None else BookExport(latestBook, chapters)
+        fname = book.getName().replace("/", "|") # (sanitized for output filename)
+        for name in self.formats:
+            path = os.path.join(self.outFolder, fname + self.writers[name].ext)
+            with open(path, 'w') as f:
+                self._write(f, self.writers[name], latestExport if self.writers[name].latest else export, header=True)
+            self.created.append(path)
+        for name in self.combined:
+            f = self.combinedFiles.get(name)
+            if f == None:
+                path = os.path.join(self.outFolder, self.combined[name])
+                f = self.combinedFiles[name] = open(path, 'w')
+                self.created.append(path)
+            self._write(f, self.writers[name], latestExport if self.writers[name].latest else export, header=(f.tell() == 0))
+        return self.created[numCreated:]
+
+    @staticmethod
+    def _write(f, writer, export, header):
+        """
+        writes a book to an open file using the provided ExportWriter
+        """
+        if header and writer.header() != None:
+            f.write(writer.header())
+        for chunk in writer.chunks(export):
+            f.write(chunk)
+
+    def close(self):
+        """
+        closes any combined files
+        """
+        for f in self.combinedFiles.values():
+            f.close()
+        self.combinedFiles = {}
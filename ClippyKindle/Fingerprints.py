@@ -0,0 +1,94 @@
+import re
+import hashlib
+
+NORMALIZE_PATTERN = re.compile(r"\W+") # runs of characters ignored when comparing content
+MAX_BOOKS_PER_PRINT = 8 # fingerprints shared by more books than this (e.g. "the end") are ignored
+
+def normalizeContent(content):
+    """
+    Returns:
+        (str): provided highlight/note content with case, punctuation and whitespace differences removed
+    """
+    return NORMALIZE_PATTERN.sub(" ", content.lower()).strip()
+
+def fingerprint(content):
+    """
+    Returns:
+        (int): 64 bit hash of the normalized content of a highlight/note (or None if it has no content)
+    """
+    normalized = normalizeContent(content)
+    if normalized == "":
+        return None
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big")
+
+def bookFingerprints(book):
+    """
+    Returns:
+        (set of int): fingerprints of the highlights and notes in the provided Book
+    """
+    prints = set(fingerprint(obj.content) for obj in book.highlights + book.notes)
+    prints.discard(None)
+    return prints
+
+def findSimilarBooks(bookList, minRatio=0.5, minShared=3):
+    """
+    finds pairs of books sharing a large fraction of their highlights/notes (e.g. the same book re-downloaded,
+    or a different edition) using an index of content fingerprints, so the whole collection is processed in
+    (near) linear time rather than by comparing each pair of books.
+
+    Args:
+        bookList (:type listOfObjects: DataStructures.Book) list of Book objects to search
+        minRatio (float): Optional; min fraction of the smaller book's fingerprints that must be shared
+        minShared (int): Optional; min number of fingerprints that must be shared
+    Returns:
+        (list of tuples): (int index of larger book, int index of smaller book, int number shared, float ratio)
+            for each pair of similar books (indices into bookList), most similar first
+    """
+    prints = [bookFingerprints(book) for book in bookList]
+    index = {} # dict mapping fingerprint -> list of indices of books containing it
+    for bookIndex, bookPrints in enumerate(prints):
+        for fp in bookPrints:
+            index.setdefault(fp, []).append(bookIndex)
+
+    shared = {} # dict mapping (book index, book index) -> number of fingerprints shared
+    for bookIndices in index.values():
+        if len(bookIndices) < 2 or len(bookIndices) > MAX_BOOKS_PER_PRINT:
+            continue
+        for i in range(len(bookIndices)):
+            for j in range(i+1, len(bookIndices)):
+                pair = (bookIndices[i], bookIndices[j])
+                shared[pair] = shared.get(pair, 0) + 1
+
+    res = []
+    for (a, b), count in shared.items():
+        ratio = count / min(len(prints[a]), len(prints[b]))
+        if count >= minShared and ratio >= minRatio:
+            larger, smaller = (a, b) if len(prints[a]) >= len(prints[b]) else (b, a)
+            res.append((larger, smaller, count, ratio))
+    res.sort(key=lambda tup: (tup[3], tup[2]), reverse=True)
+    return res
+
+def mergeBooks(target, other):
+    """
+    merges the items of a Book into another (skipping highlights/notes whose content target already contains
+    and bookmarks at locations target already has bookmarked)
+
+    Args:
+        target (DataStructures.Book): Book to merge items into
+        other (DataStructures.Book): Book to merge items from (left unchanged)
+    Returns:
+        (int): number of items added to target
+    """
+    existing = bookFingerprints(target)
+    numBefore = len(target.highlights) + len(target.notes) + len(target.bookmarks)
+    for obj in other.highlights + other.notes:
+        fp = fingerprint(obj.content)
+        if fp == None or fp not in existing:
+            target.addItem(obj)
+            existing.add(fp)
+    bookmarkLocs = set(obj.loc for obj in target.bookmarks)
+    for obj in other.bookmarks:
+        if obj.loc not in bookmarkLocs:
+            target.addItem(obj)
+            bookmarkLocs.add(obj.loc)
+    return len(target.highlights) + len(target.notes) + len(target.bookmarks) - numBefore
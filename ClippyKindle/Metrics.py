@@ -0,0 +1,126 @@
+import os
+import json
+import time
+
+METRIC_PREFIX = "clippykindle_" # prefix of every metric name (in prometheus format)
+METRICS_FORMATS = ["prometheus", "json"] # supported formats of metrics files
+
+class Metrics:
+    """
+    Machine readable metrics of a single run of one of the scripts (e.g. for alerting on nightly jobs),
+    written as a prometheus textfile (for node_exporter's textfile collector) or as json.
+    Every metric is a gauge (its value for this run), optionally with a single label (e.g. the stage or item type).
+    """
+    def __init__(self, tool):
+        """
+        Args:
+            tool (str): name of script the metrics are of (e.g. "clippy"), added as a label of every metric
+        """
+        self.tool = tool
+        self.start = time.time()
+        self.startPerf = time.perf_counter()
+        self.samples = {} # dict mapping metric name -> {"help": str, "label": str or None, "values": {label value (or None) -> number}}
+
+    def set(self, name, value, help, label=None, labelValue=None):
+        """
+        sets the value of a metric
+
+        Args:
+            name (str): name of metric (without METRIC_PREFIX) e.g. "parse_errors"
+            value (int or float): value of metric
+            help (str): description of metric
+            label (str): Optional; name of label distinguishing values of the metric (e.g. "type")
+            labelValue (str): Optional; value of label for this value (e.g. "highlight")
+        """
+        sample = self.samples.setdefault(name, {"help": help, "label": label, "values": {}})
+        sample["values"][labelValue] = value
+
+    def addBytes(self, name, paths, help):
+        """
+        sets a metric to the total size of the provided files (or folders) that exist (each counted once)
+        """
+        total = 0
+        for path in set(paths):
+            if os.path.isdir(path):
+                total += sum(os.path.getsize(os.path.join(folder, fname)) for folder, _, fnames in os.walk(path) for fname in fnames)
+            elif os.path.isfile(path):
+                total += os.path.getsize(path)
+        self.set(name, total, help)
+
+    def addProfiler(self, profiler):
+        """
+        adds the time (and call/item counts) recorded for each stage by a Profiler.Profiler
+        """
+        for stage, data in profiler.stages.items():
+            self.set("stage_duration_seconds", round(data["time"], 6), "wall time spent in each stage", "stage", stage)
+            self.set("stage_calls", data["calls"], "number of calls of each stage", "stage", stage)
+            self.set("stage_items", data["items"], "number of items processed by each stage", "stage", stage)
+
+    def finish(self):
+        """
+        adds the duration and resource usage of the run so far (call just before writing the metrics)
+        """
+        self.set("run_timestamp_seconds", round(self.start), "unix time the run started")
+        self.set("run_duration_seconds", round(time.perf_counter() - self.startPerf, 6), "wall time of the run")
+        try:
+            import resource # (unix only)
+        except ImportError:
+            return
+        # (ru_maxrss is in KiB on linux but bytes on macOS)
+        scale = 1 if os.uname().sysname == "Darwin" else 1024
+        self.set("peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, "peak resident memory of the run's process")
+        self.set("children_peak_rss_bytes", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+            "peak resident memory of the largest worker process (0 if none)")
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.set("cpu_seconds", round(usage.ru_utime + usage.ru_stime, 6), "cpu time of the run's process (user + system)")
+
+    def toPrometheus(self):
+        """
+        Returns:
+            (str): metrics in the prometheus text exposition format
+        """
+        lines = []
+        for name, sample in self.samples.items():
+            fullName = METRIC_PREFIX + name
+            lines.append("# HELP {} {}".format(fullName, sample["help"]))
+            lines.append("# TYPE {} gauge".format(fullName))
+            for labelValue, value in sample["values"].items():
+                labels = 'tool="{}"'.format(self.tool)
+                if labelValue != None:
+                    labels += ',{}="{}"'.format(sample["label"], _escapeLabel(labelValue))
+                lines.append("{}{{{}}} {}".format(fullName, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def toDict(self):
+        """
+        Returns:
+            (dict): metrics as a dict mapping metric name -> value (or dict mapping label value -> value for labelled metrics)
+        """
+        return {"tool": self.tool, "metrics": {name: (sample["values"][None] if sample["label"] == None else dict(sample["values"]))
+            for name, sample in self.samples.items()}}
+
+    def write(self, path, fmt=None):
+        """
+        writes the metrics to a file (atomically, so collectors never read a partially written file)
+
+        Args:
+            path (str): path of file to write
+            fmt (str): Optional; format of file (see METRICS_FORMATS), by default json if path ends with ".json" otherwise prometheus
+        """
+        fmt = fmt if fmt != None else ("json" if path.lower().endswith(".json") else "prometheus")
+        if fmt not in METRICS_FORMATS:
+            raise ValueError("unknown metrics format '{}' (expected one of {})".format(fmt, METRICS_FORMATS))
+        tmpPath = path + ".tmp"
+        with open(tmpPath, 'w') as f:
+            if fmt == "json":
+                json.dump(self.toDict(), f, indent=2)
+            else:
+                f.write(self.toPrometheus())
+        os.replace(tmpPath, path)
+
+def _escapeLabel(value):
+    """
+    Returns:
+        (str): provided label value escaped for the prometheus text format
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
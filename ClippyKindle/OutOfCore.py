@@ -0,0 +1,227 @@
+import os
+import json
+import heapq
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+from ClippyKindle.Profiler import PROFILER
+from ClippyKindle.Compression import openFile
+
+ITEM_OVERHEAD_BYTES = 400 # estimated memory used by a parsed item (in addition to the size of its section of the clippings file)
+MAX_OPEN_RUNS = 32        # max number of run files of a book (more are merged into one, so merging never opens too many files)
+ITEM_CLASSES = {"highlight": DataStructures.Highlight, "note": DataStructures.Note, "bookmark": DataStructures.Bookmark}
+
+class SpillCollection:
+    """
+    Holds a collection too large to fit in memory: whenever the (estimated) memory used by the items parsed so far
+    exceeds a budget, they're spilled to a temporary "run" file per book (sorted, one item per line) and removed
+    from their Book objects (see ClippyKindle.parseClippings()). Books are then sorted and deduplicated one at a time
+    (see writeJson()), books too large for the budget themselves by merging their run files as streams.
+    """
+    def __init__(self, memoryBudget, tmpFolder=None):
+        """
+        Args:
+            memoryBudget (int): max (estimated) number of bytes of parsed items to hold in memory at once
+            tmpFolder (str): Optional; folder to create the temporary folder for run files in (default: see tempfile.mkdtemp())
+        """
+        self.memoryBudget = memoryBudget
+        self.folder = tempfile.mkdtemp(prefix="clippy-", dir=tmpFolder) # (removed by close())
+        self.memoryUsed = 0 # estimated number of bytes of items held in memory (since they were last spilled)
+        self.books = {}     # dict mapping book name -> dict with its "title", "author", "runs" (paths of run files),
+                            #   "size" (estimated number of bytes of its items), "items" (number of items)
+                            #   and "counts" (dict mapping item type -> number of items of that type)
+        self.numRuns = 0    # number of run files created so far (used to name them)
+
+    def __len__(self):
+        """
+        Returns:
+            (int): number of books in the collection
+        """
+        return len(self.books)
+
+    def add(self, allBooks, numBytes):
+        """
+        accounts for an item just parsed into one of the provided books, spilling every book's items if over budget
+
+        Args:
+            allBooks (iterable of DataStructures.Book): books being parsed
+            numBytes (int): size of the item's section of the clippings file
+        """
+        self.memoryUsed += ITEM_OVERHEAD_BYTES + numBytes
+        if self.memoryUsed > self.memoryBudget:
+            self.spill(allBooks)
+
+    def spill(self, allBooks):
+        """
+        writes the items of the provided books to a new run file per book (in sorted order, see Book.sort())
+        and removes them from the books (call after parsing to spill the items remaining in memory)
+
+        Args:
+            allBooks (iterable of DataStructures.Book): books being parsed
+        """
+        with PROFILER.stage("spill"):
+            for book in allBooks:
+                info = self.books.setdefault(book.getName(), {"title": book.title, "author": book.author, "runs": [], "size": 0, "items": 0,
+                    "counts": {itemType: 0 for itemType in ITEM_CLASSES}})
+                numItems = len(book.highlights) + len(book.notes) + len(book.bookmarks)
+                if numItems == 0:
+                    continue
+                PROFILER.count("spill", calls=0, items=numItems)
+                book.sort(removeDups=False)
+                info["runs"].append(self._writeRun(heapq.merge(book.highlights, book.notes, book.bookmarks, key=DataStructures.sortKey)))
+                info["size"] += sum(ITEM_OVERHEAD_BYTES + len(obj.content) for obj in book.highlights + book.notes) + ITEM_OVERHEAD_BYTES * len(book.bookmarks)
+                info["items"] += numItems
+                for itemType, objs in zip(ITEM_CLASSES, [book.highlights, book.notes, book.bookmarks]):
+                    info["counts"][itemType] += len(objs)
+                book.highlights, book.notes, book.bookmarks = [], [], []
+                book.sorted = False
+                if len(info["runs"]) > MAX_OPEN_RUNS:
+                    # (stable merge, so items with equal sort keys stay in the order they were parsed)
+                    runs = info["runs"]
+                    info["runs"] = [self._writeRun(heapq.merge(*[self._iterRun(run) for run in runs], key=DataStructures.sortKey))]
+                    for run in runs:
+                        os.remove(run)
+        self.memoryUsed = 0
+
+    def _writeRun(self, objs):
+        """
+        Returns:
+            (str): path of a new run file containing the provided (sorted) Highlight/Note/Bookmark objects
+        """
+        path = os.path.join(self.folder, "{}.jsonl".format(self.numRuns))
+        self.numRuns += 1
+        with open(path, 'w') as f:
+            for obj in objs:
+                f.write(json.dumps(obj.toDict()) + "\n")
+        return path
+
+    @staticmethod
+    def _iterRun(path, itemType=None):
+        """
+        generator yielding the Highlight/Note/Bookmark objects in a run file (optionally only those of one type)
+        """
+        with open(path) as f:
+            for line in f:
+                d = json.loads(line)
+                if itemType == None or d["type"] == itemType:
+                    yield ITEM_CLASSES[d["type"]].fromDict(d)
+
+    def _iterItems(self, info, itemType):
+        """
+        Returns:
+            (iterator): sorted stream of a book's items of the provided type (merged from its run files)
+        """
+        return heapq.merge(*[SpillCollection._iterRun(run, itemType) for run in info["runs"]], key=DataStructures.sortKey)
+
+    def loadBook(self, name):
+        """
+        Returns:
+            (DataStructures.Book): sorted book with the provided name, loaded from its run files (duplicates are not removed)
+        """
+        info = self.books[name]
+        book = DataStructures.Book(info["title"], info["author"])
+        book.highlights, book.notes, book.bookmarks = (list(self._iterItems(info, itemType)) for itemType in ITEM_CLASSES)
+        book.sorted = True
+        return book
+
+    def writeJson(self, path, removeDups=True, dedupCache=None, audit=None):
+        """
+        writes the collection to a json file (identical to the collection.json written for the same books in memory),
+        processing one book at a time. Books whose items fit within the memory budget are loaded and sorted as usual
+        (see Book.sort()), the items of larger books are streamed from their run files (see _writeLargeBook()).
+
+        Args:
+            path (str): path of json file to write (e.g. "collection.json", compressed if its extension is e.g. ".gz")
+            removeDups, dedupCache, audit: see Book.sort()
+        Returns:
+            (list of DataStructures.BookSummary): summary of each book written (see Book.getSummary())
+        """
+        summaries = []
+        with openFile(path, 'w') as f:
+            f.write("[")
+            for i, name in enumerate(self.books):
+                f.write("\n  " if i == 0 else ",\n  ")
+                info = self.books[name]
+                if info["size"] <= self.memoryBudget:
+                    book = self.loadBook(name)
+                    book.sort(removeDups=removeDups, dedupCache=dedupCache, audit=audit)
+                    d = book.toDict()
+                    f.write(_indent(json.dumps(d, indent=2), "  "))
+                    summaries.append(book.getSummary(d))
+                else:
+                    with PROFILER.stage("external merge", items=info["items"], book=name if PROFILER.enabled else None):
+                        summaries.append(self._writeLargeBook(f, name, removeDups, dedupCache, audit))
+            f.write("\n]" if len(self.books) > 0 else "]")
+        return summaries
+
+    def _writeLargeBook(self, f, name, removeDups, dedupCache, audit):
+        """
+        writes a book too large for the memory budget to an open collection json file (see writeJson()),
+        in two passes over its items: the first merges (and deduplicates) them into a single run file while finding
+        its date range, and the second writes them after the book's dates (as they come first in the output).
+
+        Returns:
+            (DataStructures.BookSummary): summary of the book written
+        """
+        info = self.books[name]
+        compare, onRemove = DataStructures.getDedupFunctions(name, dedupCache, audit)
+        streams = []
+        for itemType in ITEM_CLASSES:
+            objs = self._iterItems(info, itemType)
+            streams.append(DataStructures.iterWithoutDuplicates(objs, compare, onRemove) if removeDups else objs)
+        counts = {itemType: 0 for itemType in ITEM_CLASSES}
+        dateStart, dateEnd = None, None # min/max timestamps of items
+        contentHash = hashlib.blake2b(digest_size=16) # (computed incrementally, see Book.getSummary())
+        contentHash.update(b"[")
+        locType = None
+        mergedPath = os.path.join(self.folder, "merged.jsonl")
+        with open(mergedPath, 'w') as merged:
+            for obj in heapq.merge(*streams, key=DataStructures.sortKey):
+                d = obj.toDict()
+                merged.write(json.dumps(d) + "\n")
+                contentHash.update(((", " if locType != None else "") + json.dumps(d, sort_keys=True)).encode("utf-8"))
+                locType = d["locType"] if locType == None else locType
+                counts[d["type"]] += 1
+                timestamp = obj.date.timestamp()
+                dateStart = timestamp if dateStart == None else min(dateStart, timestamp)
+                dateEnd = timestamp if dateEnd == None else max(dateEnd, timestamp)
+        contentHash.update(b"]")
+        PROFILER.count("dedup", calls=0, items=info["items"] - sum(counts.values()))
+
+        header = {"title": info["title"], "author": info["author"],
+                "dateStart": None if dateStart == None else ClippyKindle.dateToStr(datetime.fromtimestamp(dateStart)),
+                "dateEnd": ClippyKindle.dateToStr(datetime.fromtimestamp(max(dateEnd or 0, 0))), "items": []}
+        # (header is the book's dict without its items, which are inserted between its last 2 lines)
+        headerLines = _indent(json.dumps(header, indent=2), "  ").split("\n")
+        f.write("\n".join(headerLines[:-2]))
+        with open(mergedPath) as merged:
+            if locType == None:
+                f.write("\n" + headerLines[-2])
+            else:
+                f.write('\n    "items": [')
+                for i, line in enumerate(merged):
+                    f.write(("\n      " if i == 0 else ",\n      ") + _indent(json.dumps(json.loads(line), indent=2), "      "))
+                f.write("\n    ]")
+        f.write("\n" + headerLines[-1])
+        os.remove(mergedPath)
+        return DataStructures.BookSummary(dict({key: header[key] for key in ["title", "author", "dateStart", "dateEnd"]},
+            name=name, highlights=counts["highlight"], notes=counts["note"], bookmarks=counts["bookmark"],
+            locType=locType, hash=contentHash.hexdigest()))
+
+    def close(self):
+        """
+        deletes the run files
+        """
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+def _indent(text, prefix):
+    """
+    Returns:
+        (str): provided text with prefix added to the start of each line but the first
+            (for nesting the output of json.dumps(indent=2) within a larger json document)
+    """
+    return text.replace("\n", "\n" + prefix)
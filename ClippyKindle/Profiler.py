@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+
+class Profiler:
+    """
+    Lightweight instrumentation for recording the wall time, call counts and item counts
+    of each stage of the pipeline (reading, parsing, sorting, removing duplicates, outputting...)
+    Recording is disabled by default so the instrumented code paths cost (almost) nothing.
+    """
+    def __init__(self):
+        """
+        Initialize a (disabled) Profiler object.
+        """
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """
+        clears all recorded data
+        """
+        self.stages = {} # dict mapping stage name -> {"time": float, "calls": int, "items": int}
+        self.books = {}  # dict mapping book name -> {stage name: float seconds spent on that book}
+
+    @contextmanager
+    def stage(self, name, items=0, book=None):
+        """
+        context manager timing the code within it as (one call of) the provided stage
+        e.g. `with PROFILER.stage("sort", items=len(arr)): ...`
+
+        Args:
+            name (str): name of stage being timed
+            items (int): Optional; number of items processed in this call of the stage
+            book (str): Optional; name of the book this time should (also) be attributed to
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, items=items, book=book)
+
+    def add(self, name, seconds, calls=1, items=0, book=None):
+        """
+        records time/calls/items spent on a stage (use when a context manager is inconvenient)
+        """
+        if not self.enabled:
+            return
+        data = self.stages.setdefault(name, {"time": 0.0, "calls": 0, "items": 0})
+        data["time"] += seconds
+        data["calls"] += calls
+        data["items"] += items
+        if book != None:
+            bookData = self.books.setdefault(book, {})
+            bookData[name] = bookData.get(name, 0.0) + seconds
+
+    def count(self, name, calls=1, items=0):
+        """
+        records call/item counts for a stage without timing it
+        """
+        self.add(name, 0.0, calls=calls, items=items)
+
+    def report(self):
+        """
+        Returns:
+            (str): table of the recorded stages (in the order they were first recorded)
+        """
+        rows = [("stage", "time (s)", "calls", "items")]
+        for name, data in self.stages.items():
+            rows.append((name, "{:.4f}".format(data["time"]), str(data["calls"]), str(data["items"])))
+        return _formatTable(rows)
+
+    def pruneReport(self, names):
+        """
+        Args:
+            names (list of str): names of stages recorded as a cascade of filters, each with
+                calls = number of candidates checked and items = number of those ruled out (e.g. DataStructures.SIMILARITY_TIERS)
+        Returns:
+            (str): table of the fraction of candidates each stage ruled out (or None if none were recorded)
+        """
+        rows = [("stage", "checked", "ruled out", "rate")]
+        for name in names:
+            data = self.stages.get(name, {"calls": 0, "items": 0})
+            rate = "-" if data["calls"] == 0 else "{:.1%}".format(data["items"] / data["calls"])
+            rows.append((name, str(data["calls"]), str(data["items"]), rate))
+        if all(name not in self.stages for name in names):
+            return None
+        return _formatTable(rows)
+
+    def bookReport(self, limit=10):
+        """
+        Args:
+            limit (int): Optional; max number of books to list
+        Returns:
+            (str): table of the books that took the longest to process (slowest first)
+        """
+        stageNames = []
+        for bookData in self.books.values():
+            stageNames += [name for name in bookData if name not in stageNames]
+        totals = sorted(self.books.items(), key=lambda pair: sum(pair[1].values()), reverse=True)
+        rows = [tuple(["book", "total (s)"] + stageNames)]
+        for bookName, bookData in totals[:limit]:
+            rows.append(tuple([bookName, "{:.4f}".format(sum(bookData.values()))] +
+                ["{:.4f}".format(bookData.get(name, 0.0)) for name in stageNames]))
+        return _formatTable(rows)
+
+PROFILER = Profiler() # shared instance used by the instrumented code
+
+def _formatTable(rows):
+    """
+    helper function for formatting a list of tuples (the first being the header) as an aligned text table
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for index, row in enumerate(rows):
+        lines.append("  ".join(val.ljust(widths[i]) for i, val in enumerate(row)).rstrip())
+        if index == 0:
+            lines.append("  ".join("-" * w for w in widths))
+    return "\n".join(lines)
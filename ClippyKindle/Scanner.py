@@ -0,0 +1,171 @@
+import os
+import mmap
+
+SEPARATOR = b"==========" # line separating each section of a clippings file
+# (utf-8 encoded) invisible characters kindles sprinkle into clippings files (e.g. at the start of book titles)
+#   which are stripped from each section: byte order mark, and zero width space
+WEIRD_CHARS = [b"\xef\xbb\xbf", b"\xe2\x80\x8b"]
+
+class SectionScanner:
+    """
+    Low level scanner for a "My Clippings.txt" file, which memory maps the file and locates the byte offsets
+    of each section (the lines between two "==========" lines) without decoding it.
+    Sections are only decoded (and stripped of WEIRD_CHARS) when their lines are requested.
+    (compressed files are decompressed into memory instead, or into a temporary file if tmpFolder is provided,
+    see Compression.detectCompression())
+    """
+    def __init__(self, fname, tmpFolder=None):
+        """
+        Opens (and memory maps) the provided clippings file.
+
+        Args:
+            fname (str): file path to txt file to scan (e.g. "My Clippings.txt" or "My Clippings.txt.gz")
+            tmpFolder (str): Optional; folder to decompress a compressed file into (which is then memory mapped),
+                so it isn't held in memory (e.g. when parsing within a memory budget)
+        """
+        # (imported here so "python -m ClippyKindle.Compression" works)
+        from ClippyKindle.Compression import readDecompressed, decompressToFile
+        self.fname = fname
+        self.f = None
+        self.tmpPath = None # path of the decompressed copy of the file (if any, deleted by close())
+        if tmpFolder != None:
+            self.tmpPath = decompressToFile(fname, tmpFolder)
+        else:
+            self.data = readDecompressed(fname)
+            if self.data != None:
+                return
+        self.f = open(fname if self.tmpPath == None else self.tmpPath, 'rb')
+        if os.fstat(self.f.fileno()).st_size == 0:
+            self.data = b"" # (empty files can't be memory mapped)
+        else:
+            self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        """
+        Returns:
+            (int): size of the file in bytes
+        """
+        return len(self.data)
+
+    def iterSections(self, start=0):
+        """
+        generator yielding the location of each section in the file as a tuple (int start, int end, bool complete)
+        where start and end are byte offsets (see getLines()). The final tuple yielded has complete=False
+        and refers to any data after the last separator (which may be empty).
+
+        Args:
+            start (int): Optional; byte offset to start scanning from (must be the start of a section)
+        """
+        data, pos = self.data, start
+        while True:
+            pos = data.find(SEPARATOR, pos)
+            if pos == -1:
+                break
+            lineEnd = pos + len(SEPARATOR)
+            # separator must be a line of its own:
+            if (pos != 0 and data[pos-1:pos] not in (b"\n", b"\r")) or data[lineEnd:lineEnd+1] not in (b"", b"\n", b"\r"):
+                pos += 1
+                continue
+            yield (start, pos, True)
+            pos = lineEnd + (2 if data[lineEnd:lineEnd+2] == b"\r\n" else (1 if lineEnd < len(data) else 0))
+            start = pos
+        yield (start, len(data), False)
+
+    def getLines(self, start, end):
+        """
+        decodes the lines of a section (see iterSections())
+
+        Args:
+            start (int): byte offset where section starts
+            end (int): byte offset where section ends
+        Returns:
+            (list of str): lines in section (without line endings, including empty lines)
+        """
+        raw = self.data[start:end]
+        for char in WEIRD_CHARS:
+            if char in raw:
+                raw = raw.replace(char, b"")
+        if len(raw) == 0:
+            return []
+        text = raw.decode("utf-8")
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop() # (last line ended with a line break rather than starting a new line)
+        return lines
+
+    def _iterNonEmptyLines(self, start, end):
+        """
+        generator decoding (only as many as requested of) the non empty lines of a section (see iterSections())
+        """
+        pos = start
+        while pos < end:
+            lineEnd = self.data.find(b"\n", pos, end)
+            lineEnd = end if lineEnd == -1 else lineEnd
+            line = self.data[pos:lineEnd]
+            for char in WEIRD_CHARS:
+                line = line.replace(char, b"")
+            line = line.rstrip(b"\r")
+            if len(line) != 0:
+                yield line.decode("utf-8")
+            pos = lineEnd + 1
+
+    def getTitle(self, start, end):
+        """
+        decodes just the title (first non empty line) of a section (see iterSections())
+
+        Returns:
+            (str): title line of section (or None if the section is empty)
+        """
+        return next(self._iterNonEmptyLines(start, end), None)
+
+    def getHeader(self, start, end):
+        """
+        decodes just the title and metadata line (first two non empty lines) of a section (see iterSections())
+        e.g. ("Sinsajo (Suzanne Collins)", "- Your Highlight on Location 4749-4749 | Added on Saturday, January 4, 2020 10:20:02 AM")
+
+        Returns:
+            (tuple): (str title line, str metadata line) either of which may be None if the section is missing it
+        """
+        lines = self._iterNonEmptyLines(start, end)
+        return (next(lines, None), next(lines, None))
+
+    def countLines(self, start, end):
+        """
+        counts the lines of a section without decoding it
+
+        Returns:
+            (int): number of lines in section (equal to len(getLines(start, end)))
+        """
+        if start == end:
+            return 0
+        raw = self.data[start:end] # (mmap objects have no count())
+        return raw.count(b"\n" if b"\n" in raw else b"\r") + (0 if raw[-1:] in (b"\n", b"\r") else 1)
+
+    def countItemsPerBook(self):
+        """
+        quickly counts the number of sections (highlights, notes, and bookmarks) for each book in the file
+        (only the title line of each section is decoded)
+
+        Returns:
+            (dict): mapping each book's title/author string to its number of sections
+        """
+        counts = {}
+        for start, end, complete in self.iterSections():
+            title = self.getTitle(start, end) if complete else None
+            if title != None:
+                counts[title] = counts.get(title, 0) + 1
+        return counts
+
+    def close(self):
+        """
+        closes the file
+        """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.f != None:
+            self.f.close()
+        if self.tmpPath != None:
+            os.remove(self.tmpPath)
+            self.tmpPath = None
@@ -0,0 +1,166 @@
+import os
+import re
+import hashlib
+import sqlite3
+
+from ClippyKindle.Compression import stripCompressionExt
+
+TOKEN_PATTERN = re.compile(r"\w+") # (unicode aware) pattern matching a single token of text
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)') # pattern matching a quoted phrase or single term of a query
+
+def tokenize(text):
+    """
+    Returns:
+        (list of str): the (lowercase) tokens in the provided text
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def getIndexPath(collectionPath):
+    """
+    Returns:
+        (str): path of the search index stored next to the provided collection (e.g. "collection.json" -> "collection.search.sqlite")
+    """
+    return os.path.splitext(stripCompressionExt(collectionPath))[0] + ".search.sqlite"
+
+class SearchIndex:
+    """
+    Persistent (sqlite) inverted index mapping each token in the highlights/notes of a collection
+    to the items (and positions within them) it appears in, supporting word, prefix (e.g. 'tyran*')
+    and phrase (e.g. '"electric sheep"') queries without loading the collection itself.
+    """
+    def __init__(self, fname):
+        """
+        Opens (or creates) a SearchIndex stored in the provided file.
+
+        Args:
+            fname (str): file path of sqlite database to use (see getIndexPath())
+        """
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, hash TEXT UNIQUE,
+                book TEXT, type TEXT, loc INTEGER, locType TEXT, dateStr TEXT, content TEXT)""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS postings (token TEXT, itemId INTEGER, pos INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS postings_token ON postings (token, itemId)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS postings_item ON postings (itemId)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_book ON items (book)")
+
+    @staticmethod
+    def itemHash(bookName, d):
+        """
+        Returns:
+            (str): hash identifying an item (dict created by toDict()) within the provided book
+        """
+        key = "\n".join([bookName, d["type"], str(d["loc"]), d["dateStr"], d.get("content", "")])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def update(self, bookList, prune=False):
+        """
+        incrementally updates the index to match the provided books
+        (only new items are tokenized, and items no longer in the provided books are removed)
+
+        Args:
+            bookList (:type listOfObjects: DataStructures.Book) list of Book objects to index
+            prune (bool): set True if bookList is the entire collection (so any other indexed books are removed too)
+        Returns:
+            (tuple of int): (number of items added, number of items removed)
+        """
+        wanted = {} # dict mapping item hash -> (book name, item dict)
+        for book in bookList:
+            for obj in book.highlights + book.notes:
+                d = obj.toDict()
+                wanted[SearchIndex.itemHash(book.getName(), d)] = (book.getName(), d)
+
+        bookNames = set(book.getName() for book in bookList)
+        existing = {} # dict mapping item hash -> item id (for the indexed items of relevant books)
+        for itemHash, itemId, bookName in self.conn.execute("SELECT hash, id, book FROM items"):
+            if prune or bookName in bookNames:
+                existing[itemHash] = itemId
+        stale = [(existing[h],) for h in existing if h not in wanted]
+        with self.conn:
+            self.conn.executemany("DELETE FROM postings WHERE itemId = ?", stale)
+            self.conn.executemany("DELETE FROM items WHERE id = ?", stale)
+            numAdded = 0
+            for itemHash, (bookName, d) in wanted.items():
+                if itemHash in existing:
+                    continue
+                cur = self.conn.execute("INSERT INTO items (hash, book, type, loc, locType, dateStr, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (itemHash, bookName, d["type"], d["loc"], d["locType"], d["dateStr"], d["content"]))
+                self.conn.executemany("INSERT INTO postings (token, itemId, pos) VALUES (?, ?, ?)",
+                        ((token, cur.lastrowid, pos) for pos, token in enumerate(tokenize(d["content"]))))
+                numAdded += 1
+        return (numAdded, len(stale))
+
+    def _lookup(self, token, prefix=False):
+        """
+        helper function for looking up the postings of a token
+        Returns:
+            (dict): mapping item id -> set of positions the token (or a token starting with it if prefix) appears at
+        """
+        if prefix:
+            # (range query, so the index on token is used)
+            rows = self.conn.execute("SELECT itemId, pos FROM postings WHERE token >= ? AND token < ?", (token, token + "\U0010ffff"))
+        else:
+            rows = self.conn.execute("SELECT itemId, pos FROM postings WHERE token = ?", (token,))
+        res = {}
+        for itemId, pos in rows:
+            res.setdefault(itemId, set()).add(pos)
+        return res
+
+    def _matchTerm(self, phrase, prefix):
+        """
+        helper function for finding the items matching a single (possibly multi-token) term of a query
+        Returns:
+            (set of int): ids of matching items
+        """
+        tokens = tokenize(phrase)
+        if len(tokens) == 0:
+            return None
+        # start from the positions of the first token, then keep only those followed by each next token
+        matches = self._lookup(tokens[0], prefix=(prefix and len(tokens) == 1))
+        for offset, token in enumerate(tokens[1:], start=1):
+            postings = self._lookup(token, prefix=(prefix and offset == len(tokens)-1))
+            matches = {itemId: set(p for p in positions if p + offset in postings[itemId])
+                for itemId, positions in matches.items() if itemId in postings}
+            matches = {itemId: positions for itemId, positions in matches.items() if len(positions) > 0}
+        return set(matches)
+
+    def search(self, query, limit=50):
+        """
+        finds the items matching every term in the provided query
+        e.g. 'android "electric sheep" tyran*' (terms may be words, quoted phrases, or prefixes ending in '*')
+
+        Args:
+            query (str): query to search for
+            limit (int): Optional; max number of results to return
+        Returns:
+            (list of dict): matching items (ordered by book and location) e.g.
+                {"book": "...", "type": "highlight", "loc": 607, "locType": "location", "dateStr": "...", "content": "..."}
+        """
+        itemIds = None
+        for match in QUERY_PATTERN.finditer(query):
+            phrase = match.group(1) if match.group(1) != None else match.group(2)
+            prefix = phrase.endswith("*")
+            res = self._matchTerm(phrase.rstrip("*"), prefix)
+            if res == None:
+                continue # (term contained no tokens)
+            itemIds = res if itemIds == None else (itemIds & res)
+            if len(itemIds) == 0:
+                break
+        if not itemIds:
+            return []
+        results = []
+        itemIds = list(itemIds)
+        for i in range(0, len(itemIds), 500): # (sqlite limits the number of query parameters)
+            chunk = itemIds[i:i+500]
+            results += self.conn.execute("SELECT book, type, loc, locType, dateStr, content FROM items WHERE id IN ({})"
+                    .format(",".join("?" * len(chunk))), chunk).fetchall()
+        results.sort(key=lambda row: (row[0], row[2]))
+        return [{"book": row[0], "type": row[1], "loc": row[2], "locType": row[3], "dateStr": row[4], "content": row[5]}
+            for row in results[:limit]]
+
+    def close(self):
+        """
+        closes the database
+        """
+        self.conn.close()
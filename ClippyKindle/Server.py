@@ -0,0 +1,235 @@
+import os
+import json
+import hashlib
+import threading
+import traceback
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+from ClippyKindle.SqliteStore import SqliteStore
+from ClippyKindle.Shards import getManifestPath
+
+MAX_CACHED_RESPONSES = 512 # max number of rendered responses kept by a CollectionService
+
+class CollectionService:
+    """
+    Answers queries about a collection (created by clippy.py) held in memory as Book objects,
+    so clients don't have to re-parse the whole collection for each query.
+    Rendered responses are cached (with an ETag) until the collection file changes, at which point it's reloaded.
+    If reloading fails (e.g. while clippy.py is rewriting the file), the last loaded books are served until it succeeds
+    (requests are answered with 503 if the collection was never loaded).
+
+    Paths served (the book may be given by its index in /books or its url encoded name, see Book.getName()):
+        /books                   list of every book (with its number of highlights/notes/bookmarks)
+        /books/<book>            every item of a book (see Book.toDict())
+        /books/<book>/markdown   markdown of a book (see marky.jsonToMarkdown()), "?omit-notes=1" omits notes
+        /items                   every item of every book (books without any items are omitted)
+    All paths except /books accept the query parameters "after" and "before" (ISO 8601 dates, e.g. "2021-03-05"),
+    which restrict the items returned to those added within the window (see Book.cutBefore() and Book.cutAfter()).
+    """
+    def __init__(self, fname, renderMarkdown=None):
+        """
+        Loads the provided collection.
+
+        Args:
+            fname (str): file path to json file (or sqlite store or sharded collection folder) created by clippy.py (e.g. "collection.json")
+            renderMarkdown (function): Optional; function converting a dict created by Book.toDict() to a
+                markdown string (e.g. marky.jsonToMarkdown), markdown isn't served if not provided
+        """
+        self.fname = fname
+        self.renderMarkdown = renderMarkdown
+        self.lock = threading.Lock() # (requests may be handled concurrently)
+        self.stat = None    # (modification time, size) of collection file when it was loaded
+        self.books = []     # loaded Book objects
+        self.names = {}     # dict mapping book name -> index in self.books
+        self.cache = {}     # dict mapping request path (including query) -> (status, content type, etag, body bytes)
+        self.numLoads = 0   # number of times the collection was (re)loaded
+        self.loadError = None # description of the error of the last attempt to (re)load the collection (None if it succeeded)
+        self._reloadIfChanged()
+
+    def _reloadIfChanged(self):
+        """
+        (re)loads the collection if the file changed since it was last loaded (discarding all cached responses).
+        If it can't be loaded, the previously loaded books are kept (and self.loadError is set), and loading
+        is attempted again on the next call.
+        """
+        try:
+            # (a sharded collection's manifest is rewritten whenever any of its books change)
+            stat = os.stat(getManifestPath(self.fname) if os.path.isdir(self.fname) else self.fname)
+            stat = (stat.st_mtime_ns, stat.st_size)
+            if stat == self.stat:
+                return
+            if SqliteStore.isStorePath(self.fname):
+                store = SqliteStore(self.fname)
+                try:
+                    books = store.loadBooks()
+                finally:
+                    store.close()
+            else:
+                books = ClippyKindle.ClippyKindle.parseJsonFile(self.fname)
+        except Exception as e:
+            # (e.g. the file is missing or partially written while clippy.py rewrites it)
+            self.loadError = "{}: {}".format(type(e).__name__, e)
+            return
+        self.loadError = None
+        self.books = books
+        self.names = {book.getName(): i for i, book in enumerate(self.books)}
+        self.cache = {}
+        self.stat = stat
+        self.numLoads += 1
+
+    def handle(self, path, ifNoneMatch=None):
+        """
+        answers a GET request
+
+        Args:
+            path (str): path requested (including any query string) e.g. "/books/3?after=2021-01-01"
+            ifNoneMatch (str): Optional; value of the request's "If-None-Match" header
+        Returns:
+            (tuple): (int status code, str content type, str etag, bytes body)
+                body is empty if the status code is 304 (the client's cached response is still valid)
+        """
+        with self.lock:
+            self._reloadIfChanged()
+            if self.stat == None:
+                # (the collection was never loaded, so there's nothing to serve yet)
+                return CollectionService._jsonResponse({"error": "collection unavailable ({})".format(self.loadError)}, status=503)
+            res = self.cache.get(path)
+            if res == None:
+                res = self._render(path)
+                if len(self.cache) >= MAX_CACHED_RESPONSES:
+                    del self.cache[next(iter(self.cache))] # (evict the oldest response)
+                self.cache[path] = res
+        status, contentType, etag, body = res
+        if etag != None and ifNoneMatch != None and etag in [tag.strip() for tag in ifNoneMatch.split(",")]:
+            return (304, contentType, etag, b"")
+        return res
+
+    def _render(self, path):
+        """
+        renders the response to a request (see handle())
+        """
+        url = urlsplit(path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            after, before = (CollectionService._parseDate(query.get(key)) for key in ["after", "before"])
+        except ValueError as e:
+            return CollectionService._jsonResponse({"error": str(e)}, status=400)
+
+        if parts == ["books"]:
+            return CollectionService._jsonResponse([{"id": i, "name": book.getName(), "title": book.title, "author": book.author,
+                "highlights": len(book.highlights), "notes": len(book.notes), "bookmarks": len(book.bookmarks)}
+                for i, book in enumerate(self.books)])
+        if parts == ["items"]:
+            bookDicts = [CollectionService._windowDict(book, after, before) for book in self.books]
+            return CollectionService._jsonResponse([d for d in bookDicts if len(d["items"]) > 0])
+        if len(parts) in [2, 3] and parts[0] == "books":
+            book = self._getBook(parts[1])
+            if book == None:
+                return CollectionService._jsonResponse({"error": "book not found: '{}'".format(parts[1])}, status=404)
+            if len(parts) == 2:
+                return CollectionService._jsonResponse(CollectionService._windowDict(book, after, before))
+            if parts[2] == "markdown" and self.renderMarkdown != None:
+                md = self.renderMarkdown(CollectionService._windowDict(book, after, before), [], query.get("omit-notes") in ["1", "true"])
+                return CollectionService._response(md.encode("utf-8"), "text/markdown; charset=utf-8")
+        return CollectionService._jsonResponse({"error": "not found: '{}'".format(url.path)}, status=404)
+
+    def _getBook(self, key):
+        """
+        Returns:
+            (DataStructures.Book): book with the provided name (or index in self.books), or None if not found
+        """
+        if key in self.names:
+            return self.books[self.names[key]]
+        if key.isdigit() and int(key) < len(self.books):
+            return self.books[int(key)]
+        return None
+
+    @staticmethod
+    def _windowDict(book, after, before):
+        """
+        Returns:
+            (dict): dict representing the provided book (see Book.toDict()) with only the items added after/before
+                the provided dates (either of which may be None), the book itself is left unchanged
+        """
+        if after == None and before == None:
+            return book.toDict()
+        window = DataStructures.Book(book.title, book.author)
+        window.highlights, window.notes, window.bookmarks = book.highlights, book.notes, book.bookmarks
+        window.sorted = book.sorted
+        if after != None:
+            window.cutBefore(after)
+        if before != None:
+            window.cutAfter(before)
+        return window.toDict()
+
+    @staticmethod
+    def _parseDate(dateStr):
+        """
+        Returns:
+            (datetime.datetime): date parsed from an ISO 8601 string (or None if dateStr is None)
+        """
+        if dateStr == None:
+            return None
+        try:
+            return datetime.fromisoformat(dateStr)
+        except ValueError:
+            raise ValueError("invalid date (expected ISO 8601 e.g. '2021-03-05'): '{}'".format(dateStr))
+
+    @staticmethod
+    def _jsonResponse(data, status=200):
+        return CollectionService._response(json.dumps(data, indent=2).encode("utf-8"), "application/json", status)
+
+    @staticmethod
+    def _response(body, contentType, status=200):
+        """
+        Returns:
+            (tuple): response as returned by handle() (only successful responses are given an ETag)
+        """
+        etag = '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest()) if status == 200 else None
+        return (status, contentType, etag, body)
+
+class CollectionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles HTTP requests using the CollectionService of its server (see makeServer())
+    """
+    def do_GET(self):
+        try:
+            status, contentType, etag, body = self.server.service.handle(self.path, self.headers.get("If-None-Match"))
+        except Exception:
+            # (respond with an error instead of dropping the connection)
+            traceback.print_exc()
+            status, contentType, etag, body = CollectionService._jsonResponse({"error": "internal server error"}, status=500)
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        if etag != None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache") # (clients should revalidate using the ETag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def makeServer(service, host="127.0.0.1", port=8080, verbose=True):
+    """
+    creates an HTTP server answering requests with the provided service (call serve_forever() on it to start serving)
+
+    Args:
+        service (CollectionService): service to answer requests with
+        host (str): Optional; address to listen on
+        port (int): Optional; port to listen on (0 picks any free port)
+        verbose (bool): Optional; whether to log each request (to stderr)
+    Returns:
+        (http.server.ThreadingHTTPServer): the server
+    """
+    server = ThreadingHTTPServer((host, port), CollectionRequestHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
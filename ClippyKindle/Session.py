@@ -0,0 +1,245 @@
+import threading
+from collections import OrderedDict
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+
+class LruCache:
+    """
+    Thread safe memo of at most maxEntries values (the least recently used are evicted first)
+    """
+    def __init__(self, maxEntries):
+        """
+        Args:
+            maxEntries (int): max number of values to keep
+        """
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, compute):
+        """
+        Args:
+            key (hashable): key of value
+            compute (function): function computing the value (called without any arguments) if it's not cached
+        Returns:
+            the cached (or newly computed) value
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        value = compute() # (computed without holding the lock, so other threads aren't blocked meanwhile)
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """
+        discards all cached values
+        """
+        with self.lock:
+            self.entries.clear()
+
+class ParseResult:
+    """
+    Result of parsing clippings file(s) with a Session
+    """
+    def __init__(self, books, errors):
+        """
+        Args:
+            books (:type listOfObjects: DataStructures.Book) books parsed
+            errors (list of dict): sections that failed to parse (see ClippyKindle.parseClippings())
+        """
+        self.books = books
+        self.errors = errors
+
+    def __repr__(self):
+        return "<ParseResult: {} books, {} errors>".format(len(self.books), len(self.errors))
+
+    @property
+    def ok(self):
+        """
+        (bool): true if every section was parsed successfully
+        """
+        return len(self.errors) == 0
+
+class MemoDedupCache:
+    """
+    In memory memo of the decisions made by Highlight.compare()/Note.compare() (with the same interface as
+    DedupCache.DedupCache, so it can be passed to Book.sort()), so re-sorting the same items is nearly free.
+    """
+    def __init__(self, maxEntries=200000):
+        """
+        Args:
+            maxEntries (int): Optional; max number of decisions to keep (least recently used are evicted)
+        """
+        self.cache = LruCache(maxEntries)
+
+    @staticmethod
+    def itemKey(obj):
+        """
+        Returns:
+            (tuple): key identifying the provided Highlight/Note object (by its type, location and content)
+        """
+        return (type(obj).__name__, obj.loc, getattr(obj, "locEnd", None), obj.locType, obj.content)
+
+    def compare(self, obj, other):
+        """
+        returns obj.compare(other), using a previously cached decision when available
+
+        Returns:
+            (tuple): (bool isDuplicate, str reason or None, float similarity or None)
+        """
+        return self.cache.get((MemoDedupCache.itemKey(obj), MemoDedupCache.itemKey(other)), lambda: obj.compare(other))
+
+class Session:
+    """
+    Reusable (and thread safe) engine for parsing clippings files and loading collections within a long running process.
+    Unlike the static methods of ClippyKindle.ClippyKindle, a Session never prints, prompts or exits:
+    results (and any sections that failed to parse) are returned as ParseResults.
+    A Session keeps memos of the metadata lines and dates it has parsed, and of duplicate detection decisions,
+    so parsing (and sorting) the same clippings again (e.g. a growing "My Clippings.txt") gets faster.
+
+    e.g.
+        session = Session()
+        res = session.parseFiles(["kindle1/My Clippings.txt", "kindle2/My Clippings.txt"])
+        if not res.ok: ...
+        bookDicts = [book.toDict() for book in res.books]
+    """
+    def __init__(self, removeDups=True, maxHeaders=200000, maxDates=200000, maxDecisions=200000):
+        """
+        Args:
+            removeDups (bool): Optional; whether parsed books have their duplicate items removed (see Book.sort())
+            maxHeaders (int): Optional; max number of parsed metadata lines to memoize
+            maxDates (int): Optional; max number of parsed date strings to memoize
+            maxDecisions (int): Optional; max number of duplicate detection decisions to memoize
+        """
+        self.removeDups = removeDups
+        self.headers = LruCache(maxHeaders) # (formats, metadata line) -> dict of fields parsed (or None)
+        self.dates = LruCache(maxDates)     # date string -> datetime.datetime (or None if it can't be parsed)
+        self.dedupCache = MemoDedupCache(maxDecisions)
+        self._compiledFormats = {} # dict mapping format string -> compiled parse.Parser object
+
+    def matchFormats(self, formats, line):
+        """
+        memoized version of ClippyKindle._matchFormats()
+
+        Returns:
+            (dict): fields parsed from the line using the first format matching it (or None if no format matched),
+                which must not be modified
+        """
+        def compute():
+            for formatStr in formats:
+                parser = self._compiledFormats.get(formatStr)
+                if parser == None:
+                    import parse
+                    parser = self._compiledFormats[formatStr] = parse.compile(formatStr)
+                res = parser.parse(line)
+                if res != None:
+                    return res.named
+            return None
+        return self.headers.get((formats[0], line), compute)
+
+    def parseDate(self, dateStr):
+        """
+        memoized version of ClippyKindle._parseDate()
+        raises ValueError if it can't be parsed
+
+        Returns:
+            (datetime.datetime): parsed date
+        """
+        def compute():
+            try:
+                return ClippyKindle.ClippyKindle._parseDate(dateStr)
+            except ValueError:
+                return None
+        date = self.dates.get(dateStr, compute)
+        if date == None:
+            raise ValueError("unable to parse date: '{}'".format(dateStr))
+        return date
+
+    def parseFile(self, fname, sectionFilter=None):
+        """
+        parses a clippings file (see ClippyKindle.parseClippings())
+
+        Args:
+            fname (str): file path to (optionally compressed) txt file to parse (e.g. "My Clippings.txt")
+            sectionFilter (ClippyKindle.SectionFilter): Optional; filter of which sections to parse
+        Returns:
+            (ParseResult): books parsed (sorted, and without duplicates if self.removeDups) and any errors
+        """
+        return self.parseFiles([fname], sectionFilter)
+
+    def parseFiles(self, fnames, sectionFilter=None):
+        """
+        parses multiple clippings files (e.g. from several devices) and merges their books by name
+        (see ClippyKindle.parseClippingsFiles(), but in the calling thread)
+
+        Args:
+            fnames (list of str): file paths to txt files to parse
+            sectionFilter (ClippyKindle.SectionFilter): Optional; filter of which sections to parse
+        Returns:
+            (ParseResult): books parsed (sorted, and without duplicates if self.removeDups) and any errors
+        """
+        allBooks = {} # dict mapping book name -> Book object
+        errors = []
+        for fname in fnames:
+            ClippyKindle.ClippyKindle._mergeBooks(allBooks, ClippyKindle.ClippyKindle.parseClippings(fname, verbose=0,
+                errorPolicy="collect", errors=errors, sectionFilter=sectionFilter, session=self))
+        books = list(allBooks.values())
+        self.sortBooks(books)
+        return ParseResult(books, errors)
+
+    def sortBooks(self, books, audit=None):
+        """
+        sorts books (and removes their duplicate items if self.removeDups) using this session's memo of decisions
+
+        Args:
+            books (:type listOfObjects: DataStructures.Book) books to sort (in place)
+            audit (Audit.DedupAudit): Optional; audit file to record each removed duplicate in
+        """
+        for book in books:
+            book.sort(removeDups=self.removeDups, dedupCache=self.dedupCache, audit=audit)
+
+    def loadCollection(self, fname):
+        """
+        loads a collection created by clippy.py
+
+        Args:
+            fname (str): path of (optionally compressed) json file, sqlite store or sharded collection folder
+        Returns:
+            (:type listOfObjects: DataStructures.Book) list of Book objects
+        """
+        from ClippyKindle.SqliteStore import SqliteStore
+        if SqliteStore.isStorePath(fname):
+            store = SqliteStore(fname)
+            try:
+                return store.loadBooks()
+            finally:
+                store.close()
+        return ClippyKindle.ClippyKindle.parseJsonFile(fname)
+
+    def getStats(self):
+        """
+        Returns:
+            (dict): mapping name of each memo ("headers", "dates", "decisions") -> {"size", "hits", "misses"}
+        """
+        return {name: {"size": len(cache), "hits": cache.hits, "misses": cache.misses}
+            for name, cache in [("headers", self.headers), ("dates", self.dates), ("decisions", self.dedupCache.cache)]}
+
+    def clear(self):
+        """
+        discards all memoized data
+        """
+        for cache in [self.headers, self.dates, self.dedupCache.cache]:
+            cache.clear()
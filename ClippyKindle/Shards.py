@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+
+from ClippyKindle import DataStructures
+
+SHARD_VERSION = 1 # version of the sharded collection format (collections of other versions aren't read)
+MANIFEST_NAME = "manifest.json" # name of the manifest file within a sharded collection's folder
+SHARDS_FOLDER = "books" # name of the folder (within a sharded collection's folder) holding a shard per book
+
+def getManifestPath(folder):
+    """
+    Returns:
+        (str): path of the manifest of the sharded collection in the provided folder
+    """
+    return os.path.join(folder, MANIFEST_NAME)
+
+def isShardedPath(path):
+    """
+    Returns:
+        (bool): true if the provided path is the folder of a sharded collection (i.e. it contains a manifest)
+    """
+    return os.path.isfile(getManifestPath(path))
+
+def getShardName(bookName):
+    """
+    Returns:
+        (str): path of the shard storing a book (relative to its collection's folder), derived from the book's name
+            (see Book.getName()) so it stays the same across runs and is a valid filename whatever the book's title
+    """
+    return "{}/{}.json".format(SHARDS_FOLDER, hashlib.blake2b(bookName.encode("utf-8"), digest_size=8).hexdigest())
+
+def readManifest(folder):
+    """
+    Returns:
+        (list of dicts): entry of each book in the sharded collection in the provided folder (in order),
+            i.e. its summary (see BookSummary.toDict()) and the path of its shard ("file"),
+            or None if the folder doesn't contain a (current version) sharded collection
+    """
+    if not isShardedPath(folder):
+        return None
+    with open(getManifestPath(folder)) as f:
+        manifest = json.load(f)
+    return manifest["books"] if manifest.get("version") == SHARD_VERSION else None
+
+def _writeAtomic(path, data):
+    """
+    writes data as json to the provided path via a temporary file, so readers never see a partially written file
+    """
+    tmpPath = path + ".tmp"
+    with open(tmpPath, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmpPath, path)
+
+def writeShards(folder, bookList, bookDicts=None):
+    """
+    writes a collection as a folder containing a json file (shard) per book and a manifest listing the summary
+    (see Book.getSummary()) and shard of each book. The shards of books whose content hash is unchanged since
+    the collection was last written are left as is, so only the books that changed are rewritten.
+    The manifest is written last, so the collection can be read at any time.
+
+    Args:
+        folder (str): path of folder to write the collection in (created if needed)
+        bookList (:type listOfObjects: DataStructures.Book) list of Book objects in the collection
+        bookDicts (list of dicts): Optional; dict of each book (created with Book.toDict()) if already available
+    Returns:
+        (tuple): (int number of shards written, int number of shards unchanged, int number of shards removed)
+    """
+    os.makedirs(os.path.join(folder, SHARDS_FOLDER), exist_ok=True)
+    oldEntries = {entry["name"]: entry for entry in (readManifest(folder) or [])}
+    if bookDicts == None:
+        bookDicts = [book.toDict() for book in bookList]
+    entries = []
+    numWritten = 0
+    for book, d in zip(bookList, bookDicts):
+        entry = dict(book.getSummary(d).toDict(), file=getShardName(book.getName()))
+        old = oldEntries.get(entry["name"])
+        if old == None or old["hash"] != entry["hash"] or not os.path.isfile(os.path.join(folder, entry["file"])):
+            _writeAtomic(os.path.join(folder, entry["file"]), d)
+            numWritten += 1
+        entries.append(entry)
+    _writeAtomic(getManifestPath(folder), {"version": SHARD_VERSION, "books": entries})
+
+    # remove shards of books no longer in the collection
+    files = set(entry["file"] for entry in entries)
+    numRemoved = 0
+    for entry in oldEntries.values():
+        if entry["file"] not in files and os.path.isfile(os.path.join(folder, entry["file"])):
+            os.remove(os.path.join(folder, entry["file"]))
+            numRemoved += 1
+    return (numWritten, len(entries) - numWritten, numRemoved)
+
+def loadSummaries(folder):
+    """
+    Returns:
+        (list of DataStructures.BookSummary): summary of each book in the sharded collection in the provided folder
+            (read from its manifest, without loading any shards)
+    """
+    return [DataStructures.BookSummary(entry) for entry in readManifest(folder)]
+
+def _loadShard(path):
+    """
+    Returns:
+        (DataStructures.Book): book loaded from the shard at the provided path
+    """
+    with open(path) as f:
+        return DataStructures.Book.fromDict(json.load(f))
+
+def loadShards(folder, names=None, maxWorkers=None):
+    """
+    loads books from a sharded collection (see writeShards()), reading only the shards of the requested books
+
+    Args:
+        folder (str): path of folder of sharded collection
+        names (collection of str): Optional; names of books to load (see Book.getName()), every book is loaded if not provided
+            (names not in the collection are ignored)
+        maxWorkers (int): Optional; max number of shards to read at once (default: see concurrent.futures.ThreadPoolExecutor),
+            1 reads them one at a time
+    Returns:
+        (:type listOfObjects: DataStructures.Book) list of Book objects (in the collection's order)
+    Raises:
+        ValueError: if the folder doesn't contain a sharded collection
+    """
+    entries = readManifest(folder)
+    if entries == None:
+        raise ValueError("not a sharded collection (missing or outdated '{}'): '{}'".format(MANIFEST_NAME, folder))
+    paths = [os.path.join(folder, entry["file"]) for entry in entries if names == None or entry["name"] in names]
+    if maxWorkers == 1 or len(paths) < 2:
+        return [_loadShard(path) for path in paths]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        return list(executor.map(_loadShard, paths))
@@ -0,0 +1,135 @@
+from datetime import datetime
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+
+SQLITE_EXTS = (".sqlite", ".db") # file extensions identifying a collection stored in a SqliteStore
+
+class SqliteStore:
+    """
+    Stores a collection of books (and their highlights/notes/bookmarks) in an indexed sqlite database
+    as an alternative to a collection.json file, so individual books (or date ranges within them)
+    can be loaded without reading the whole collection.
+    """
+    def __init__(self, fname):
+        """
+        Opens (or creates) a SqliteStore in the provided file.
+
+        Args:
+            fname (str): file path of sqlite database (e.g. "collection.sqlite")
+        """
+        import sqlite3 # (imported here so isStorePath() can be used without loading sqlite3)
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, name TEXT UNIQUE, title TEXT, author TEXT)")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, bookId INTEGER, type TEXT,
+                loc INTEGER, locEnd INTEGER, locType TEXT, date REAL, dateStr TEXT, content TEXT)""")
+            # (name is UNIQUE so already indexed, drop the redundant index created by earlier versions)
+            self.conn.execute("DROP INDEX IF EXISTS books_name")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_book_loc ON items (bookId, loc)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_date ON items (date)")
+
+    @staticmethod
+    def isStorePath(fname):
+        """
+        Returns:
+            (bool): true if the provided file path refers to a SqliteStore (based on its extension)
+        """
+        return fname.lower().endswith(SQLITE_EXTS)
+
+    def writeBooks(self, bookList):
+        """
+        stores the provided books (in a single transaction), replacing the stored data of any books
+        with the same name (books in the store that aren't provided are left unchanged)
+
+        Args:
+            bookList (:type listOfObjects: DataStructures.Book) list of Book objects to store
+        """
+        with self.conn:
+            for book in bookList:
+                self.conn.execute("INSERT OR IGNORE INTO books (name, title, author) VALUES (?, ?, ?)",
+                        (book.getName(), book.title, book.author))
+                bookId = self.conn.execute("SELECT id FROM books WHERE name = ?", (book.getName(),)).fetchone()[0]
+                self.conn.execute("DELETE FROM items WHERE bookId = ?", (bookId,))
+                self.conn.executemany("""INSERT INTO items (bookId, type, loc, locEnd, locType, date, dateStr, content)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    ((bookId, d["type"], d["loc"], d.get("locEnd"), d["locType"], obj.date.timestamp(), d["dateStr"], d.get("content"))
+                        for obj, d in ((obj, obj.toDict()) for obj in book.highlights + book.notes + book.bookmarks)))
+
+    def getBookNames(self):
+        """
+        Returns:
+            (list of str): names of all books in the store (see Book.getName())
+        """
+        return [row[0] for row in self.conn.execute("SELECT name FROM books ORDER BY id")]
+
+    def loadBook(self, name, after=None, before=None):
+        """
+        loads a single book from the store (optionally only the items within a date window)
+
+        Args:
+            name (str): name of book to load (see Book.getName())
+            after (datetime.datetime): Optional; only load items added after this date (see Book.cutBefore())
+            before (datetime.datetime): Optional; only load items added before this date (see Book.cutAfter())
+        Returns:
+            (DataStructures.Book): the loaded Book object (or None if no book with the provided name is stored)
+        """
+        row = self.conn.execute("SELECT id, title, author FROM books WHERE name = ?", (name,)).fetchone()
+        if row == None:
+            return None
+        query = "SELECT type, loc, locEnd, locType, dateStr, content FROM items WHERE bookId = ?"
+        params = [row[0]]
+        if after != None:
+            query += " AND date > ?"
+            params.append(after.timestamp())
+        if before != None:
+            query += " AND date < ?"
+            params.append(before.timestamp())
+        items = [SqliteStore._rowToDict(item) for item in self.conn.execute(query + " ORDER BY loc, date", params)]
+        return DataStructures.Book.fromDict({"title": row[1], "author": row[2], "items": items})
+
+    def getSummaries(self):
+        """
+        summarizes every book in the store without loading their items (see Book.getSummary())
+        (the summaries have no content hash)
+
+        Returns:
+            (list of DataStructures.BookSummary): summary of each book in the store
+        """
+        summaries = []
+        for row in self.conn.execute("""SELECT name, title, author, SUM(type = 'highlight'), SUM(type = 'note'),
+                SUM(type = 'bookmark'), MIN(date), MAX(date), (SELECT locType FROM items WHERE bookId = books.id ORDER BY loc, date LIMIT 1)
+                FROM books LEFT JOIN items ON items.bookId = books.id GROUP BY books.id ORDER BY books.id"""):
+            summaries.append(DataStructures.BookSummary({"name": row[0], "title": row[1], "author": row[2],
+                "highlights": row[3] or 0, "notes": row[4] or 0, "bookmarks": row[5] or 0,
+                "dateStart": None if row[6] == None else ClippyKindle.dateToStr(datetime.fromtimestamp(row[6])),
+                "dateEnd": ClippyKindle.dateToStr(datetime.fromtimestamp(row[7] or 0)), "locType": row[8], "hash": None}))
+        return summaries
+
+    def loadBooks(self):
+        """
+        loads every book in the store (equivalent to ClippyKindle.parseJsonFile())
+
+        Returns:
+            (:type listOfObjects: DataStructures.Book) list of Book objects
+        """
+        return [self.loadBook(name) for name in self.getBookNames()]
+
+    @staticmethod
+    def _rowToDict(row):
+        """
+        helper function for converting a row of the items table to a dict (as created by toDict())
+        """
+        d = {"type": row[0], "loc": row[1], "locType": row[3], "dateStr": row[4]}
+        if row[0] == "highlight":
+            d["locEnd"] = row[2]
+        if row[0] != "bookmark":
+            d["content"] = row[5]
+        return d
+
+    def close(self):
+        """
+        closes the database
+        """
+        self.conn.close()
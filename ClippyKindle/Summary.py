@@ -0,0 +1,77 @@
+import os
+import json
+from datetime import datetime
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+from ClippyKindle.SqliteStore import SqliteStore
+from ClippyKindle.Compression import openFile, stripCompressionExt
+
+SUMMARY_VERSION = 1 # version of the summary index format (indexes of other versions are ignored)
+
+def getSummaryPath(collectionPath):
+    """
+    Returns:
+        (str): path of the summary index stored next to the provided collection (e.g. "collection.json" -> "collection.summary.json")
+            (the index of a compressed collection is stored uncompressed e.g. "collection.json.gz" -> "collection.summary.json")
+    """
+    return os.path.splitext(stripCompressionExt(collectionPath))[0] + ".summary.json"
+
+def _collectionStat(collectionPath):
+    """
+    Returns:
+        (list): [modification time (ns), size] of the collection file, identifying its current version
+    """
+    stat = os.stat(collectionPath)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def writeSummaries(collectionPath, summaries):
+    """
+    writes the summary index of a collection (call after the collection itself is written)
+
+    Args:
+        collectionPath (str): path of collection.json the summaries are of
+        summaries (list of DataStructures.BookSummary): summary of each book in the collection (in order)
+    Returns:
+        (str): path of the summary index written
+    """
+    path = getSummaryPath(collectionPath)
+    with open(path, 'w') as f:
+        json.dump({"version": SUMMARY_VERSION, "collection": _collectionStat(collectionPath),
+            "books": [summary.toDict() for summary in summaries]}, f, indent=2)
+    return path
+
+def loadSummaries(collectionPath, rebuild=True):
+    """
+    loads the summary of each book in a collection, using its summary index (see writeSummaries()) if it's up to date
+    (so the collection's items don't need to be loaded), otherwise the summaries are computed from the collection
+    (and the index rewritten if rebuild is True). For a SqliteStore the summaries are computed by the database,
+    and for a sharded collection they're read from its manifest (see ClippyKindle.Shards).
+
+    Args:
+        collectionPath (str): path of collection (json file, sqlite store or sharded collection folder) created by clippy.py
+        rebuild (bool): Optional; whether to rewrite the summary index if it was missing or out of date
+    Returns:
+        (list of DataStructures.BookSummary): summary of each book in the collection (in order)
+    """
+    if os.path.isdir(collectionPath):
+        from ClippyKindle import Shards
+        return Shards.loadSummaries(collectionPath)
+    if SqliteStore.isStorePath(collectionPath):
+        store = SqliteStore(collectionPath)
+        summaries = store.getSummaries()
+        store.close()
+        return summaries
+
+    path = getSummaryPath(collectionPath)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("version") == SUMMARY_VERSION and index.get("collection") == _collectionStat(collectionPath):
+            return [DataStructures.BookSummary(d) for d in index["books"]]
+    # (index missing or out of date)
+    with openFile(collectionPath) as f:
+        summaries = [DataStructures.Book.fromDict(d).getSummary(d) for d in json.load(f)]
+    if rebuild:
+        writeSummaries(collectionPath, summaries)
+    return summaries
@@ -0,0 +1,113 @@
+import os
+import time
+import hashlib
+
+import ClippyKindle
+from ClippyKindle import DataStructures
+from ClippyKindle.Scanner import SectionScanner
+
+class IncrementalParser:
+    """
+    Parses a clippings file repeatedly (e.g. each time a kindle is plugged in), keeping the parsed books in memory
+    and only parsing the sections appended to the file since the last update (kindles only ever append to it).
+    The file is parsed from scratch if it was otherwise modified (e.g. replaced by a different device's file).
+    """
+    def __init__(self, fname):
+        """
+        Args:
+            fname (str): file path to txt file to parse (e.g. "/media/Kindle/documents/My Clippings.txt")
+        """
+        self.fname = fname
+        self.reset()
+
+    def reset(self):
+        """
+        forgets everything parsed so far
+        """
+        self.registry = DataStructures.BookRegistry() # books parsed so far
+        self.offset = 0         # byte offset after the last complete section parsed
+        self.prefixHash = None  # hash of the bytes in the file before self.offset
+        self.lineNum = 0        # line number of the end of the last section parsed
+        self.errors = []        # dicts describing each section that failed to parse (see ClippyKindle.parseClippings())
+
+    @staticmethod
+    def _hashPrefix(data, end):
+        """
+        Returns:
+            (str): hash of the first end bytes of data (hashed in chunks to avoid copying it all at once)
+        """
+        h = hashlib.sha1()
+        chunkSize = 1 << 20
+        for i in range(0, end, chunkSize):
+            h.update(data[i : min(i + chunkSize, end)])
+        return h.hexdigest()
+
+    def update(self):
+        """
+        parses any sections added to the file since the last update
+
+        Returns:
+            (:type listOfObjects: DataStructures.Book) list of the Book objects that changed
+            (books are otherwise left as is between updates, so changes made to them e.g. sorting persist)
+        """
+        scanner = SectionScanner(self.fname)
+        if self.offset > len(scanner) or IncrementalParser._hashPrefix(scanner.data, self.offset) != self.prefixHash:
+            self.reset()
+        numItems = [len(book.highlights) + len(book.notes) + len(book.bookmarks) for book in self.registry]
+        for start, end, complete in scanner.iterSections(self.offset):
+            if not complete:
+                self.offset = start
+                break
+            section = scanner.getLines(start, end)
+            self.lineNum += len(section) + 1
+            res = ClippyKindle.ClippyKindle._parseSection(section, self.registry)
+            if res != None:
+                self.errors.append({"error": res, "file": self.fname, "lineStart": self.lineNum - len(section),
+                    "lineEnd": self.lineNum, "lines": section})
+        self.prefixHash = IncrementalParser._hashPrefix(scanner.data, self.offset)
+        scanner.close()
+        return [book for book in self.registry if book.id >= len(numItems) or
+                len(book.highlights) + len(book.notes) + len(book.bookmarks) != numItems[book.id]]
+
+class FileWatcher:
+    """
+    Polls a file (which may not exist yet, e.g. on a kindle that isn't mounted) for changes,
+    waiting for each change to settle before reporting it (so a single copy/mount is only reported once).
+    """
+    def __init__(self, fname, interval=2.0, debounce=5.0):
+        """
+        Args:
+            fname (str): file path to watch
+            interval (float): Optional; seconds between each check of the file
+            debounce (float): Optional; seconds the file must be unchanged before a change is reported
+        """
+        self.fname = fname
+        self.interval = interval
+        self.debounce = debounce
+        self.lastSeen = None # (modification time, size) of file when a change was last reported
+
+    def _stat(self):
+        """
+        Returns:
+            (tuple): (modification time, size) of the file (or None if it doesn't exist)
+        """
+        try:
+            stat = os.stat(self.fname)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def waitForChange(self):
+        """
+        blocks until the file exists and has changed since the last change reported (and settled)
+        """
+        pending, pendingSince = None, None
+        while True:
+            cur = self._stat()
+            if cur != None and cur != self.lastSeen:
+                if cur != pending:
+                    pending, pendingSince = cur, time.monotonic()
+                elif time.monotonic() - pendingSince >= self.debounce:
+                    self.lastSeen = cur
+                    return
+            time.sleep(self.interval)
@@ -1,13 +1,14 @@
 import os
 import sys
-import parse
+import re
 import json
+# NOTE: the modules parse, dateutil and concurrent.futures are only imported when needed (to speed up startup)
 
-from dateutil import parser
-from dateutil.relativedelta import *
 from datetime import datetime
 
 from ClippyKindle import DataStructures
+from ClippyKindle.Profiler import PROFILER
+from ClippyKindle.Scanner import SectionScanner
 
 # NOTE: you can also use a config.ini to define config https://stackoverflow.com/a/38275781
 HIGHLIGHT_START = "- Your Highlight"
@@ -29,7 +30,83 @@ NOTE_FORMATS = [
     "- Your Note {:l} {:l} {:d} | {locType:l} {loc:d} | Added on {date}",    # case like: "- Your Note on page 16 | location 231 | Added on Monday, 7 December 2020 19:19:23"
 ]
 
+# when we parse the date of a highlight/note/bookmark, these formats will be tried (before falling back to dateutil):
+DATE_FORMATS = [
+    "%A, %B %d, %Y %I:%M:%S %p", # case like: "Saturday, January 4, 2020 10:20:02 AM"
+    "%A, %d %B %Y %H:%M:%S",     # case like: "Thursday, 15 June 2017 18:23:21"
+]
+
+YEAR_PATTERN = re.compile(r"\b\d{4}\b") # year within a date string (see DATE_FORMATS)
+
 DATE_FMT_OUT = "%B %d, %Y %H:%M:%S" # format string for outputting datetime objects
+ERROR_POLICIES = ["ask", "skip", "collect", "fail"] # supported values for parseClippings(errorPolicy=...)
+
+class ParseError(Exception):
+    """
+    raised by ClippyKindle.parseClippings() (when errorPolicy="fail") if a section of the clippings file can't be parsed
+    """
+    def __init__(self, errors):
+        """
+        Args:
+            errors (list of dict): the problem sections (see ClippyKindle.parseClippings())
+        """
+        self.errors = errors
+        super().__init__("{} (lines {} - {})".format(errors[0]["error"], errors[0]["lineStart"], errors[0]["lineEnd"]))
+
+    def __reduce__(self):
+        """
+        allows ParseErrors to be pickled (e.g. when raised in a worker process)
+        """
+        return (ParseError, (self.errors,))
+
+class SectionFilter:
+    """
+    Restricts which sections of a clippings file ClippyKindle.parseClippings() parses, using only each section's
+    title and metadata lines (see SectionScanner.getHeader()), so sections that don't match are skipped without
+    being fully decoded or parsed.
+    """
+    def __init__(self, since=None, until=None, books=None):
+        """
+        Args:
+            since (datetime.datetime): Optional; only parse items added on or after this date
+            until (datetime.datetime): Optional; only parse items added before this date
+            books (list of str): Optional; only parse items of books whose title line (title and author,
+                e.g. "Fahrenheit 451: A Novel (Bradbury, Ray)") contains any of these strings (case insensitive)
+        """
+        self.since = since
+        self.until = until
+        self.books = None if books == None else [name.lower() for name in books]
+
+    def matchesHeader(self, titleLine, metaLine):
+        """
+        Returns:
+            (bool): False if a section with the provided title and metadata lines should be skipped
+                (sections whose header can't be interpreted are never skipped, so they're still parsed and reported)
+        """
+        if titleLine == None or metaLine == None:
+            return True
+        if self.books != None and not any(name in titleLine.lower() for name in self.books):
+            return False
+        if self.since == None and self.until == None:
+            return True
+        # (every supported format ends with "| Added on {date}", see HIGHLIGHT_FORMATS etc)
+        sep, dateStr = metaLine.rpartition("| Added on ")[1:]
+        if sep == "":
+            return True
+        # check the year first, so only dates in the first/last year of the window need to be fully parsed
+        match = YEAR_PATTERN.search(dateStr)
+        if match != None:
+            year = int(match.group())
+            if (self.since != None and year < self.since.year) or (self.until != None and year > self.until.year):
+                return False
+            if (self.since == None or year > self.since.year) and (self.until == None or year < self.until.year):
+                return True
+        try:
+            date = ClippyKindle._parseDate(dateStr)
+        except ValueError:
+            return True
+        return (self.since == None or date >= self.since) and (self.until == None or date < self.until)
+
 ######## helper functions
 def strToDate(dateStr):
     """
@@ -42,6 +119,15 @@ def dateToStr(dateObj):
     converts a provided dateTime object to a string with desired formatting
     """
     return dateObj.strftime(DATE_FMT_OUT)
+_compiledFormats = {} # dict mapping format strings (e.g. in HIGHLIGHT_FORMATS) -> compiled parse.Parser objects
+
+def _parseClippingsWorker(fname, verbose, errorPolicy, sectionFilter):
+    """
+    helper function for ClippyKindle.parseClippingsFiles() (run in a worker process)
+    return: (tuple) (list of Book objects, list of error dicts)
+    """
+    errors = []
+    return (ClippyKindle.parseClippings(fname, verbose, errorPolicy, errors, sectionFilter), errors)
 ########
 
 
@@ -59,97 +145,205 @@ class ClippyKindle:
         returns an array of Book objects
 
         parameters:
-            fname (str): file path to json file to parse (e.g. "collection.json")
+            fname (str): file path to (optionally compressed) json file to parse (e.g. "collection.json" or "collection.json.gz"),
+                or folder of a sharded collection (see ClippyKindle.Shards) whose books are all loaded
         return:
             (:type listOfObjects: DataStructures.Book) list of Book objects
         """
+        if os.path.isdir(fname):
+            from ClippyKindle import Shards
+            return Shards.loadShards(fname)
+        from ClippyKindle.Compression import openFile
         bookList = []
-        with open(fname) as f:
+        with openFile(fname) as f:
             jsonData = json.load(f)
         for bookData in jsonData:
             bookList.append(DataStructures.Book.fromDict(bookData))
         return bookList
 
     @staticmethod
-    def parseClippings(fname, verbose=False):
+    def parseClippings(fname, verbose=1, errorPolicy="ask", errors=None, sectionFilter=None, spill=None, session=None):
         """
         parses the notes/highlights/bookmarks stored in a kindle clippings txt file (printing any errors)
         and returns the data as an array of dicts (each dict representing the data from one book).
 
         parameters:
-            fname (str): file path to txt file to parse (e.g. "My Clippings.txt")
-            # TODO: use verbose param with options 0 (print nothing), 1 (print everything), and 2 (print errors only)
+            fname (str): file path to txt file to parse (e.g. "My Clippings.txt"), which may be compressed (see Compression.COMPRESSIONS)
+            verbose (int): 0 (print nothing), 1 (print everything), or 2 (print errors only)
+            errorPolicy (str): how to handle sections of the file that fail to parse (see ERROR_POLICIES):
+                "ask" prints each problem section and then asks the user whether to continue (exiting if not),
+                "skip" ignores problem sections, "collect" ignores them but only records them in errors,
+                and "fail" raises a ParseError on the first problem section.
+            errors (list): optional list to append a dict describing each problem section to
+                e.g. {"error": "ERROR: ...", "file": "My Clippings.txt", "lineStart": 5, "lineEnd": 9, "lines": ["...", ...]}
+            sectionFilter (SectionFilter): optional filter of which sections to parse (e.g. by date or book),
+                sections not matching it are skipped based on their title/metadata lines alone
+            spill (OutOfCore.SpillCollection): optional collection to spill parsed items to (to bound memory use),
+                in which case the returned books are empty and their items are all in spill once parsing finishes
+            session (Session.Session): optional session whose caches are used to parse each section's metadata (see _parseSection())
         return:
             (:type listOfObjects: DataStructures.Book) list of Book objects
         """
-        print("\nParsing file: '{}'".format(fname))
+        if errorPolicy not in ERROR_POLICIES:
+            raise ValueError("unknown errorPolicy '{}' (expected one of {})".format(errorPolicy, ERROR_POLICIES))
 
         def printHelper(msg, isError=False):
             """
             helper function for printing
             parameters:
                 msg (str): message to print
-                level (bool): True if msg is an error message, False otherwise
+                isError (bool): True if msg is an error message (printed to stderr), False otherwise
+            """
+            if verbose == 0 or (verbose == 2 and not isError):
+                return
+            print(msg, file=(sys.stderr if isError else sys.stdout))
+
+        def reportError(msg, lineStart, lineEnd, lines):
             """
-            # TODO: implement, consider actually printing errors to stderr
-            pass
+            helper function for handling a section that failed to parse (according to errorPolicy)
+            """
+            error = {"error": msg, "file": fname, "lineStart": lineStart, "lineEnd": lineEnd, "lines": lines}
+            if errors != None:
+                errors.append(error)
+            if errorPolicy == "fail":
+                raise ParseError([error])
+            if errorPolicy == "collect":
+                return
+            printHelper(msg, isError=True)
+            if errorPolicy == "ask":
+                printHelper("problem section in file (lines {} - {}) >>>".format(lineStart, lineEnd), isError=True)
+                for line in lines:
+                    printHelper("  '{}'".format(line), isError=True)
+                printHelper("<<<\n", isError=True)
+            else:
+                printHelper("  (skipped section at lines {} - {})".format(lineStart, lineEnd), isError=True)
 
-        allBooks = {} # dict mapping book title/author string to a Book object
-        lineNum = 0
+        printHelper("\nParsing file: '{}'".format(fname))
+        allBooks = DataStructures.BookRegistry() # maps book title/author strings to Book objects
+        lineNum = 0 # line number of the end of the last section parsed
         numErrors = 0
-        with open(fname, 'r') as fh:
-            allLines = fh.readlines()
-            section = []
-            lineNum = 0
-            for line in allLines:
-                lineNum += 1
-                line = line.rstrip("\n")
-                # TODO: remove weird character from some lines!!!
-                if line == "==========":
-                    res = ClippyKindle._parseSection(section, allBooks)
-                    if res != None:
+        numSkipped = 0 # number of sections not matching sectionFilter
+        with PROFILER.stage("read"):
+            # (when parsing within a memory budget, compressed files are decompressed to disk rather than into memory)
+            scanner = SectionScanner(fname, tmpFolder=None if spill == None else spill.folder)
+        PROFILER.count("read", calls=0, items=len(scanner))
+        with PROFILER.stage("parse sections"):
+            # (lines are stripped of weird characters e.g. the byte order mark at the start of some titles)
+            for start, end, complete in scanner.iterSections():
+                if complete and sectionFilter != None and not sectionFilter.matchesHeader(*scanner.getHeader(start, end)):
+                    lineNum += scanner.countLines(start, end) + 1
+                    numSkipped += 1
+                    continue
+                # intentially includes empty lines as well (e.g. "") because some notes can intentionally contain an empty line
+                section = scanner.getLines(start, end)
+                if not complete:
+                    if len(section) != 0:
                         numErrors += 1
-                        print(res)
-                        print("problem section in file (lines {} - {}) >>>".format(lineNum - len(section), lineNum))
-                        for line in section:
-                            print("  '{}'".format(line))
-                        print("<<<\n")
-                    section = []
-                else:
-                    # intentially includes empty lines as well (e.g. "") because some notes can intentionally contain an empty line
-                    section.append(line)
-
-            if len(section) != 0:
-                numErrors += 1
-                print("\n\nERROR: Unable to finsh parsing before hitting end of file")
-                print("section not parsed (at line {}) >>>".format(lineNum))
-                for line in section:
-                    print("  '{}'".format(line))
-                print("<<<")
-        print("\nFinished parsing data from {} books!".format(len(allBooks)))
-        if numErrors != 0 and input("{} error(s) parsing input file. Continue anyway (y/n)? "\
+                        reportError("ERROR: Unable to finsh parsing before hitting end of file", lineNum + 1, lineNum + len(section), section)
+                    break
+                lineNum += len(section) + 1
+                PROFILER.count("parse sections", calls=0, items=1)
+                res = ClippyKindle._parseSection(section, allBooks, session)
+                if res != None:
+                    numErrors += 1
+                    reportError(res, lineNum - len(section), lineNum, section)
+                elif spill != None:
+                    spill.add(allBooks, end - start)
+        scanner.close()
+        if spill != None:
+            spill.spill(allBooks)
+        if numSkipped != 0:
+            PROFILER.count("skip sections", calls=0, items=numSkipped)
+            printHelper("Skipped {} section(s) not matching the filters".format(numSkipped))
+        printHelper("\nFinished parsing data from {} books!".format(len(allBooks)))
+        if numErrors != 0 and errorPolicy != "ask":
+            printHelper("{} error(s) parsing input file (problem sections were skipped)".format(numErrors), isError=True)
+        elif numErrors != 0:
+            ClippyKindle._askContinue(numErrors)
+
+        return list(allBooks) # list of Book objects
+
+    @staticmethod
+    def parseClippingsFiles(fnames, maxWorkers=None, verbose=1, errorPolicy="ask", errors=None, sectionFilter=None):
+        """
+        parses multiple kindle clippings txt files (e.g. from several devices) concurrently (in separate processes)
+        and merges their data, combining books with the same name (see Book.getName()) into one Book object.
+
+        parameters:
+            fnames (:type: list of str): file paths to txt files to parse
+            maxWorkers (int): optional max number of files to parse at once (default: number of CPUs)
+            verbose, errorPolicy, errors, sectionFilter: see parseClippings() (when errorPolicy is "ask",
+                the user is asked whether to continue only once, after every file is parsed)
+        return:
+            (:type listOfObjects: DataStructures.Book) list of Book objects
+        """
+        if len(fnames) == 1:
+            return ClippyKindle.parseClippings(fnames[0], verbose, errorPolicy, errors, sectionFilter)
+        workerPolicy = "collect" if errorPolicy == "ask" else errorPolicy
+        allBooks = {} # dict mapping book name -> Book object (merged from every file)
+        allErrors = []
+        from concurrent.futures import ProcessPoolExecutor
+        with PROFILER.stage("parse files", items=len(fnames)), ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            # (results are merged in the order files were provided)
+            for bookList, fileErrors in executor.map(_parseClippingsWorker, fnames,
+                    [verbose] * len(fnames), [workerPolicy] * len(fnames), [sectionFilter] * len(fnames)):
+                allErrors += fileErrors
+                ClippyKindle._mergeBooks(allBooks, bookList)
+        if errors != None:
+            errors += allErrors
+        if len(allErrors) != 0 and errorPolicy == "ask":
+            for error in allErrors:
+                print("{}\nproblem section in file '{}' (lines {} - {}) >>>".format(error["error"], error["file"], error["lineStart"], error["lineEnd"]), file=sys.stderr)
+                for line in error["lines"]:
+                    print("  '{}'".format(line), file=sys.stderr)
+                print("<<<\n", file=sys.stderr)
+            ClippyKindle._askContinue(len(allErrors))
+        if verbose == 1:
+            print("\nFinished parsing data from {} files ({} books)!".format(len(fnames), len(allBooks)))
+        return list(allBooks.values())
+
+    @staticmethod
+    def _mergeBooks(allBooks, bookList):
+        """
+        helper function merging parsed books into allBooks (a dict mapping book name -> Book object),
+        appending the items of books with the same name (see Book.getName()) to the existing Book object
+        """
+        for book in bookList:
+            if book.getName() not in allBooks:
+                allBooks[book.getName()] = book
+            else:
+                merged = allBooks[book.getName()]
+                merged.highlights += book.highlights
+                merged.notes += book.notes
+                merged.bookmarks += book.bookmarks
+                merged.sorted = False
+
+    @staticmethod
+    def _askContinue(numErrors):
+        """
+        asks the user whether to continue after errors parsing input (exiting if not)
+        """
+        if input("{} error(s) parsing input file. Continue anyway (y/n)? "\
                 .format(numErrors)).lower().strip() in ('n','no'):
             print("Aborting...")
             print("Feel free to report any issues with parsing your 'My Clippings.txt' file here: https://github.com/dangbert/clippy-kindle/issues/new")
             exit(1)
 
-        outData = [] # list of Book objects
-        for bookId in allBooks:
-            outData.append(allBooks[bookId])
-        return outData
-
     @staticmethod
-    def _parseSection(section, allBooks):
+    def _parseSection(section, allBooks, session=None):
         """
         Parses lines belonging to a section of the clippings file that pertains to a single Highlight/Note/Bookmark object
         Creates a Highlight, Note, or Bookmark object as needed and stores it in allBooks under its relevant book
 
         Parameters:
             section (:type: list of str): array of lines from a clippings file containing all the information pertaining to one particular highlight, note, or bookmark
-            allBooks (dict): dict mapping each book's title/author string (e.g. "Fahrenheit 451: A Novel (Bradbury, Ray)") to a Book object
+            allBooks (DataStructures.BookRegistry): registry mapping each book's title/author string (e.g. "Fahrenheit 451: A Novel (Bradbury, Ray)") to a Book object
+            session (Session.Session): optional session providing (memoized) matchFormats() and parseDate() functions
 
         return: None if successful else returns str explaining error
         """
+        matchFormats = ClippyKindle._matchFormats if session == None else session.matchFormats
+        parseDate = ClippyKindle._parseDate if session == None else session.parseDate
 
         # retreive just the lines in section that aren't empty
         contentLines = []
@@ -159,16 +353,8 @@ class ClippyKindle:
         if not len(contentLines) >= 2:
             return "ERROR: found section with an unexpected number of lines"
 
-        # create book object in allBooks if not already existing for this book
-        bookId = contentLines[0]
-        if bookId not in allBooks:
-            # parse title into title / author
-            title, author = bookId, ""
-            if bookId.endswith(')') and bookId.count(' (') >= 1:
-                title = bookId[0 : bookId.rfind('(')-1].strip()
-                author = bookId[bookId.rfind(" (")+2 : bookId.rfind(")")].strip()
-            #print("***** found: '{}' by '{}' *****".format(title, author))
-            allBooks[bookId] = DataStructures.Book(title, author)
+        # get book object in allBooks (created if not already existing for this book)
+        book = allBooks.get(allBooks.getId(contentLines[0]))
 
         # parse.parse https://stackoverflow.com/a/18620969
         if contentLines[1].startswith(HIGHLIGHT_START) and len(contentLines) == 3:
@@ -179,19 +365,15 @@ class ClippyKindle:
             - Your Highlight on Location 4749-4749 | Added on Saturday, January 4, 2020 10:20:02 AM
             me pongo en cuclillas
             """
-            res = None
-            for formatStr in HIGHLIGHT_FORMATS:
-                res = parse.parse(formatStr, contentLines[1])
-                if res != None:
-                    break
+            res = matchFormats(HIGHLIGHT_FORMATS, contentLines[1])
             if res == None:
                 return "ERROR: unable to parse highlight (in unexpected/unsupported format)"
 
             try:
-                date = parser.parse(res['date'])
+                date = parseDate(res['date'])
                 loc2 = res['loc2'] if 'loc2' in res else res['loc1'] # if loc2 not set, use loc1 in its place
                 highlight = DataStructures.Highlight((res['loc1'], loc2), res['locType'].lower(), date, contentLines[2])
-                allBooks[bookId].highlights.append(highlight)
+                book.addItem(highlight)
             except ValueError:                  # due to date parsing or casting page/loc as an int
                 return "ERROR: unable to parse date in highlight"
 
@@ -202,18 +384,14 @@ class ClippyKindle:
             Do Androids Dream of Electric Sheep? (Dick, Philip K.)
             - Your Bookmark on Location 604 | Added on Friday, November 25, 2016 12:13:59 AM
             """
-            res = None
-            for formatStr in BOOKMARK_FORMATS:
-                res = parse.parse(formatStr, contentLines[1])
-                if res != None:
-                    break
+            res = matchFormats(BOOKMARK_FORMATS, contentLines[1])
             if res == None:
                 return "ERROR: unable to parse bookmark (in unexpected/unsupported format)"
 
             try:
-                date = parser.parse(res['date'])
+                date = parseDate(res['date'])
                 bookmark = DataStructures.Bookmark(res['loc'], res['locType'].lower(), date)
-                allBooks[bookId].bookmarks.append(bookmark)
+                book.addItem(bookmark)
             except ValueError:
                 return "ERROR: unable to parse date in bookmark"
 
@@ -231,16 +409,12 @@ class ClippyKindle:
             Cite specific lines from the text to illustrate where you saw the elements/themes.
             ==========
             """
-            res = None
-            for formatStr in NOTE_FORMATS:
-                res = parse.parse(formatStr, contentLines[1])
-                if res != None:
-                    break
+            res = matchFormats(NOTE_FORMATS, contentLines[1])
             if res == None:
                 return "ERROR: unable to parse note (in unexpected/unsupported format)"
 
             try:
-                date = parser.parse(res['date'])
+                date = parseDate(res['date'])
                 content = section[2:] # get just the content lines of the note
                 # remove first and trailing empty lines if they exist (notes are always preceeded by an empty line)
                 content = content[1:] if content[0] == "" and len(content) > 1 else content
@@ -248,9 +422,48 @@ class ClippyKindle:
                     content = content[:-1]
 
                 note = DataStructures.Note(res['loc'], res['locType'].lower(), date, '\n'.join(str(line) for line in content))
-                allBooks[bookId].notes.append(note)
+                book.addItem(note)
             except ValueError:
                 return "ERROR: unable to parse date in note"
 
         else:
             return "ERROR: not sure how to parse section"
+
+    @staticmethod
+    def _matchFormats(formats, line):
+        """
+        tries each of the provided format strings (in order) until one successfully parses the provided line
+
+        Parameters:
+            formats (:type: list of str): format strings to try (e.g. HIGHLIGHT_FORMATS)
+            line (str): line to parse (e.g. "- Your Bookmark on Location 604 | Added on Friday, November 25, 2016 12:13:59 AM")
+
+        return: (parse.Result) result of the first successful parse (or None if no format matched)
+        """
+        with PROFILER.stage("parse.parse"):
+            for formatStr in formats:
+                if formatStr not in _compiledFormats:
+                    import parse
+                    _compiledFormats[formatStr] = parse.compile(formatStr)
+                res = _compiledFormats[formatStr].parse(line)
+                if res != None:
+                    return res
+        return None
+
+    @staticmethod
+    def _parseDate(dateStr):
+        """
+        parses a date string from the clippings file (e.g. "Saturday, January 4, 2020 10:20:02 AM")
+        raises ValueError if it can't be parsed
+
+        return: (datetime.datetime) parsed date
+        """
+        with PROFILER.stage("parse date"):
+            for formatStr in DATE_FORMATS:
+                try:
+                    return datetime.strptime(dateStr, formatStr)
+                except ValueError:
+                    pass
+        with PROFILER.stage("dateutil"):
+            from dateutil import parser
+            return parser.parse(dateStr)
@@ -5,15 +5,40 @@ import os
 import sys
 import argparse
 import json
+import time
+from datetime import datetime
 
-from ClippyKindle import ClippyKindle
+from ClippyKindle import ClippyKindle, ParseError, SectionFilter, ERROR_POLICIES
+from ClippyKindle.Profiler import PROFILER
+from ClippyKindle.Compression import COMPRESSIONS, openFile, stripCompressionExt
+# NOTE: modules only needed by optional features are imported where they're used (to speed up startup)
 
 def main():
     # parse args:
     parser = argparse.ArgumentParser(description='Parses a "My Clippings.txt" file from a kindle and outputs the data to a json file.')
-    parser.add_argument('file_name', type=str, help='(string) path to kindle clippings file e.g. "./My Clippings.txt"')
+    parser.add_argument('file_name', type=str, nargs='+', help='(string) path to kindle clippings file e.g. "./My Clippings.txt" (which may be compressed with gzip/bz2/xz) (multiple files, e.g. from several kindles, or folders containing .txt clippings files can also be provided, and will be parsed concurrently and merged)')
+    parser.add_argument('--jobs', type=int, default=None, help='(int) max number of clippings files to parse at once (default: number of CPUs)')
     parser.add_argument('--out-folder', type=str, default='.', help='(string) path of folder to output parsed clippings (default: \'.\')')
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None, help='(date) only parse items added on or after this date (ISO 8601 e.g. "2021-03-05" or "2021-03-05T18:30"). Other sections of the clippings file are skipped without being fully parsed, so the collection outputted only contains the matching items.')
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None, help='(date) only parse items added before this date (see --since)')
+    parser.add_argument('--book', type=str, action="append", default=None, help='(string) only parse items of books whose title or author contains this text (case insensitive), can be provided multiple times (see --since)')
+    parser.add_argument('--memory-budget', type=float, default=None, help='(float) optional max number of megabytes of parsed clippings to hold in memory at once (e.g. 512) for collections too large to fit in memory. Parsed items are spilled to temporary files (in $TMPDIR) whenever the budget is exceeded, and books are then sorted/deduplicated one at a time (streaming the items of books too large for the budget from disk). Files are parsed one at a time (compressed files are decompressed to a temporary file rather than into memory), and only \'--store json\' is supported (without --similar-books or --search-index).')
+    parser.add_argument('--compress', type=str, choices=["gzip", "bz2", "xz"], default=None, help="Compress the outputted collection.json (e.g. 'gzip' writes collection.json.gz), which marky.py (and the other scripts) read transparently. Compressed clippings files (e.g. \"My Clippings.txt.gz\") are always detected and read without being decompressed to disk. Run \"python3 -m ClippyKindle.Compression collection.json\" to compare the time spent (de)compressing with each format against the I/O time saved.")
     parser.add_argument('--keep-dups', action="store_true", help="When this flag is provided, duplicate highlights/notes/bookmarks will not be detected/removed before outputting to json.")
+    parser.add_argument('--store', type=str, choices=["json", "sqlite", "shards"], default="json", help="How to store the parsed collection: 'json' writes collection.json (the default), 'sqlite' adds/replaces the parsed books in an indexed collection.sqlite database, 'shards' writes a collection/ folder with a json file per book and a manifest, only rewriting the files of books that changed since the last run (marky.py can also read either).")
+    parser.add_argument('--similar-books', type=str, choices=["report", "ask", "merge"], default=None, help="Find books that share most of their highlights/notes (e.g. the same book under a slightly different title) and either 'report' them, 'ask' whether to merge each pair, or 'merge' them all. (With --batch, 'ask' only reports.)")
+    parser.add_argument('--search-index', action="store_true", help="Also (incrementally) update the search index stored next to the outputted collection (used by searchy.py).")
+    parser.add_argument('--dedup-cache', type=str, default='', help='(string) optional path of a file for remembering duplicate detection decisions between runs (e.g. ".dedup-cache.sqlite"), so later runs only compare new items')
+    parser.add_argument('--dedup-cache-size', type=int, default=200000, help='(int) max number of decisions to keep in --dedup-cache (least recently used are discarded first, default: 200000)')
+    parser.add_argument('--clear-dedup-cache', action="store_true", help="Discard all decisions stored in --dedup-cache before running (they are also automatically discarded when the dedup thresholds change).")
+    parser.add_argument('--dedup-audit', type=str, default='', help='(string) optional path of jsonl file to record each removed duplicate in, along with the item kept in its place (e.g. "dedup-audit.jsonl"). Sample it with "python3 -m ClippyKindle.Audit dedup-audit.jsonl"')
+    parser.add_argument('--batch', action="store_true", help="Run non-interactively (never prompt), e.g. for scheduled jobs. Implies '--on-error collect' unless --on-error is provided.")
+    parser.add_argument('--on-error', type=str, choices=ERROR_POLICIES, default=None, help="How to handle sections of the clippings file that fail to parse: 'ask' (print them and ask whether to continue, the default), 'skip' (continue), 'collect' (continue, only recording them in --error-report) or 'fail' (exit with an error).")
+    parser.add_argument('--error-report', type=str, default='', help='(string) optional path of json file to write details of any sections that failed to parse to (e.g. "errors.json")')
+    parser.add_argument('--profile', action="store_true", help="Print the time spent (and call/item counts) in each stage of parsing, sorting, removing duplicates and outputting, and the slowest books.")
+    parser.add_argument('--profile-dump', type=str, default='', help='(string) optional path to also write a cProfile dump of the run to (e.g. "clippy.prof"), viewable with "python -m pstats clippy.prof"')
+    parser.add_argument('--metrics', type=str, default='', help='(string) optional path of file to write metrics of the run to for monitoring (e.g. "clippy.prom" for node_exporter\'s textfile collector, or "metrics.json"): sections parsed per second, parsing errors, duplicates removed per type, bytes read/written, time spent per stage and peak memory use')
+    parser.add_argument('--metrics-format', type=str, choices=["prometheus", "json"], default=None, help="Format of --metrics file (default: json if its name ends with '.json', otherwise prometheus)")
     # TODO: (optionally) provide an existing collection.json, and only have data outside of each book's dateStart and dateEnd appended to that file
     #   lets you delete unwanted items in a book's collection and not have them show up again the next time "My Clippings.txt" is parsed
     #   also lets you get a new kindle and still have your old notes preserved
@@ -23,26 +48,265 @@ def main():
         exit(1)
     args = parser.parse_args()
 
+    metrics = None
+    if args.metrics != "":
+        from ClippyKindle.Metrics import Metrics
+        metrics = Metrics("clippy")
+    PROFILER.enabled = args.profile or metrics != None # (time per stage is also recorded in metrics)
+    outputs = []
+    success = False
+    try:
+        if args.profile_dump != "":
+            import cProfile
+            profile = cProfile.Profile()
+            outputs = profile.runcall(run, args, metrics)
+            profile.dump_stats(args.profile_dump)
+            print("Wrote cProfile dump to: '{}'".format(args.profile_dump))
+        else:
+            outputs = run(args, metrics)
+        success = True
+    finally:
+        # (metrics are also written when the run is aborted e.g. by exit(1), with whatever was recorded so far)
+        if metrics != None:
+            metrics.set("run_success", int(success), "1 if the run completed, 0 if it was aborted")
+            metrics.addBytes("bytes_written", outputs, "total size of the collection files written")
+            metrics.addProfiler(PROFILER)
+            metrics.finish()
+            metrics.write(args.metrics, args.metrics_format)
+            print("Wrote metrics to: '{}'".format(args.metrics))
+
+    if args.profile:
+        print("\nTime spent per stage:")
+        print(PROFILER.report())
+        from ClippyKindle.DataStructures import SIMILARITY_TIERS
+        pruneReport = PROFILER.pruneReport(SIMILARITY_TIERS)
+        if pruneReport != None:
+            print("\nFuzzy duplicate checks ruled out by each stage:")
+            print(pruneReport)
+        print("\nSlowest books:")
+        print(PROFILER.bookReport())
+
+def run(args, metrics=None):
+    """
+    parses the clippings file and writes the collection (json file or sqlite store) using the provided (parsed) command line args
+    params:
+        metrics (ClippyKindle.Metrics.Metrics): optional metrics to record statistics of the run in
+    return: list of paths of the collection files written
+    """
     # parse file:
-    bookList = ClippyKindle.parseClippings(args.file_name)     # list of Book objects
+    errorPolicy = args.on_error if args.on_error != None else ("collect" if args.batch else "ask")
+    errors = []
+    sectionFilter = None
+    if args.since != None or args.until != None or args.book != None:
+        if args.store == "sqlite" and (args.since != None or args.until != None):
+            # (books in the store are replaced entirely, so their items outside the date window would be lost)
+            print("ERROR: --since/--until can't be used with '--store sqlite'", file=sys.stderr)
+            exit(1)
+        if args.store == "shards":
+            # (shards of books not parsed are removed, and the other books are rewritten with only their matching items)
+            print("ERROR: --since/--until/--book can't be used with '--store shards'", file=sys.stderr)
+            exit(1)
+        sectionFilter = SectionFilter(since=args.since, until=args.until, books=args.book)
+    if args.compress != None and args.store != "json":
+        print("ERROR: --compress can only be used with '--store json'", file=sys.stderr)
+        exit(1)
+    spill = None # collection holding the parsed items on disk (if parsing with a memory budget)
+    if args.memory_budget != None:
+        if args.store != "json" or args.similar_books != None or args.search_index:
+            # (these need every book in memory at once)
+            print("ERROR: --memory-budget can only be used with '--store json' (and without --similar-books or --search-index)", file=sys.stderr)
+            exit(1)
+        from ClippyKindle.OutOfCore import SpillCollection
+        spill = SpillCollection(int(args.memory_budget * 1024 * 1024))
+    fnames = getInputFiles(args.file_name)
+    parseStart = time.perf_counter()
+    try:
+        if spill != None:
+            # (books with the same name in several files are merged by spill)
+            for fname in fnames:
+                ClippyKindle.parseClippings(fname, errorPolicy=errorPolicy, errors=errors, sectionFilter=sectionFilter, spill=spill)
+            bookList = []
+        else:
+            bookList = ClippyKindle.parseClippingsFiles(fnames, maxWorkers=args.jobs,
+                    errorPolicy=errorPolicy, errors=errors, sectionFilter=sectionFilter) # list of Book objects
+    except ParseError as e:
+        if spill != None:
+            spill.close()
+        # (errors raised in worker processes aren't added to errors)
+        errors += [error for error in e.errors if error not in errors]
+        print("ERROR: {}".format(e), file=sys.stderr)
+        exit(1)
+    finally:
+        if metrics != None:
+            metrics.set("input_files", len(fnames), "number of clippings files parsed")
+            metrics.addBytes("bytes_read", fnames, "total size of the clippings files parsed")
+            metrics.set("parse_errors", len(errors), "number of sections of the clippings files that failed to parse")
+        if args.error_report != "":
+            with open(args.error_report, 'w') as f:
+                json.dump(errors, f, indent=2)
+            print("Wrote {} parsing error(s) to: '{}'".format(len(errors), args.error_report))
+
+    if metrics != None:
+        parseSeconds = time.perf_counter() - parseStart
+        numParsed = countItems(bookList) if spill == None else {itemType: sum(info["counts"][itemType] for info in spill.books.values())
+            for itemType in ["highlight", "note", "bookmark"]}
+        metrics.set("parse_seconds", round(parseSeconds, 6), "wall time spent parsing the clippings files")
+        metrics.set("sections_parsed", sum(numParsed.values()), "number of sections of the clippings files parsed successfully")
+        metrics.set("sections_per_second", round(sum(numParsed.values()) / max(parseSeconds, 1e-9), 3), "sections parsed per second of wall time")
+
+    if args.similar_books != None:
+        mode = "report" if (args.batch and args.similar_books == "ask") else args.similar_books
+        bookList = mergeSimilarBooks(bookList, mode)
 
     outData = []
+    dedupCache, audit = None, None
     if not args.keep_dups:
         print("Removing duplicates (this may take a few minutes)...")
+        if args.dedup_cache != "":
+            from ClippyKindle.DedupCache import DedupCache
+            dedupCache = DedupCache(args.dedup_cache, maxEntries=args.dedup_cache_size)
+            if args.clear_dedup_cache:
+                dedupCache.clear()
+        if args.dedup_audit != "":
+            from ClippyKindle.Audit import DedupAudit
+            audit = DedupAudit(args.dedup_audit)
+    # get file name for outputting json data
+    outPath = args.out_folder + ("" if args.out_folder.endswith("/") else "/")
+    outPathJson = outPath + "collection.json" + ("" if args.compress == None else COMPRESSIONS[args.compress][1])
+    summaries = None # summary of each book written (if already computed)
+    if spill != None:
+        try:
+            with PROFILER.stage("write json", items=len(spill)):
+                summaries = spill.writeJson(outPathJson, removeDups=(not args.keep_dups), dedupCache=dedupCache, audit=audit)
+        finally:
+            spill.close()
     for book in bookList:
         # do post-processing on books (sorting/removing duplicates)
-        book.sort(removeDups=(not args.keep_dups))
-        outData.append(book.toDict())
+        book.sort(removeDups=(not args.keep_dups), dedupCache=dedupCache, audit=audit)
+        if args.store in ["json", "shards"]:
+            with PROFILER.stage("toDict", book=book.getName() if PROFILER.enabled else None):
+                outData.append(book.toDict())
 
-    # get file name for outputting json data
-    outPath = args.out_folder + ("" if args.out_folder.endswith("/") else "/")
-    outPathJson = outPath + "collection.json"
+    if metrics != None:
+        numKept = countItems(bookList) if spill == None else {itemType: sum(getattr(summary, itemType + "s") for summary in summaries)
+            for itemType in numParsed}
+        metrics.set("books", len(bookList) if spill == None else len(summaries), "number of books in the collection written")
+        for itemType in numParsed:
+            metrics.set("items", numKept[itemType], "number of items in the collection written (per type)", "type", itemType)
+        for itemType in numParsed:
+            metrics.set("dedup_removed", numParsed[itemType] - numKept[itemType], "number of duplicate items removed (per type)", "type", itemType)
+    if audit != None:
+        audit.close()
+        print("Recorded {} removed duplicate(s) in: '{}'".format(audit.numRecords, args.dedup_audit))
+    if dedupCache != None:
+        dedupCache.close()
+        print("Duplicate detection cache: {} hit(s), {} new comparison(s)".format(dedupCache.hits, dedupCache.misses))
+
+    if args.store == "sqlite":
+        outPathDb = outPath + "collection.sqlite"
+        with PROFILER.stage("write sqlite", items=len(bookList)):
+            from ClippyKindle.SqliteStore import SqliteStore
+            store = SqliteStore(outPathDb)
+            store.writeBooks(bookList)
+            store.close()
+        print("Wrote all parsed data to: '{}'\n".format(outPathDb))
+        if args.search_index:
+            updateSearchIndex(outPathDb, bookList, prune=False) # (store may hold books not in this file)
+        return [outPathDb]
+    if args.store == "shards":
+        outPathShards = outPath + "collection"
+        from ClippyKindle.Shards import writeShards
+        with PROFILER.stage("write shards", items=len(outData)):
+            numWritten, numUnchanged, numRemoved = writeShards(outPathShards, bookList, outData)
+        print("Wrote all parsed data to: '{}' ({} book(s) written, {} unchanged, {} removed)\n".format(
+            outPathShards, numWritten, numUnchanged, numRemoved))
+        if args.search_index:
+            updateSearchIndex(outPathShards, bookList, prune=True)
+        return [outPathShards]
     #if os.path.exists(outPathJson):
     #    if not answerYesNo("Overwrite '{}' (y/n)? ".format(outPathJson)):
     #        outPathJson = getAvailableFname(outPath + "collection", ".json")
-    with open(outPathJson, 'w') as f:
-        json.dump(outData, f, indent=2) # write indented json to file
-        print("Wrote all parsed data to: '{}'\n".format(outPathJson))
+    if spill == None:
+        with PROFILER.stage("write json", items=len(outData)), openFile(outPathJson, 'w') as f:
+            json.dump(outData, f, indent=2) # write indented json to file
+    print("Wrote all parsed data to: '{}'".format(outPathJson))
+    # (summary of each book, so books can be listed without loading the whole collection)
+    from ClippyKindle.Summary import writeSummaries
+    with PROFILER.stage("write summary", items=(len(outData) if spill == None else len(spill))):
+        if summaries == None:
+            summaries = [book.getSummary(d) for book, d in zip(bookList, outData)]
+        summaryPath = writeSummaries(outPathJson, summaries)
+    print("Wrote summary of each book to: '{}'\n".format(summaryPath))
+    if args.search_index:
+        updateSearchIndex(outPathJson, bookList, prune=True)
+    return [outPathJson, summaryPath]
+
+def countItems(bookList):
+    """
+    returns the number of items of each type in the provided books
+    params:
+        bookList: list of ClippyKindle.Book objects
+    return (dict): mapping item type ("highlight", "note" or "bookmark") -> number of items of that type
+    """
+    return {"highlight": sum(len(book.highlights) for book in bookList), "note": sum(len(book.notes) for book in bookList),
+        "bookmark": sum(len(book.bookmarks) for book in bookList)}
+
+def getInputFiles(paths):
+    """
+    returns the list of clippings files to parse from the provided paths (replacing folders with the .txt files within them,
+    including compressed ones e.g. .txt.gz)
+    """
+    fnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            fnames += sorted(os.path.join(path, name) for name in os.listdir(path) if stripCompressionExt(name).lower().endswith(".txt"))
+        else:
+            fnames.append(path)
+    return fnames
+
+def mergeSimilarBooks(bookList, mode):
+    """
+    finds pairs of books sharing most of their highlights/notes and (depending on mode) merges them
+    params:
+        bookList: list of ClippyKindle.Book objects
+        mode (str): "report" (only print pairs found), "ask" (prompt user to merge each pair), or "merge" (merge all pairs)
+    return: list of Book objects remaining (books merged into another are removed)
+    """
+    from ClippyKindle.Fingerprints import findSimilarBooks, mergeBooks
+    with PROFILER.stage("similar books", items=len(bookList)):
+        pairs = findSimilarBooks(bookList)
+    if len(pairs) == 0:
+        return bookList
+    print("\nFound {} pair(s) of books sharing most of their highlights/notes:".format(len(pairs)))
+    mergedInto = {} # dict mapping index of a merged book -> index of book it was merged into
+    for a, b, count, ratio in pairs:
+        while a in mergedInto:
+            a = mergedInto[a]
+        while b in mergedInto:
+            b = mergedInto[b]
+        if a == b:
+            continue
+        print("  '{}' and '{}' share {} highlight(s)/note(s) ({:.0%} of the smaller book)"
+                .format(bookList[a].getName(), bookList[b].getName(), count, ratio))
+        if mode == "report" or (mode == "ask" and input("  Merge the latter into the former (y/n)? ").lower().strip() not in ('y', 'yes')):
+            continue
+        numAdded = mergeBooks(bookList[a], bookList[b])
+        mergedInto[b] = a
+        print("  merged ({} new item(s) added)".format(numAdded))
+    print()
+    return [book for i, book in enumerate(bookList) if i not in mergedInto]
+
+def updateSearchIndex(collectionPath, bookList, prune):
+    """
+    updates the search index stored next to the provided collection with the provided books
+    """
+    from ClippyKindle.Search import SearchIndex, getIndexPath
+    indexPath = getIndexPath(collectionPath)
+    with PROFILER.stage("search index", items=len(bookList)):
+        index = SearchIndex(indexPath)
+        numAdded, numRemoved = index.update(bookList, prune=prune)
+        index.close()
+    print("Updated search index '{}' ({} item(s) added, {} removed)\n".format(indexPath, numAdded, numRemoved))
 
 if __name__ == "__main__":
     main()
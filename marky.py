@@ -5,132 +5,217 @@ import os
 import sys
 import argparse
 import json
-import csv
-import copy
 import re
+# NOTE: the modules copy, prettytable and sqlite3 are only imported when needed (to speed up startup)
 
 from datetime import datetime
-from prettytable import PrettyTable
 import ClippyKindle
+from ClippyKindle.SqliteStore import SqliteStore
+from ClippyKindle import Exporters
+from ClippyKindle.Profiler import PROFILER
 
 def main():
     # parse args:
     parser = argparse.ArgumentParser(description='Parses a json file created by clippy.py and creates markdown and csv files for each book as desired.')
-    parser.add_argument('json_file', type=str, help='(string) path to json file created by clippy.py (e.g. "./collection.json")')
-    parser.add_argument('out_folder', type=str, help='(string) path of folder to output markdown and csv files (e.g. "./output")')
+    parser.add_argument('json_file', type=str, help='(string) path to json file (or sqlite store or sharded collection folder) created by clippy.py (e.g. "./collection.json", "./collection.sqlite" or "./collection"), json files may be compressed (e.g. "./collection.json.gz")')
+    parser.add_argument('out_folder', type=str, nargs='?', help='(string) path of folder to output markdown and csv files (e.g. "./output")')
+    parser.add_argument('--list', action="store_true", help="Only list the books in the collection (with their number of highlights/notes/bookmarks and date range) and exit. Uses the summary index written next to the collection by clippy.py, so the collection itself doesn't need to be loaded.")
     parser.add_argument('--settings', type=str, help='(string) path to json file containing settings for parsing books (optional). If no settings is provided then the program will offer to create one.')
     # https://docs.python.org/dev/library/argparse.html#action
     parser.add_argument('--latest-csv', action="store_true", help='Causes only the newly added items (since the last output using --update-outdate) to be outputted to csv files.')
     parser.add_argument('--update-outdate', action="store_true", help='Stores the date of the latest item outputted for each book in the settings file.')
     parser.add_argument('--omit-notes', action="store_true", help="Omits the user's typed notes for each book in markdown output.")
+    parser.add_argument('--batch', action="store_true", help="Run non-interactively (never prompt), e.g. for scheduled jobs. Books missing from the settings are placed in --default-group, and settings are only saved if --settings was provided.")
+    parser.add_argument('--default-group', type=str, default="both", help="(string) settings group to place books missing from the settings in when running with --batch (default: 'both')")
+    parser.add_argument('--metrics', type=str, default='', help='(string) optional path of file to write metrics of the run to for monitoring (e.g. "marky.prom" for node_exporter\'s textfile collector, or "metrics.json"): books and files outputted, bytes read/written, time spent per stage and peak memory use')
+    parser.add_argument('--metrics-format', type=str, choices=["prometheus", "json"], default=None, help="Format of --metrics file (default: json if its name ends with '.json', otherwise prometheus)")
     # (args starting with '--' are made optional)
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         exit(1)
     args = parser.parse_args()
+    if args.list:
+        listBooks(args.json_file)
+        return
+    if args.out_folder == None:
+        parser.error("the following arguments are required: out_folder")
+
+    metrics = None
+    if args.metrics != "":
+        from ClippyKindle.Metrics import Metrics
+        metrics = Metrics("marky")
+        PROFILER.enabled = True # (time per stage is recorded in metrics)
+    success = False
+    try:
+        run(args, parser, metrics)
+        success = True
+    finally:
+        # (metrics are also written when the run is aborted e.g. by exit(1), with whatever was recorded so far)
+        if metrics != None:
+            metrics.set("run_success", int(success), "1 if the run completed, 0 if it was aborted")
+            metrics.addProfiler(PROFILER)
+            metrics.finish()
+            metrics.write(args.metrics, args.metrics_format)
+            print("Wrote metrics to: '{}'".format(args.metrics))
+    #########################################
+
+def run(args, parser, metrics=None):
+    """
+    outputs the markdown/csv files of the books in the collection using the provided (parsed) command line args
+    params:
+        parser (argparse.ArgumentParser): parser of the args (to report usage errors with)
+        metrics (ClippyKindle.Metrics.Metrics): optional metrics to record statistics of the run in
+    """
+    # read json settings from file:
+    settings = None
+    if args.settings != None:
+        with open(args.settings) as f:
+            settings = json.load(f)
+    groupNames = list(settings if settings != None else getDefaultSettings())
+    if args.batch and args.default_group not in groupNames:
+        # (checked before loading the collection, so scheduled jobs fail fast)
+        parser.error("--default-group '{}' isn't a settings group (existing groups: {})".format(args.default_group, groupNames))
 
     outPath = args.out_folder + ("" if args.out_folder.endswith("/") else "/")
     if not os.path.isdir(outPath):
         os.mkdir(outPath)
-    bookList = ClippyKindle.ClippyKindle.parseJsonFile(args.json_file)
+    store = None # SqliteStore to load books from on demand (if provided instead of a json file)
+    shards = None # folder of sharded collection to load books from (if provided instead of a json file)
     bookMap = {} # map book titles to its respective Book object
-    for bookObj in bookList:
-        bookMap[bookObj.getName()] = {"obj": bookObj, "used": False}
+    if os.path.isdir(args.json_file):
+        from ClippyKindle.Shards import readManifest
+        entries = readManifest(args.json_file)
+        if entries == None:
+            print("ERROR: not a sharded collection created by clippy.py: '{}'".format(args.json_file), file=sys.stderr)
+            exit(1)
+        shards = args.json_file
+        for entry in entries:
+            bookMap[entry["name"]] = {"obj": None, "used": False} # (loaded once settings are known)
+    elif SqliteStore.isStorePath(args.json_file):
+        store = SqliteStore(args.json_file)
+        for bookName in store.getBookNames():
+            bookMap[bookName] = {"obj": None, "used": False} # (loaded when needed)
+    else:
+        with PROFILER.stage("load collection"):
+            bookList = ClippyKindle.ClippyKindle.parseJsonFile(args.json_file)
+        for bookObj in bookList:
+            bookMap[bookObj.getName()] = {"obj": bookObj, "used": False}
+    bookNames = list(bookMap)
+    if metrics != None:
+        metrics.set("books", len(bookNames), "number of books in the collection")
+        metrics.addBytes("bytes_read", [args.json_file], "size of the collection read")
 
-    # read json settings from file:
-    settings = None
     saveSettings = True # whether to write settings to file (updating existing if provided)
     if args.settings != None:
-        with open(args.settings) as f:
-            settings = json.load(f)
-        settings = updateSettings(bookList, settings, useDefaults=False)
+        settings = updateSettings(bookNames, settings, useDefaults=args.batch, defaultGroup=args.default_group)
+    elif args.batch:
+        print("No settings file provided, using defaults (creating both a .md and .csv file for every book)...")
+        settings = updateSettings(bookNames, settings=None, useDefaults=True, defaultGroup=args.default_group)
+        saveSettings = False
     else:
         # settings file not provided, so make settings here:
         print("No settings file provided, using defaults (creating both a .md and .csv file for every book)...")
         useDefaults = not answerYesNo("Or define custom settings now instead (y/n)? ")
-        settings = updateSettings(bookList, settings=None, useDefaults=useDefaults)
+        settings = updateSettings(bookNames, settings=None, useDefaults=useDefaults)
         if not answerYesNo("Save settings to file for later use (y/n)? "):
             saveSettings = False
         else:
             args.settings = getAvailableFname("settings", ".json")
 
+    if shards != None:
+        # only load (concurrently) the shards of books in groups that output something
+        from ClippyKindle.Shards import loadShards
+        needed = set(bookSettings["name"] for groupName in settings if Exporters.getGroupFormats(settings[groupName]) != ([], {})
+            for bookSettings in settings[groupName]["books"])
+        with PROFILER.stage("load collection", items=len(needed)):
+            bookList = loadShards(shards, names=needed)
+        for bookObj in bookList:
+            bookMap[bookObj.getName()]["obj"] = bookObj
+
     print("\nOutputting files based on selected settings...")
+    writers = Exporters.getWriters(renderMarkdown=jsonToMarkdown, omitNotes=args.omit_notes)
+    created = [] # paths of files created
+    numExported = 0 # number of books outputted
     for groupName in settings:
         #print("at group: " + groupName)
-        outputMD = (settings[groupName]["outputMD"] == True)   # whether to output md file for books in group
-        outputCSV = (settings[groupName]["outputCSV"] == True) # whether to output csv file for books in group
-
-        # filenames for combined output
-        #   (create additional file for everything in group if provided path != "")
-        combinedMD = settings[groupName]["combinedMD"].strip()
-        combinedCSV = settings[groupName]["combinedCSV"].strip()
-        # remove files we will be appending to:
-        for path in [combinedMD, combinedCSV]:
-            if path != "" and os.path.exists(args.out_folder + "/" + path):
-                os.remove(args.out_folder + "/" + path)
+        # formats to output a file in for each book in group, and formats to output a combined file in for the group
+        #   (outputMD/outputCSV and combinedMD/combinedCSV, plus any additional "formats" and "combined" listed)
+        formats, combined = Exporters.getGroupFormats(settings[groupName])
+        exporter = Exporters.Exporter(args.out_folder, writers, formats, combined)
         # TODO: add settings option for each group "separateFolder": True, (create folder for each group if needed)
-        #       use os.join() to append folder path to the filenames above (not below)
 
         # loop over books in this group
         for i in range(len(settings[groupName]["books"])):
             bookName = settings[groupName]["books"][i]["name"]
             chapters = settings[groupName]["books"][i]["chapters"]
+            if bookName not in bookMap:
+                print("NOTE: skipping book in settings that isn't in the collection: '{}'".format(bookName))
+                continue
 
             bookMap[bookName]["used"] = True
+            if len(formats) == 0 and len(combined) == 0:
+                continue # (nothing to output, so the book isn't loaded)
+            if bookMap[bookName]["obj"] == None:
+                with PROFILER.stage("load collection", items=1):
+                    bookMap[bookName]["obj"] = store.loadBook(bookName)
 
             bookObj = bookMap[bookName]["obj"]             # Book object from collection
             lastDate = bookObj.getDateRange()[1]           # datetime object of latest item added to book
-            fname = bookObj.getName().replace("/", "|")    # sanitize for output filename
-            outPathMD = "{}{}.md".format(outPath, fname)   # output markdown filename
-            outPathCSV = "{}{}.csv".format(outPath, fname) # output csv filename
-
-            mdStr = jsonToMarkdown(bookObj.toDict(), chapters, args.omit_notes)
-            csvStr = bookObj.toCSV()
+            latestObj = None                               # Book object of the new items only (for csv output)
             if args.latest_csv:
                 # ensure csv only contains new data since the last time it was outputted
-                tmp = copy.deepcopy(bookObj)
                 oldEpoch = settings[groupName]["books"][i].get("lastOutputDate", 0) # default 0
                 oldEpoch = 0 if oldEpoch == 0 else ClippyKindle.strToDate(oldEpoch).timestamp()
-                tmp.cutBefore(datetime.fromtimestamp(oldEpoch))
-                csvStr = tmp.toCSV()
-
-            # write markdown file:
-            if outputMD:
-                with open(outPathMD, 'w') as f:
-                    f.write(mdStr)
-                print("created: '{}'".format(outPathMD))
-            if combinedMD != "":
-                combinePath = os.path.join(args.out_folder, combinedMD)
-                existed = os.path.exists(combinePath)
-                with open(combinePath, 'a+') as f: # append or create file
-                    f.write(mdStr)
-                if not existed:
-                    print("created: '{}'".format(combinePath)) # print the first time only
-            # write csv file:
-            if outputCSV:
-                with open(outPathCSV, 'w') as f:
-                    csv.writer(f).writerows(csvStr)
-                print("created: '{}'".format(outPathCSV))
-                # update last outputted timestamp
-                if args.update_outdate:
-                    settings[groupName]["books"][i]["lastOutputDate"] = ClippyKindle.dateToStr(lastDate)
-            if combinedCSV != "":
-                combinePath = os.path.join(args.out_folder, combinedCSV)
-                existed = os.path.exists(combinePath)
-                with open(combinePath, 'a+') as f:  # append or create file
-                    csv.writer(f).writerows(csvStr if not existed else csvStr[1:]) # remove header if file already existed
-                if args.update_outdate:
-                    settings[groupName]["books"][i]["lastOutputDate"] = ClippyKindle.dateToStr(lastDate)
-                if not existed:
-                    print("created: '{}'".format(combinePath)) # print the first time only
+                if store != None:
+                    # (only load the new data from the store)
+                    latestObj = store.loadBook(bookName, after=datetime.fromtimestamp(oldEpoch))
+                else:
+                    import copy
+                    latestObj = copy.deepcopy(bookObj)
+                    latestObj.cutBefore(datetime.fromtimestamp(oldEpoch))
+
+            with PROFILER.stage("export", items=1, book=bookName if PROFILER.enabled else None):
+                paths = exporter.exportBook(bookObj, chapters, latestObj)
+            for path in paths:
+                print("created: '{}'".format(path))
+            numExported += 1
+            # update last outputted timestamp
+            if args.update_outdate and ("csv" in formats or "csv" in combined):
+                settings[groupName]["books"][i]["lastOutputDate"] = ClippyKindle.dateToStr(lastDate)
+        exporter.close()
+        created += exporter.created
 
     # update settings file:
     if saveSettings:
         with open(args.settings, 'w') as f:
             json.dump(settings, f, indent=2) # write indented json to file
         print("\nSettings stored in '{}'".format(args.settings))
-    #########################################
+
+    if metrics != None:
+        metrics.set("books_exported", numExported, "number of books outputted")
+        metrics.set("files_created", len(created), "number of files outputted")
+        metrics.addBytes("bytes_written", created, "total size of the files outputted")
+
+def listBooks(collectionPath):
+    """
+    prints a table of the books in a collection (from its summary index, see ClippyKindle.Summary)
+    params:
+        collectionPath (str): path of json file (or sqlite store) created by clippy.py
+    """
+    from ClippyKindle.Summary import loadSummaries
+    from prettytable import PrettyTable
+    DATE_FMT = "%B %d, %Y"
+    table = PrettyTable()
+    table.field_names = ["Book", "Highlights", "Notes", "Bookmarks", "From", "To"]
+    table.align["Book"] = "l"
+    summaries = loadSummaries(collectionPath)
+    for summary in summaries:
+        dateStart, dateEnd = summary.getDateRange()
+        table.add_row([summary.getName(), summary.highlights, summary.notes, summary.bookmarks,
+            "" if dateStart == None else dateStart.strftime(DATE_FMT), "" if dateStart == None else dateEnd.strftime(DATE_FMT)])
+    print(table)
+    print("{} book(s), {} item(s)".format(len(summaries), sum(summary.numItems() for summary in summaries)))
 
 def jsonToMarkdown(data, chapters=[], omitNotes=False):
     """
@@ -173,14 +258,14 @@ def jsonToMarkdown(data, chapters=[], omitNotes=False):
             # print number of '#' based on current chapter level
             md += "#{} {}\n".format("#" * len(cIndex), chap["title"])
             cIndex = cIndexAdvance(cIndex, chapters, verbose=True)
-        if "content" in item:  # escape all '*' as '\*'
-            item["content"] = item["content"].replace('*', '\*')
+        # escape all '*' as '\*' (without modifying data, as it may be output in other formats too)
+        content = item["content"].replace('*', r'\*') if "content" in item else None
         if item["type"] == "highlight":
-            md += "* {} -- [{} {}]\n\n".format(item["content"], locType, item["loc"])
+            md += "* {} -- [{} {}]\n\n".format(content, locType, item["loc"])
         if item["type"] == "note" and not omitNotes:
             # two spaces at the end of a line creates a line break after
             #   https://meta.stackexchange.com/a/186647
-            tmp = item["content"].replace("\n", "  \n> ")
+            tmp = content.replace("\n", "  \n> ")
             md += "> {} -- [{} {}]\n\n".format(tmp, locType, item["loc"])
         if item["type"] == "bookmark":
             md += "* [Bookmark -- {} {}]\n\n".format(locType, item["loc"])
@@ -245,47 +330,43 @@ def getChapterAt(cur_cIndex, cur_chapters):
         return None # unable to descend further as expected
     return getChapterAt(cur_cIndex[1:], cur_chapters[cur_cIndex[0]]["chapters"])
 
-def updateSettings(bookList, settings=None, useDefaults=False):
+def updateSettings(bookNames, settings=None, useDefaults=False, defaultGroup="both"):
     """
     ensures that every book in the provided list exists in the settings
     modifies existing settings if provided or creates default settings to modify
     params:
-        bookList: list of ClippyKindle.Book objects for settings to be created for
-        useDefaults (bool): true when we want to default to outputting a md and csv file for each book
-            otherwise prompt user to choose the group for each book that needs to be added to settings.
-            (Ignored if settings != None)
+        bookNames: list of names of books (see Book.getName()) for settings to be created for
+        useDefaults (bool): true when we want to place each book that needs to be added to settings in
+            defaultGroup (without prompting), otherwise prompt user to choose the group for each such book.
         settings (dict): optional existing settings to modify. If not provided, default settings
             are created and modified.
+        defaultGroup (str): name of settings group to place new books in when useDefaults is true
+            (default group "both" outputs a md and csv file for each book)
     return (dict): settings to use for these books
     """
     if settings == None:
-        # default settings groups:
-        settings = {
-            "csvOnly": {"outputMD": False, "outputCSV": True, "combinedMD": "", "combinedCSV": "", "books": []},
-            "both":    {"outputMD": True, "outputCSV": True, "combinedMD": "", "combinedCSV": "", "books": []},
-            "mdOnly":  {"outputMD": True, "outputCSV": False, "combinedMD": "", "combinedCSV": "", "books": []},
-            "skip":    {"outputMD": False, "outputCSV": False, "combinedMD": "", "combinedCSV": "", "books": []}
-        }
-    else:
-        useDefaults = False # (group "both" isn't guranteed to exist in this case)
+        settings = getDefaultSettings()
+    if useDefaults and defaultGroup not in settings:
+        raise ValueError("settings group '{}' doesn't exist (existing groups: {})".format(defaultGroup, list(settings)))
     # determine which books aren't in the settings:
     tmpMap = {} # map book names -> count of their appearences in settings 
     for groupName in settings:
         for b in settings[groupName]["books"]:
             tmpMap[b["name"]] = 1 if (b["name"] not in tmpMap) else tmpMap[b["name"]] + 1
-    newBooks = [bookObj for bookObj in bookList if bookObj.getName() not in tmpMap]
+    newBooks = [bookName for bookName in bookNames if bookName not in tmpMap]
     # print warning for books appearing in settings multipe times:
     for name in [bookName for bookName in tmpMap if tmpMap[bookName] > 1]:
         print("NOTE: book appears {} times in settings: '{}'".format(tmpMap[name], name))
 
     if len(newBooks) > 0 and not useDefaults:
         print("{} book(s) must have their output settings defined...".format(len(newBooks)))
-    # place each new book under desired group (default is "both"):
-    for bookIndex, bookObj in zip(range(len(newBooks)), newBooks):
-        selectedGroup = "both"
+    # place each new book under desired group (default is defaultGroup):
+    for bookIndex, bookName in zip(range(len(newBooks)), newBooks):
+        selectedGroup = defaultGroup
         if not useDefaults:
             prompt = "\nSelect a settings group for book {} of {}: '{}'\n"\
-                    .format(bookIndex+1, len(newBooks), bookObj.getName())
+                    .format(bookIndex+1, len(newBooks), bookName)
+            from prettytable import PrettyTable
             table = PrettyTable()  # http://zetcode.com/python/prettytable/
             table.field_names = ["Group #", "Group", "md file?", "csv file?", "Combined md for group?", "Combined csv for group?"]
             for index, groupName in zip(range(len(settings)), settings):
@@ -295,11 +376,23 @@ def updateSettings(bookList, settings=None, useDefaults=False):
             selectedGroup = [g for g in settings][answerMenu(prompt, len(settings))-1]
             print()
         settings[selectedGroup]["books"].append({
-            "name": bookObj.getName(),
+            "name": bookName,
             "chapters": []
         })
     return settings
 
+def getDefaultSettings():
+    """
+    returns the default settings groups (without any books)
+    return (dict): settings (see updateSettings())
+    """
+    return {
+        "csvOnly": {"outputMD": False, "outputCSV": True, "combinedMD": "", "combinedCSV": "", "books": []},
+        "both":    {"outputMD": True, "outputCSV": True, "combinedMD": "", "combinedCSV": "", "books": []},
+        "mdOnly":  {"outputMD": True, "outputCSV": False, "combinedMD": "", "combinedCSV": "", "books": []},
+        "skip":    {"outputMD": False, "outputCSV": False, "combinedMD": "", "combinedCSV": "", "books": []}
+    }
+
 def answerMenu(prompt, numOptions):
     """
     returns the response to a prompt that expects the user to choose a number
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# searches the highlights and notes of a collection created by clippy.py (using a search index stored next to it)
+
+import os
+import sys
+import argparse
+
+import ClippyKindle
+from ClippyKindle.Search import SearchIndex, getIndexPath
+from ClippyKindle.SqliteStore import SqliteStore
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Searches the highlights and notes of a collection created by clippy.py.  Terms may be words, quoted phrases (e.g. \'"electric sheep"\') or prefixes (e.g. \'tyran*\'), and results must match every term.')
+    parser.add_argument('collection', type=str, help='(string) path to json file (or sqlite store) created by clippy.py (e.g. "./collection.json")')
+    parser.add_argument('query', type=str, help='(string) query to search for (e.g. \'android "electric sheep"\')')
+    parser.add_argument('--limit', type=int, default=50, help='(int) max number of results to show (default: 50)')
+    parser.add_argument('--rebuild', action="store_true", help="Rebuild the search index from scratch.")
+
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+
+    indexPath = getIndexPath(args.collection)
+    if args.rebuild and os.path.exists(indexPath):
+        os.remove(indexPath)
+    # (re)index collection only if it changed since the index was last updated
+    needsUpdate = not os.path.exists(indexPath) or os.path.getmtime(indexPath) < os.path.getmtime(args.collection)
+    index = SearchIndex(indexPath)
+    if needsUpdate:
+        if SqliteStore.isStorePath(args.collection):
+            store = SqliteStore(args.collection)
+            bookList = store.loadBooks()
+            store.close()
+        else:
+            bookList = ClippyKindle.ClippyKindle.parseJsonFile(args.collection)
+        numAdded, numRemoved = index.update(bookList, prune=True)
+        print("Updated search index '{}' ({} item(s) added, {} removed)\n".format(indexPath, numAdded, numRemoved))
+
+    results = index.search(args.query, limit=args.limit)
+    index.close()
+    for res in results:
+        locType = "loc" if res["locType"] == "location" else res["locType"]
+        print("{} -- [{} {}] ({})".format(res["book"], locType, res["loc"], res["type"]))
+        print("  {}\n".format(res["content"].replace("\n", "\n  ")))
+    print("{} result(s) found".format(len(results)))
+
+if __name__ == "__main__":
+    main()
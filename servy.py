@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# serves the books of a collection created by clippy.py over HTTP (as json or markdown), e.g. for other local tools
+
+import sys
+import argparse
+
+from ClippyKindle.Server import CollectionService, makeServer
+import marky
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Loads a collection created by clippy.py once and serves it over HTTP, so other tools can query it without re-parsing it. Endpoints: /books (list of books), /books/<book> (items of a book), /books/<book>/markdown, and /items (items of every book), where <book> is the index of a book in /books or its url encoded name. All but /books accept ?after=<date>&before=<date> (ISO 8601 e.g. "2021-03-05") to only return items added within a date window. Responses are cached (with ETags) until the collection file changes.')
+    parser.add_argument('collection', type=str, help='(string) path to json file (or sqlite store) created by clippy.py (e.g. "./collection.json")')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help="(string) address to listen on (default: '127.0.0.1')")
+    parser.add_argument('--port', type=int, default=8080, help='(int) port to listen on (default: 8080)')
+    parser.add_argument('--quiet', action="store_true", help="Don't log each request.")
+
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+
+    service = CollectionService(args.collection, renderMarkdown=marky.jsonToMarkdown)
+    if service.loadError != None:
+        print("WARNING: unable to load '{}' ({}), requests are answered with 503 until it can be loaded".format(
+            args.collection, service.loadError), file=sys.stderr)
+    server = makeServer(service, args.host, args.port, verbose=(not args.quiet))
+    print("Serving {} book(s) from '{}' at http://{}:{}/books (press Ctrl+C to stop)...".format(
+        len(service.books), args.collection, args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped serving")
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import sys
+from datetime import datetime
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import DataStructures
+from ClippyKindle.DedupCache import DedupCache
+from ClippyKindle.Audit import DedupAudit, sampleAudit
+from ClippyKindle.Fingerprints import findSimilarBooks, mergeBooks
+
+def makeBook():
+    """
+    returns a Book containing a few (fuzzy) duplicate highlights and notes
+    """
+    book = DataStructures.Book("Test Book", "Someone")
+    text = "the quick brown fox jumps over the lazy dog and then runs away into the forest"
+    for i, content in enumerate([text, text[:40], text + " again", "something else entirely", "short", "short one"]):
+        book.highlights.append(DataStructures.Highlight((100 + i, 101 + i), "location", datetime(2020, 1, 1 + i), content))
+    for i, content in enumerate([text, text + " more", "a note", "another note", "x"]):
+        book.notes.append(DataStructures.Note(200, "location", datetime(2020, 2, 1 + i), content))
+    return book
+
+def test_dedup_cache():
+    """
+    test that cached dedup decisions match uncached ones and are reused across runs
+    """
+    expected = makeBook()
+    expected.sort(removeDups=True)
+
+    cachePath = os.path.join(TMP_PATH, "dedup-cache.sqlite")
+    for run in range(2):
+        cache = DedupCache(cachePath)
+        book = makeBook()
+        book.sort(removeDups=True, dedupCache=cache)
+        cache.close()
+        assert(book.toDict() == expected.toDict())
+        if run == 0:
+            assert(cache.hits == 0 and cache.misses > 0)
+        else:
+            assert(cache.misses == 0 and cache.hits > 0)
+
+    # cache is capped and invalidated when thresholds change
+    cache = DedupCache(cachePath, maxEntries=1)
+    cache.flush()
+    assert(cache.conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0] == 1)
+    cache.close()
+    oldOverlap = DataStructures.DUP_MIN_OVERLAP
+    DataStructures.DUP_MIN_OVERLAP = 0.9
+    try:
+        cache = DedupCache(cachePath)
+        assert(cache.conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0] == 0)
+        cache.close()
+    finally:
+        DataStructures.DUP_MIN_OVERLAP = oldOverlap
+
+def test_dedup_cache_fuzzy_only():
+    """
+    test that only decisions needing a fuzzy match are cached (so the cache isn't consulted for pairs ruled out cheaply)
+    """
+    from datetime import timedelta
+    text = "the quick brown fox jumps over the lazy dog and then runs away into the forest"
+    def makeLargeBook():
+        book = DataStructures.Book("Large Book", "Someone")
+        for i in range(5000):
+            # (highlights too far apart to be duplicates, plus pairs of nearby highlights that need fuzzy matching)
+            loc = (i - (i % 50 == 1)) * 100 + (i % 50 == 1)
+            content = "{} {}".format(i, text) if i % 50 < 2 else "highlight number {} of many".format(i)
+            book.highlights.append(DataStructures.Highlight((loc, loc + 1), "location", datetime(2020, 1, 1) + timedelta(minutes=i), content))
+        return book
+
+    cachePath = os.path.join(TMP_PATH, "dedup-cache-fuzzy.sqlite")
+    cache = DedupCache(cachePath)
+    makeLargeBook().sort(removeDups=True, dedupCache=cache)
+    cache.flush()
+    assert(cache.misses == 100) # (only the nearby pairs)
+    assert(cache.conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0] == 100)
+    cache.close()
+
+    # (a warm cache answers every fuzzy comparison)
+    cache = DedupCache(cachePath)
+    makeLargeBook().sort(removeDups=True, dedupCache=cache)
+    cache.close()
+    assert(cache.misses == 0 and cache.hits == 100)
+
+def test_dedup_audit():
+    """
+    test that each removed duplicate is recorded in the audit file and can be sampled back
+    """
+    auditPath = os.path.join(TMP_PATH, "dedup-audit.jsonl")
+    audit = DedupAudit(auditPath)
+    book = makeBook()
+    numBefore = len(book.highlights) + len(book.notes)
+    book.sort(removeDups=True, audit=audit)
+    audit.close()
+    numRemoved = numBefore - len(book.highlights) - len(book.notes)
+    assert(audit.numRecords == numRemoved > 0)
+
+    records = sampleAudit(auditPath, 100)
+    assert(len(records) == numRemoved)
+    for record in records:
+        assert(record["book"] == book.getName())
+        assert(record["reason"] in ("substring", "overlap"))
+        assert(record["kept"]["loc"] >= record["removed"]["loc"])
+    assert(len(sampleAudit(auditPath, 1, seed=3)) == 1)
+
+def test_similar_books():
+    """
+    test that books sharing most of their highlights are found (and merged without duplicating items)
+    """
+    original = makeBook()
+    reimport = DataStructures.Book("Test Book (2nd edition)", "Someone")
+    for obj in original.highlights[:4]: # (same content at different locations)
+        reimport.highlights.append(DataStructures.Highlight((obj.loc + 1000, obj.locEnd + 1000), "location", obj.date, obj.content.upper() + "!"))
+    reimport.highlights.append(DataStructures.Highlight((2000, 2001), "location", datetime(2021, 1, 1), "brand new highlight"))
+    other = DataStructures.Book("Unrelated", "")
+    other.highlights.append(DataStructures.Highlight((5, 6), "location", datetime(2021, 1, 1), original.highlights[0].content))
+
+    pairs = findSimilarBooks([other, original, reimport])
+    assert(len(pairs) == 1)
+    assert(pairs[0][:3] == (1, 2, 4))
+    for day in [1, 2]: # (bookmarks at the same location are only added once)
+        reimport.bookmarks.append(DataStructures.Bookmark(3000, "location", datetime(2021, 2, day)))
+    numBefore = len(original.highlights)
+    assert(mergeBooks(original, reimport) == 2)
+    assert(len(original.highlights) == numBefore + 1 and len(original.bookmarks) == 1)
+
+def test_similarity_cascade():
+    """
+    test that the checks ruling out fuzzy matches early never change the outcome of comparing content
+    """
+    import random
+    def naiveGCS(string1, string2):
+        answer = ""
+        for i in range(len(string1)):
+            for j in range(len(string2)):
+                k = 0
+                while i+k < len(string1) and j+k < len(string2) and string1[i+k] == string2[j+k]:
+                    k += 1
+                if k > len(answer):
+                    answer = string1[i:i+k]
+        return answer
+
+    rand = random.Random(0)
+    words = "the quick brown fox jumps over a lazy dog and then runs away into forest".split()
+    for _ in range(300):
+        content = " ".join(rand.choice(words) for _ in range(rand.randint(4, 20)))
+        other = " ".join(rand.choice(words) for _ in range(rand.randint(1, 20)))
+        if rand.random() < 0.5:
+            other = content[rand.randint(0, len(content) // 2):] + " " + other
+        assert(DataStructures.GCS(content, other) == naiveGCS(content, other))
+        isDup, reason, similarity = DataStructures.compareContent(content, other, 3)
+        sub = naiveGCS(content, other).strip()
+        expected = content in other or other in content or (content.count(" ") >= 3 and len(sub) / len(content) >= DataStructures.DUP_MIN_OVERLAP)
+        assert(isDup == expected)
+        if reason == "overlap":
+            assert(similarity == len(sub) / len(content))
@@ -0,0 +1,58 @@
+import os
+import sys
+import io
+import copy
+import json
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle.Diff import diffCollections, iterJsonArray
+
+def _loadExpected():
+    with open(os.path.join(FOLDER_PATH, "examples/expected_output/dans--My.Clippings.json")) as f:
+        return json.load(f)
+
+def test_iter_json_array():
+    """
+    test that streaming a json array yields the same elements as loading it, whatever the chunk size
+    """
+    data = _loadExpected()
+    text = json.dumps(data, indent=2)
+    for chunkSize in [1, 7, 100, len(text) * 2]:
+        assert(list(iterJsonArray(io.StringIO(text), chunkSize)) == data)
+    assert(list(iterJsonArray(io.StringIO("[]"))) == [])
+
+def test_diff_collections():
+    """
+    test that books/items added, removed and changed between two collections are found
+    """
+    old = _loadExpected()
+    new = copy.deepcopy(old)
+    removedBook = new.pop(0)
+    new[0]["items"][0]["content"] += " (edited)"   # changed
+    longItem = dict(new[1]["items"][0], content="a long highlight " * 10)
+    old[2]["items"].append(dict(longItem, content=longItem["content"] + "(old)"))
+    new[1]["items"].append(longItem)               # changed (with content longer than PREVIEW_LENGTH)
+    new[1]["items"].append(dict(new[1]["items"][0], dateStr="January 01, 2021 00:00:00")) # added
+    removedItem = new[2]["items"].pop()             # removed
+    new.append({"title": "New Book", "author": "", "dateStart": None, "dateEnd": "January 01, 1970 00:00:00", "items": []})
+    oldPath, newPath = os.path.join(TMP_PATH, "diff-old.json"), os.path.join(TMP_PATH, "diff-new.json")
+    for path, data in [(oldPath, old), (newPath, new)]:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    assert(diffCollections(oldPath, oldPath).isEmpty())
+    diff = diffCollections(oldPath, newPath)
+    counts = diff.getCounts()
+    assert(counts == {"added": 1, "removed": 1, "changed": 3, "unchanged": len(old) - 4,
+        "itemsAdded": 1, "itemsRemoved": len(removedBook["items"]) + 1, "itemsChanged": 2})
+    books = {bookDiff.name: bookDiff for bookDiff in diff.books}
+    assert(books["New Book"].status == "added")
+    changed = [bookDiff for bookDiff in diff.books if bookDiff.status == "changed"]
+    assert(changed[0].changed[0][1]["content"].endswith(" (edited)"))
+    assert(changed[1].added[0]["dateStr"] == "January 01, 2021 00:00:00")
+    assert(changed[1].changed == [(old[2]["items"][-1], longItem)]) # (old items are reported in full)
+    assert(changed[2].removed[0]["loc"] == removedItem["loc"])
@@ -0,0 +1,57 @@
+import os
+import sys
+import csv
+import json
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle, DataStructures, Exporters
+import marky
+
+def test_exporter():
+    """
+    test outputting books in every format (for each book and combined)
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    outFolder = os.path.join(TMP_PATH, "export")
+    os.mkdir(outFolder)
+    formats, combined = Exporters.getGroupFormats({"outputMD": True, "outputCSV": False, "combinedMD": "",
+        "combinedCSV": "all.csv", "formats": ["csv", "jsonl", "anki"], "combined": {"anki": "all.anki.tsv"}, "books": []})
+    assert(formats == ["csv", "jsonl", "anki", "md"] and combined == {"anki": "all.anki.tsv", "csv": "all.csv"})
+
+    writers = Exporters.getWriters(renderMarkdown=marky.jsonToMarkdown)
+    exporter = Exporters.Exporter(outFolder, writers, formats, combined)
+    for book in bookList:
+        paths = exporter.exportBook(book)
+        assert(len(paths) == len(formats) + (len(combined) if book is bookList[0] else 0))
+    exporter.close()
+
+    allRows, numHighlights = [], 0
+    for book in bookList:
+        outPath = os.path.join(outFolder, book.getName().replace("/", "|"))
+        with open(outPath + ".md") as f:
+            assert(f.read() == marky.jsonToMarkdown(book.toDict()))
+        with open(outPath + ".csv") as f:
+            rows = list(csv.reader(f))
+            assert(rows == [[str(val) for val in row] for row in book.toCSV()])
+            allRows += rows[1:]
+            rowIter = book.iterCSV() # (rows are generated as they're consumed)
+            assert(iter(rowIter) is rowIter and list(rowIter) == book.toCSV()[1:])
+        with open(outPath + ".jsonl") as f:
+            items = [json.loads(line) for line in f]
+            assert([dict(item, book=book.getName()) for item in book.toDict()["items"]] == items)
+        with open(outPath + ".anki.tsv") as f:
+            lines = f.read().split("\n")
+            assert(lines[0] == "#separator:tab" and lines[-1] == "")
+            assert(len(lines) == 3 + len(book.highlights) + 1 and all(line.count("\t") == 1 for line in lines[3:-1]))
+        numHighlights += len(book.highlights)
+
+    # combined files have a single header
+    with open(os.path.join(outFolder, "all.csv")) as f:
+        rows = list(csv.reader(f))
+        assert(rows[0] == list(DataStructures.CSV_HEADER) and rows[1:] == allRows)
+    with open(os.path.join(outFolder, "all.anki.tsv")) as f:
+        assert(len(f.read().split("\n")) == 3 + numHighlights + 1)
@@ -10,6 +10,7 @@ import os
 import shutil
 import sys
 import json
+import mmap
 
 # enable imports from parent folder of this script:
 FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
@@ -29,3 +30,238 @@ def test_issue1_format():
     test successful parsing of file format in https://github.com/dangbert/clippy-kindle/issues/1
     """
     helperCompare('issue1--My.Clippings')
+
+def test_error_policies():
+    """
+    test that sections failing to parse are skipped/collected/raised without prompting (for non-interactive use)
+    """
+    from tests.conftest import TMP_PATH
+    from ClippyKindle import ParseError
+    badFile = os.path.join(TMP_PATH, "bad--My.Clippings.txt")
+    with open(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")) as f:
+        data = f.read()
+    with open(badFile, 'w') as f:
+        f.write("Broken Book\n- Your Scribble on Location 1 | Added on Friday, November 25, 2016 12:13:59 AM\n\nhi\n==========\n" + data)
+
+    expected = len(ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")))
+    errors = []
+    bookList = ClippyKindle.parseClippings(badFile, verbose=0, errorPolicy="collect", errors=errors)
+    assert(len(bookList) == expected + 1) # (book is still created before failing)
+    assert(len(errors) == 1)
+    assert(errors[0]["lineStart"] == 1 and errors[0]["lineEnd"] == 5)
+    assert(errors[0]["error"] == "ERROR: not sure how to parse section")
+
+    assert(len(ClippyKindle.parseClippings(badFile, verbose=0, errorPolicy="skip")) == expected + 1)
+    with pytest.raises(ParseError):
+        ClippyKindle.parseClippings(badFile, verbose=0, errorPolicy="fail")
+
+def test_section_filter():
+    """
+    test that filtering sections at parse time matches filtering the fully parsed books (and keeps error line numbers)
+    """
+    from datetime import datetime
+    from tests.conftest import TMP_PATH
+    from ClippyKindle import SectionFilter
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    since, until = datetime(2017, 1, 1), datetime(2020, 6, 1)
+    expected = []
+    for book in ClippyKindle.parseClippings(inputFile, verbose=0):
+        book.highlights, book.notes, book.bookmarks = ([obj for obj in objList if since <= obj.date < until]
+                for objList in [book.highlights, book.notes, book.bookmarks])
+        if len(book.highlights) + len(book.notes) + len(book.bookmarks) != 0:
+            expected.append(book.toDict())
+    bookList = ClippyKindle.parseClippings(inputFile, verbose=0, sectionFilter=SectionFilter(since=since, until=until))
+    assert(len(expected) > 0 and [book.toDict() for book in bookList] == expected)
+
+    bookList = ClippyKindle.parseClippings(inputFile, verbose=0, sectionFilter=SectionFilter(books=["HAMBRE", "Bradbury"]))
+    assert(sorted(book.getName() for book in bookList) == ["Fahrenheit 451: A Novel by Bradbury, Ray", "Los juegos del hambre by Suzanne Collins"])
+
+    # sections that fail to parse are reported at the same lines after skipped sections
+    badFile = os.path.join(TMP_PATH, "filtered--My.Clippings.txt")
+    with open(inputFile) as f:
+        data = f.read()
+    with open(badFile, 'w') as f:
+        f.write(data + "Broken Book\n- Your Scribble on Location 1 | Added on Friday, November 25, 2016 12:13:59 AM\n\nhi\n==========\n")
+    errors, filteredErrors = [], []
+    ClippyKindle.parseClippings(badFile, verbose=0, errorPolicy="collect", errors=errors)
+    ClippyKindle.parseClippings(badFile, verbose=0, errorPolicy="collect", errors=filteredErrors, sectionFilter=SectionFilter(books=["broken"]))
+    assert(len(errors) == 1 and filteredErrors == errors)
+
+def test_section_scanner():
+    """
+    test that the byte level scanner splits sections (regardless of line endings) and strips weird characters
+    """
+    from tests.conftest import TMP_PATH
+    from ClippyKindle.Scanner import SectionScanner
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    crlfFile = os.path.join(TMP_PATH, "crlf--My.Clippings.txt")
+    with open(inputFile, 'rb') as f:
+        data = f.read()
+    with open(crlfFile, 'wb') as f:
+        f.write(data.replace(b"\n", b"\r\n"))
+
+    scanner = SectionScanner(inputFile)
+    counts = scanner.countItemsPerBook()
+    assert(sum(counts.values()) == 13)
+    assert(counts["Do Androids Dream of Electric Sheep? (Dick, Philip K.)"] == 3) # (one title has a BOM)
+    assert(all("\ufeff" not in title for title in counts))
+    sections = [scanner.getLines(start, end) for start, end, _ in scanner.iterSections()]
+    scanner.close()
+
+    scanner = SectionScanner(crlfFile)
+    assert([scanner.getLines(start, end) for start, end, _ in scanner.iterSections()] == sections)
+    scanner.close()
+    assert([b.toDict() for b in ClippyKindle.parseClippings(crlfFile)] == [b.toDict() for b in ClippyKindle.parseClippings(inputFile)])
+
+def test_book_registry():
+    """
+    test that the book registry splits titles and gives each distinct title line a stable id
+    """
+    from ClippyKindle.DataStructures import BookRegistry
+    assert(BookRegistry.splitTitle("Fahrenheit 451: A Novel (Bradbury, Ray)") == ("Fahrenheit 451: A Novel", "Bradbury, Ray"))
+    assert(BookRegistry.splitTitle("The Iliad (Penguin Classics) (Homer)") == ("The Iliad (Penguin Classics)", "Homer"))
+    assert(BookRegistry.splitTitle("The 4 Hour Workweek") == ("The 4 Hour Workweek", ""))
+    registry = BookRegistry()
+    ids = [registry.getId(line) for line in ["A (x)", "B", "A (x)", "C (y)", "B"]]
+    assert(ids == [0, 1, 0, 2, 1])
+    assert([book.getName() for book in registry] == ["A by x", "B", "C by y"])
+    assert(registry.get(2).id == 2)
+
+def test_sorted_books():
+    """
+    test that already sorted books aren't re-sorted, and items added to sorted books stay in order
+    """
+    import random
+    from ClippyKindle import DataStructures
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"), verbose=0)
+    assert(not any(book.sorted for book in bookList))
+    for book in bookList:
+        book.sort(removeDups=False)
+        d = book.toDict()
+        assert(book.sorted and DataStructures.Book.fromDict(d).sorted)
+        assert(DataStructures.Book.fromDict(d).toDict() == d)
+
+        # (validated) unsorted dicts are still sorted
+        shuffled = dict(d, items=random.Random(0).sample(d["items"], len(d["items"])))
+        assert(DataStructures.Book.fromDict(shuffled).toDict() == d)
+
+        # adding items one at a time to a sorted book gives the same order as sorting them all
+        incremental = DataStructures.Book(book.title, book.author)
+        incremental.sort(removeDups=False)
+        for obj in random.Random(1).sample(book.highlights + book.notes + book.bookmarks, len(d["items"])):
+            incremental.addItem(obj)
+        assert(incremental.sorted and incremental.toDict() == d)
+
+def test_parse_multiple_files():
+    """
+    test that multiple clippings files are parsed concurrently and merged by book name
+    """
+    files = [os.path.join(FOLDER_PATH, "examples/{}.txt".format(stub)) for stub in ["dans--My.Clippings", "issue1--My.Clippings"]]
+    expected = {}
+    for fname in files + files[:1]:
+        for book in ClippyKindle.parseClippings(fname, verbose=0):
+            expected[book.getName()] = expected.get(book.getName(), 0) + len(book.highlights) + len(book.notes) + len(book.bookmarks)
+
+    errors = []
+    bookList = ClippyKindle.parseClippingsFiles(files + files[:1], maxWorkers=2, verbose=0, errors=errors)
+    assert(errors == [])
+    assert({book.getName(): len(book.highlights) + len(book.notes) + len(book.bookmarks) for book in bookList} == expected)
+
+def test_out_of_core(monkeypatch):
+    """
+    test that a collection spilled to disk (see OutOfCore.SpillCollection) is written identically to one parsed in memory,
+    both when books fit within the memory budget and when they must be streamed from their run files
+    """
+    from ClippyKindle import OutOfCore
+    from tests.conftest import TMP_PATH
+    monkeypatch.setattr(OutOfCore, "MAX_OPEN_RUNS", 3) # (so runs are also merged while spilling)
+    files = [os.path.join(FOLDER_PATH, "examples/{}.txt".format(stub)) for stub in ["dans--My.Clippings", "issue1--My.Clippings"]] * 2
+    bookList = ClippyKindle.parseClippingsFiles(files, maxWorkers=1, verbose=0)
+    for book in bookList:
+        book.sort(removeDups=True)
+    expected = json.dumps([book.toDict() for book in bookList], indent=2)
+
+    for memoryBudget in [1, 2000, 10**9]:
+        spill = OutOfCore.SpillCollection(memoryBudget, tmpFolder=TMP_PATH)
+        for fname in files:
+            assert(all(len(book.highlights) + len(book.notes) + len(book.bookmarks) == 0
+                for book in ClippyKindle.parseClippings(fname, verbose=0, spill=spill)))
+        path = os.path.join(TMP_PATH, "spilled.json")
+        summaries = spill.writeJson(path)
+        spill.close()
+        assert(not os.path.exists(spill.folder))
+        with open(path) as f:
+            assert(f.read() == expected)
+        assert([s.toDict() for s in summaries] == [book.getSummary().toDict() for book in bookList])
+
+def test_compressed_files():
+    """
+    test that compressed clippings/collection files are detected (by content) and read like uncompressed ones
+    """
+    from ClippyKindle import Compression, OutOfCore
+    from tests.conftest import TMP_PATH
+    from ClippyKindle.Scanner import SectionScanner
+    fname = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    bookList = ClippyKindle.parseClippings(fname, verbose=0)
+    expected = [book.toDict() for book in bookList]
+    for book in bookList:
+        book.sort(removeDups=True)
+    expectedSorted = json.dumps([book.toDict() for book in bookList], indent=2)
+    with open(fname, 'rb') as f:
+        raw = f.read()
+    for compression in Compression.COMPRESSIONS:
+        path = os.path.join(TMP_PATH, "clippings-" + compression) # (no extension, so detected by content)
+        with Compression.openFile(path, 'wb', compression) as f:
+            f.write(raw)
+        assert(Compression.detectCompression(path) == compression)
+        assert([book.toDict() for book in ClippyKindle.parseClippings(path, verbose=0)] == expected)
+
+        # within a memory budget, the file is decompressed to (and memory mapped from) the spill folder instead
+        scanner = SectionScanner(path, tmpFolder=TMP_PATH)
+        assert(isinstance(scanner.data, mmap.mmap) and scanner.data[:] == raw)
+        tmpPath = scanner.tmpPath
+        scanner.close()
+        assert(not os.path.exists(tmpPath))
+        spill = OutOfCore.SpillCollection(1, tmpFolder=TMP_PATH)
+        list(ClippyKindle.parseClippings(path, verbose=0, spill=spill))
+        assert(not any(name.startswith("decompressed-") for name in os.listdir(spill.folder)))
+        spill.writeJson(os.path.join(TMP_PATH, "spilled.json"))
+        spill.close()
+        with open(os.path.join(TMP_PATH, "spilled.json")) as f:
+            assert(f.read() == expectedSorted)
+
+        path = os.path.join(TMP_PATH, "collection.json" + Compression.COMPRESSIONS[compression][1])
+        with Compression.openFile(path, 'w') as f:
+            json.dump(expected, f)
+        assert(Compression.detectCompression(path) == compression)
+        assert([book.toDict() for book in ClippyKindle.parseJsonFile(path)] == expected)
+    assert(Compression.detectCompression(fname) == None and Compression.readDecompressed(fname) == None)
+    assert(Compression.stripCompressionExt("collection.json.xz") == "collection.json")
+
+def test_incremental_parser():
+    """
+    test that appended sections are parsed incrementally (and a replaced file is parsed from scratch)
+    """
+    from tests.conftest import TMP_PATH
+    from ClippyKindle.Watcher import IncrementalParser
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    watchedFile = os.path.join(TMP_PATH, "watched--My.Clippings.txt")
+    with open(inputFile, 'rb') as f:
+        data = f.read()
+    splitAt = data.index(b"SPQR") # (start of a section)
+    with open(watchedFile, 'wb') as f:
+        f.write(data[:splitAt] + b"partial section")
+
+    clippings = IncrementalParser(watchedFile)
+    assert(len(clippings.update()) == 6)
+    assert(clippings.update() == [])
+    with open(watchedFile, 'wb') as f:
+        f.write(data)
+    assert([book.getName() for book in clippings.update()] == ["SPQR: A History of Ancient Rome by Beard, Mary", "Siddhartha (Modern Library Classics) by Hesse, Hermann"])
+    expected = [book.toDict() for book in ClippyKindle.parseClippings(inputFile)]
+    assert([book.toDict() for book in clippings.registry] == expected)
+
+    with open(watchedFile, 'wb') as f:
+        f.write(data.replace(b"SPQR", b"SPQ"))
+    assert(len(clippings.update()) == len(expected))
+    assert(clippings.errors == [])
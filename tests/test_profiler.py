@@ -0,0 +1,100 @@
+import os
+import sys
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle
+from ClippyKindle.Profiler import PROFILER
+
+def test_profile_stages():
+    """
+    test that parsing/sorting records per-stage timings when profiling is enabled (and nothing otherwise)
+    """
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    PROFILER.reset()
+    ClippyKindle.parseClippings(inputFile)
+    assert(PROFILER.stages == {})
+
+    PROFILER.enabled = True
+    try:
+        bookList = ClippyKindle.parseClippings(inputFile)
+        for book in bookList:
+            book.sort(removeDups=True)
+    finally:
+        PROFILER.enabled = False
+    assert(PROFILER.stages["read"]["items"] == os.path.getsize(inputFile)) # (bytes read)
+    assert(PROFILER.stages["parse sections"]["items"] == 13)
+    assert(PROFILER.stages["sort"]["calls"] == len(bookList))
+    assert(len(PROFILER.books) == len(bookList))
+    assert("parse date" in PROFILER.report())
+    PROFILER.reset()
+
+def test_metrics_export():
+    """
+    test that clippy.py writes metrics of a run as json, and that metrics are also written in the prometheus text format
+    """
+    import json
+    import subprocess
+    from ClippyKindle.Metrics import Metrics
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    outFolder = os.path.join(TMP_PATH, "metrics")
+    os.makedirs(outFolder, exist_ok=True)
+    metricsPath = os.path.join(outFolder, "metrics.json")
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(FOLDER_PATH), "clippy.py"), inputFile, "--batch",
+        "--out-folder", outFolder, "--metrics", metricsPath], check=True, stdout=subprocess.DEVNULL)
+    with open(metricsPath) as f:
+        data = json.load(f)
+    metrics = data["metrics"]
+    assert(data["tool"] == "clippy")
+    assert(metrics["bytes_read"] == os.path.getsize(inputFile))
+    assert(metrics["sections_parsed"] == 13 and metrics["parse_errors"] == 0)
+    assert(metrics["items"] == {"highlight": 6, "note": 4, "bookmark": 3})
+    assert(sum(metrics["dedup_removed"].values()) == 0)
+    assert(metrics["bytes_written"] > 0 and metrics["peak_rss_bytes"] > 0)
+    assert("parse sections" in metrics["stage_duration_seconds"])
+    assert(metrics["run_success"] == 1)
+
+    # metrics are still written (with what was recorded so far) when the run is aborted
+    with open(inputFile, 'rb') as f:
+        raw = f.read()
+    badFile = os.path.join(outFolder, "bad--My.Clippings.txt")
+    with open(badFile, 'wb') as f:
+        f.write(raw + b"not a valid section\r\n==========\r\n")
+    res = subprocess.run([sys.executable, os.path.join(os.path.dirname(FOLDER_PATH), "clippy.py"), badFile, "--batch", "--on-error", "fail",
+        "--out-folder", outFolder, "--metrics", metricsPath], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert(res.returncode == 1)
+    with open(metricsPath) as f:
+        metrics = json.load(f)["metrics"]
+    assert(metrics["run_success"] == 0 and metrics["parse_errors"] == 1)
+    assert(metrics["bytes_read"] == len(raw) + 33 and metrics["bytes_written"] == 0)
+    assert("items" not in metrics and metrics["run_duration_seconds"] > 0)
+
+    # likewise for marky.py
+    markyPath = os.path.join(os.path.dirname(FOLDER_PATH), "marky.py")
+    subprocess.run([sys.executable, markyPath, os.path.join(outFolder, "collection.json"), os.path.join(outFolder, "md"), "--batch",
+        "--metrics", metricsPath], check=True, stdout=subprocess.DEVNULL)
+    with open(metricsPath) as f:
+        metrics = json.load(f)["metrics"]
+    assert(metrics["run_success"] == 1 and metrics["books"] == 8 and metrics["files_created"] > 0)
+    # (aborted as the folder provided isn't a sharded collection)
+    res = subprocess.run([sys.executable, markyPath, os.path.join(outFolder, "md"), os.path.join(outFolder, "md2"), "--batch",
+        "--metrics", metricsPath], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert(res.returncode == 1)
+    with open(metricsPath) as f:
+        metrics = json.load(f)["metrics"]
+    assert(metrics["run_success"] == 0 and "books" not in metrics and metrics["run_duration_seconds"] > 0)
+
+    metrics = Metrics("test")
+    metrics.set("parse_errors", 2, "number of errors")
+    metrics.set("dedup_removed", 3, "duplicates removed", "type", "highlight")
+    metrics.set("stage_calls", 1, "calls per stage", "stage", 'say "hi"')
+    metrics.write(os.path.join(outFolder, "metrics.prom"))
+    with open(os.path.join(outFolder, "metrics.prom")) as f:
+        lines = f.read().split("\n")
+    assert("# TYPE clippykindle_parse_errors gauge" in lines)
+    assert('clippykindle_parse_errors{tool="test"} 2' in lines)
+    assert('clippykindle_dedup_removed{tool="test",type="highlight"} 3' in lines)
+    assert('clippykindle_stage_calls{tool="test",stage="say \\"hi\\""} 1' in lines)
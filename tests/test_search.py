@@ -0,0 +1,33 @@
+import os
+import sys
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle
+from ClippyKindle.Search import SearchIndex
+
+def test_search_index():
+    """
+    test word, prefix and phrase queries, and incremental updates of the search index
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    numItems = sum(len(book.highlights) + len(book.notes) for book in bookList)
+    index = SearchIndex(os.path.join(TMP_PATH, "collection.search.sqlite"))
+    assert(index.update(bookList, prune=True) == (numItems, 0))
+    assert(index.update(bookList, prune=True) == (0, 0))
+
+    res = index.search('"electric animal"')
+    assert(len(res) == 1 and res[0]["loc"] == 607)
+    assert(index.search('"animal electric"') == [])
+    assert(len(index.search("tyran*")) == 1)
+    assert(len(index.search("TYRANNY andy")) == 1)
+    assert(index.search("tyranny nonexistentword") == [])
+
+    # removing a book removes its items from the index
+    book = [b for b in bookList if len(b.highlights) > 0 and b.highlights[0].loc == 607][0]
+    assert(index.update([b for b in bookList if b is not book], prune=True) == (0, len(book.highlights) + len(book.notes)))
+    assert(index.search('"electric animal"') == [])
+    index.close()
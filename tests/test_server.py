@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import threading
+import urllib.request
+from urllib.error import HTTPError
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle
+from ClippyKindle.Server import CollectionService, makeServer
+import marky
+
+def writeCollection(fname, bookList):
+    with open(fname, 'w') as f:
+        json.dump([book.toDict() for book in bookList], f, indent=2)
+
+def test_collection_service():
+    """
+    test queries, ETags and reloading of a CollectionService
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    for book in bookList:
+        book.sort(removeDups=True)
+    fname = os.path.join(TMP_PATH, "served_collection.json")
+    writeCollection(fname, bookList)
+    service = CollectionService(fname, renderMarkdown=marky.jsonToMarkdown)
+
+    status, contentType, etag, body = service.handle("/books")
+    books = json.loads(body)
+    assert(status == 200 and contentType == "application/json" and len(books) == len(bookList))
+    assert(books[0]["name"] == bookList[0].getName())
+
+    # books can be fetched by index or url encoded name
+    res = service.handle("/books/0")
+    assert(json.loads(res[3]) == bookList[0].toDict())
+    assert(service.handle("/books/" + urllib.request.quote(bookList[0].getName(), safe=""))[3] == res[3])
+    assert(service.handle("/books/9999")[0] == 404)
+    assert(service.handle("/nonexistent")[0] == 404)
+    assert(service.handle("/items?after=not-a-date")[0] == 400)
+
+    # cached responses are revalidated using their ETag
+    assert(service.handle("/books/0", ifNoneMatch=res[2]) == (304, res[1], res[2], b""))
+    assert(service.handle("/books/1", ifNoneMatch=res[2])[0] == 200)
+
+    # date windows
+    book = max(bookList, key=lambda b: len(b.highlights))
+    start, end = book.getDateRange()
+    window = json.loads(service.handle("/books/{}?after={}".format(bookList.index(book), start.isoformat()))[3])
+    assert(0 < len(window["items"]) < len(book.toDict()["items"]))
+    allItems = json.loads(service.handle("/items?before=1970-01-02")[3])
+    assert(allItems == [])
+    assert(len(json.loads(service.handle("/items")[3])) == len([b for b in bookList if len(b.toDict()["items"]) > 0]))
+
+    md = service.handle("/books/0/markdown")
+    assert(md[1].startswith("text/markdown") and md[3].decode("utf-8") == marky.jsonToMarkdown(bookList[0].toDict()))
+
+    # responses are invalidated when the collection changes
+    assert(service.numLoads == 1)
+    writeCollection(fname, bookList[1:])
+    books = json.loads(service.handle("/books")[3])
+    assert(service.numLoads == 2 and len(books) == len(bookList) - 1)
+    assert(service.handle("/books/0", ifNoneMatch=res[2])[0] == 200)
+
+def test_http_server():
+    """
+    test serving a collection over http
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    fname = os.path.join(TMP_PATH, "served_collection.json")
+    writeCollection(fname, bookList)
+    server = makeServer(CollectionService(fname), port=0, verbose=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:{}/books".format(server.server_address[1])
+        with urllib.request.urlopen(url) as res:
+            etag = res.headers["ETag"]
+            assert(len(json.loads(res.read())) == len(bookList))
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, headers={"If-None-Match": etag}))
+            assert(False)
+        except HTTPError as e:
+            assert(e.code == 304)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_collection_load_errors():
+    """
+    test that a collection that can't be (re)loaded (e.g. while it's being rewritten) doesn't break the service
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    fname = os.path.join(TMP_PATH, "truncated_collection.json")
+    writeCollection(fname, bookList)
+    with open(fname) as f:
+        text = f.read()
+    def writeTruncated():
+        with open(fname, 'w') as f:
+            f.write(text[:len(text) // 2])
+
+    # last loaded books are served while the file is truncated (and reloaded once it's complete again)
+    service = CollectionService(fname)
+    writeTruncated()
+    status, _, _, body = service.handle("/books")
+    assert(status == 200 and len(json.loads(body)) == len(bookList) and service.loadError != None)
+    writeCollection(fname, bookList[1:])
+    assert(len(json.loads(service.handle("/books")[3])) == len(bookList) - 1)
+    assert(service.loadError == None and service.numLoads == 2)
+
+    # nothing can be served until the collection is loaded
+    writeTruncated()
+    service = CollectionService(fname)
+    assert(service.handle("/books")[0] == 503)
+    writeCollection(fname, bookList)
+    assert(service.handle("/books")[0] == 200)
+
+    # unexpected errors are answered with 500 (rather than dropping the connection)
+    def fail(path, ifNoneMatch=None):
+        raise RuntimeError("unexpected")
+    service.handle = fail
+    server = makeServer(service, port=0, verbose=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        urllib.request.urlopen("http://127.0.0.1:{}/books".format(server.server_address[1]))
+        assert(False)
+    except HTTPError as e:
+        assert(e.code == 500)
+    finally:
+        server.shutdown()
+        server.server_close()
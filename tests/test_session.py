@@ -0,0 +1,43 @@
+import os
+import sys
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle
+from ClippyKindle.Session import Session
+
+def test_session():
+    """
+    test that a Session parses identically to ClippyKindle.parseClippings() (memoizing what it parses),
+    returns errors rather than printing/prompting, and can be shared between threads
+    """
+    fname = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    bookList = ClippyKindle.parseClippings(fname, verbose=0)
+    for book in bookList:
+        book.sort(removeDups=True)
+    expected = [book.toDict() for book in bookList]
+
+    session = Session()
+    res = session.parseFile(fname)
+    assert(res.ok and [book.toDict() for book in res.books] == expected)
+    stats = session.getStats()
+    assert(stats["headers"]["misses"] > 0 and stats["dates"]["misses"] > 0)
+    res = session.parseFile(fname)
+    assert(res.ok and [book.toDict() for book in res.books] == expected)
+    assert(session.getStats()["headers"]["misses"] == stats["headers"]["misses"]) # (every header was memoized)
+
+    # errors are returned (without prompting, even though a section is broken)
+    brokenPath = os.path.join(TMP_PATH, "broken-session.txt")
+    with open(fname) as f, open(brokenPath, 'w') as out:
+        out.write(f.read().replace("Added on", "Added at", 1))
+    res = session.parseFile(brokenPath)
+    assert(not res.ok and len(res.errors) == 1 and res.errors[0]["file"] == brokenPath)
+
+    from concurrent.futures import ThreadPoolExecutor
+    session.clear()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for res in executor.map(session.parseFile, [fname] * 8):
+            assert(res.ok and [book.toDict() for book in res.books] == expected)
@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+ROOT_PATH = os.path.dirname(FOLDER_PATH)
+
+# modules that should only be imported when they're actually used
+LAZY_MODULES = ["parse", "dateutil", "prettytable", "sqlite3", "concurrent.futures", "copy", "hashlib"]
+
+def importTime(moduleName):
+    """
+    imports a module in a fresh python process with "-X importtime"
+    returns: (tuple) (int total microseconds spent importing the module, set of names of all modules imported)
+    """
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(moduleName)],
+            cwd=ROOT_PATH, capture_output=True, text=True, check=True)
+    total, imported = None, set()
+    # lines look like: "import time:       460 |       3459 |   json"
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imported.add(name.strip())
+        if name.strip() == moduleName:
+            total = int(cumulative)
+    return (total, imported)
+
+def test_startup_imports():
+    """
+    benchmark startup (import) time of clippy.py and marky.py, ensuring optional dependencies aren't imported
+    (run "pytest -s" to see timings)
+    """
+    for moduleName in ["clippy", "marky"]:
+        total, imported = importTime(moduleName)
+        print("importing {} took {:.1f} ms ({} modules)".format(moduleName, total / 1000, len(imported)))
+        for lazyName in LAZY_MODULES:
+            assert(lazyName not in imported), "{} imports {} at startup".format(moduleName, lazyName)
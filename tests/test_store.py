@@ -0,0 +1,118 @@
+import os
+import sys
+from datetime import datetime
+
+# enable imports from parent folder of this script:
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__)) # folder containing this file
+sys.path.append(os.path.dirname(FOLDER_PATH))
+
+from tests.conftest import TMP_PATH
+from ClippyKindle import ClippyKindle
+from ClippyKindle.SqliteStore import SqliteStore
+
+def test_sqlite_store():
+    """
+    test that books stored in a SqliteStore load back identically (and can be loaded by date window)
+    """
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    for book in bookList:
+        book.sort(removeDups=True)
+    storePath = os.path.join(TMP_PATH, "collection.sqlite")
+    store = SqliteStore(storePath)
+    store.writeBooks(bookList)
+    store.writeBooks(bookList[:2]) # rewriting books replaces (rather than duplicates) their items
+    store.close()
+
+    store = SqliteStore(storePath)
+    assert(store.getBookNames() == [book.getName() for book in bookList])
+    assert([book.toDict() for book in store.loadBooks()] == [book.toDict() for book in bookList])
+    assert(store.loadBook("not a book") == None)
+
+    book = max(bookList, key=lambda b: len(b.highlights) + len(b.notes) + len(b.bookmarks))
+    cutDate = datetime(2020, 1, 1)
+    expected = store.loadBook(book.getName())
+    expected.cutBefore(cutDate)
+    assert(store.loadBook(book.getName(), after=cutDate).toDict() == expected.toDict())
+    store.close()
+
+def test_summary_index():
+    """
+    test that book summaries are loaded from the summary index while it's up to date (and recomputed otherwise)
+    """
+    import json
+    from ClippyKindle import Summary
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    for book in bookList:
+        book.sort(removeDups=True)
+    collectionPath = os.path.join(TMP_PATH, "summarized.json")
+    with open(collectionPath, 'w') as f:
+        json.dump([book.toDict() for book in bookList], f)
+    summaries = [book.getSummary() for book in bookList]
+    Summary.writeSummaries(collectionPath, summaries)
+
+    loaded = Summary.loadSummaries(collectionPath)
+    assert([s.toDict() for s in loaded] == [s.toDict() for s in summaries])
+    for summary, book in zip(loaded, bookList):
+        assert(summary.getName() == book.getName() and summary.getDateRange() == book.getDateRange())
+        assert(summary.numItems() == len(book.highlights) + len(book.notes) + len(book.bookmarks))
+
+    # the index is only used while the collection is unchanged
+    with open(Summary.getSummaryPath(collectionPath)) as f:
+        index = json.load(f)
+    index["books"][0]["highlights"] = 999
+    with open(Summary.getSummaryPath(collectionPath), 'w') as f:
+        json.dump(index, f)
+    assert(Summary.loadSummaries(collectionPath)[0].highlights == 999)
+    bookList[0].highlights = bookList[0].highlights[1:]
+    with open(collectionPath, 'w') as f:
+        json.dump([book.toDict() for book in bookList], f)
+    loaded = Summary.loadSummaries(collectionPath)
+    assert(loaded[0].toDict() == bookList[0].getSummary().toDict() and loaded[0].hash != summaries[0].hash)
+    assert([s.hash for s in loaded[1:]] == [s.hash for s in summaries[1:]])
+
+    # summaries of a SqliteStore (computed by the database) match, except for the content hash
+    store = SqliteStore(os.path.join(TMP_PATH, "summarized.sqlite"))
+    store.writeBooks(bookList)
+    store.close()
+    storeSummaries = Summary.loadSummaries(os.path.join(TMP_PATH, "summarized.sqlite"))
+    assert([dict(s.toDict(), hash=None) for s in storeSummaries] == [dict(s.toDict(), hash=None) for s in loaded])
+
+def test_sharded_collection():
+    """
+    test that a sharded collection loads back identically and only the shards of changed books are rewritten
+    """
+    from ClippyKindle import Shards
+    bookList = ClippyKindle.parseClippings(os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt"))
+    for book in bookList:
+        book.sort(removeDups=True)
+    folder = os.path.join(TMP_PATH, "sharded")
+    assert(Shards.writeShards(folder, bookList) == (len(bookList), 0, 0))
+    assert(Shards.isShardedPath(folder) and not Shards.isShardedPath(TMP_PATH))
+    assert([book.toDict() for book in ClippyKindle.parseJsonFile(folder)] == [book.toDict() for book in bookList])
+    assert([s.toDict() for s in Shards.loadSummaries(folder)] == [book.getSummary().toDict() for book in bookList])
+    names = set(book.getName() for book in bookList[1::2])
+    assert([book.getName() for book in Shards.loadShards(folder, names=names, maxWorkers=1)] == [book.getName() for book in bookList[1::2]])
+
+    # change one book and drop another
+    book = max(bookList[:-1], key=lambda b: len(b.highlights))
+    book.highlights.pop()
+    assert(Shards.writeShards(folder, bookList[:-1]) == (1, len(bookList) - 2, 1))
+    assert(not os.path.exists(os.path.join(folder, Shards.getShardName(bookList[-1].getName()))))
+    assert([b.toDict() for b in Shards.loadShards(folder)] == [b.toDict() for b in bookList[:-1]])
+
+    # a filtered run of clippy.py is rejected rather than removing (or truncating) the books it didn't parse
+    import subprocess
+    clippyPath = os.path.join(os.path.dirname(FOLDER_PATH), "clippy.py")
+    inputFile = os.path.join(FOLDER_PATH, "examples/dans--My.Clippings.txt")
+    outFolder = os.path.join(TMP_PATH, "clippy-shards")
+    os.makedirs(outFolder, exist_ok=True)
+    subprocess.run([sys.executable, clippyPath, inputFile, "--batch", "--store", "shards", "--out-folder", outFolder],
+        check=True, stdout=subprocess.DEVNULL)
+    folder = os.path.join(outFolder, "collection")
+    expected = Shards.readManifest(folder)
+    for filterArgs in [["--book", "Bradbury"], ["--since", "2020-01-01"]]:
+        res = subprocess.run([sys.executable, clippyPath, inputFile, "--batch", "--store", "shards", "--out-folder", outFolder] + filterArgs,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        assert(res.returncode == 1)
+        assert(Shards.readManifest(folder) == expected)
+        assert(all(os.path.isfile(os.path.join(folder, entry["file"])) for entry in expected))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# watches a "My Clippings.txt" file (e.g. on a kindle) and re-syncs the collection (and markdown/csv files) whenever it changes
+
+import os
+import sys
+import argparse
+import json
+from datetime import datetime
+
+from ClippyKindle.Watcher import IncrementalParser, FileWatcher
+from ClippyKindle import Exporters
+import marky
+
+def main():
+    # parse args:
+    parser = argparse.ArgumentParser(description='Watches a "My Clippings.txt" file (e.g. on a kindle that may not be plugged in yet) and whenever it changes, parses the new clippings, updates collection.json and re-creates the markdown/csv files of just the books that changed. (Combined files for settings groups are not updated, run marky.py for those.)')
+    parser.add_argument('file_name', type=str, help='(string) path to kindle clippings file e.g. "/media/Kindle/documents/My Clippings.txt"')
+    parser.add_argument('out_folder', type=str, help='(string) path of folder to output markdown and csv files (e.g. "./output")')
+    parser.add_argument('--collection-folder', type=str, default='.', help='(string) path of folder to output collection.json (default: \'.\')')
+    parser.add_argument('--settings', type=str, help='(string) path to json file containing settings for outputting books (see marky.py). New books are added to it (in --default-group).')
+    parser.add_argument('--default-group', type=str, default="both", help="(string) settings group to place new books in (default: 'both')")
+    parser.add_argument('--keep-dups', action="store_true", help="When this flag is provided, duplicate highlights/notes/bookmarks will not be detected/removed.")
+    parser.add_argument('--omit-notes', action="store_true", help="Omits the user's typed notes for each book in markdown output.")
+    parser.add_argument('--interval', type=float, default=2.0, help='(float) seconds between each check of the clippings file (default: 2)')
+    parser.add_argument('--debounce', type=float, default=5.0, help='(float) seconds the clippings file must be unchanged before syncing (default: 5)')
+    parser.add_argument('--once', action="store_true", help="Sync once (as soon as the file exists) and then exit.")
+
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        exit(1)
+    args = parser.parse_args()
+
+    settings = None
+    if args.settings != None and os.path.exists(args.settings):
+        with open(args.settings) as f:
+            settings = json.load(f)
+    groupNames = list(settings if settings != None else marky.getDefaultSettings())
+    if args.default_group not in groupNames:
+        # (checked at startup, as new books are placed in it whenever the file changes)
+        parser.error("--default-group '{}' isn't a settings group (existing groups: {})".format(args.default_group, groupNames))
+
+    if not os.path.isdir(args.out_folder):
+        os.mkdir(args.out_folder)
+
+    clippings = IncrementalParser(args.file_name)
+    watcher = FileWatcher(args.file_name, interval=args.interval, debounce=(0 if args.once else args.debounce))
+    bookDicts = {} # dict mapping book id -> dict representing the (sorted) book (see Book.toDict())
+    print("Watching '{}' (press Ctrl+C to stop)...".format(args.file_name))
+    try:
+        while True:
+            watcher.waitForChange()
+            settings = sync(args, clippings, bookDicts, settings)
+            if args.once:
+                break
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+
+def sync(args, clippings, bookDicts, settings):
+    """
+    parses any new clippings, then outputs the collection and the files of the books that changed
+    return (dict): updated settings
+    """
+    oldErrors, numErrors = clippings.errors, len(clippings.errors)
+    changed = clippings.update() # (every book is changed if the file was parsed from scratch)
+    print("\n[{}] {} book(s) changed".format(datetime.now().strftime("%H:%M:%S"), len(changed)))
+    for error in clippings.errors[numErrors if clippings.errors is oldErrors else 0:]:
+        print("{} (lines {} - {})".format(error["error"], error["lineStart"], error["lineEnd"]), file=sys.stderr)
+    if len(changed) == 0:
+        return settings
+
+    for book in changed:
+        book.sort(removeDups=(not args.keep_dups)) # (in place, so later syncs only sort in new items)
+        bookDicts[book.id] = book.toDict()
+    outPathJson = os.path.join(args.collection_folder, "collection.json")
+    with open(outPathJson, 'w') as f:
+        json.dump([bookDicts[book.id] for book in clippings.registry], f, indent=2)
+    print("updated: '{}'".format(outPathJson))
+
+    settings = marky.updateSettings([book.getName() for book in clippings.registry], settings,
+            useDefaults=True, defaultGroup=args.default_group)
+    if args.settings != None:
+        with open(args.settings, 'w') as f:
+            json.dump(settings, f, indent=2)
+
+    changedBooks = {book.getName(): book for book in changed}
+    writers = Exporters.getWriters(renderMarkdown=marky.jsonToMarkdown, omitNotes=args.omit_notes)
+    for groupName in settings:
+        formats = Exporters.getGroupFormats(settings[groupName])[0]
+        exporter = Exporters.Exporter(args.out_folder, writers, formats)
+        for bookSettings in settings[groupName]["books"]:
+            book = changedBooks.get(bookSettings["name"])
+            if book != None:
+                for path in exporter.exportBook(book, bookSettings["chapters"]):
+                    print("updated: '{}'".format(path))
+    return settings
+
+if __name__ == "__main__":
+    main()